@@ -0,0 +1,176 @@
+# amortizacion.py
+# Motor de amortización: genera los PagosFuturos de los préstamos aprobados.
+#
+# Los calendarios se calculan con NumPy para todo un lote de préstamos a la vez
+# (una matriz préstamos x cuotas) y se insertan con COPY.
+#
+# Métodos:
+#   "plano":   prestamo_total (ya incluye el interés, ver aprobar_prestamo)
+#              dividido en cuotas iguales.
+#   "frances": cuota fija sobre monto + IVA + cargos con tasa mensual
+#              porcentaje_interes / 12 (tasa anual). El total deja de ser el
+#              de aprobar_prestamo, así que programar_pagos guarda en
+#              prestamo_total la suma del calendario.
+# En ambos casos la última cuota absorbe el redondeo a centavos.
+from datetime import date
+from typing import Optional
+
+import numpy as np
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import bindparam, delete, select, update
+from sqlalchemy.orm import Session
+
+from . import auditoria, cache, catalogos, database, models, schemas
+
+router = APIRouter()
+
+METODOS = ("plano", "frances")
+TAMANO_LOTE = 10000
+
+
+def calcular_montos(principal: np.ndarray, tasa_mensual: np.ndarray, cuotas: np.ndarray, metodo: str = "plano"):
+    # Devuelve (montos, mascara) de forma (préstamos, max(cuotas)); las
+    # posiciones fuera del plazo de cada préstamo quedan en 0 y False
+    if metodo not in METODOS:
+        raise ValueError(f"Método de amortización no soportado: {metodo}")
+    cuotas = cuotas.astype(np.int64)
+    plazo = np.arange(1, cuotas.max() + 1)
+    mascara = plazo[None, :] <= cuotas[:, None]
+
+    if metodo == "frances":
+        with np.errstate(divide="ignore", invalid="ignore"):
+            anualidad = principal * tasa_mensual / (1 - (1 + tasa_mensual) ** -cuotas)
+        cuota = np.where(tasa_mensual > 0, anualidad, principal / cuotas)
+    else:
+        cuota = principal / cuotas
+
+    total = np.round(cuota * cuotas, 2)
+    cuota = np.round(cuota, 2)
+    montos = np.where(mascara, cuota[:, None], 0.0)
+    montos[np.arange(len(cuotas)), cuotas - 1] += total - cuota * cuotas
+    return np.round(montos, 2), mascara
+
+
+def calcular_fechas(fecha_inicio: date, cuotas_max: int) -> np.ndarray:
+    # Una fecha por mes a partir del mes siguiente a fecha_inicio, conservando
+    # el día y ajustándolo al último día en meses más cortos
+    meses = np.datetime64(fecha_inicio, "M") + np.arange(1, cuotas_max + 1)
+    dias_del_mes = ((meses + 1).astype("datetime64[D]") - meses.astype("datetime64[D]")).astype(np.int64)
+    return meses.astype("datetime64[D]") + (np.minimum(fecha_inicio.day, dias_del_mes) - 1)
+
+
+def generar_calendario(prestamos: dict, fecha_inicio: date, metodo: str = "plano"):
+    # `prestamos` es un dict de arreglos: prestamo_id, monto_solicitado,
+    # porcentaje_interes, cuotas_pactadas, prestamo_iva,
+    # prestamo_cargos_administrativos y prestamo_total.
+    # Devuelve arreglos planos (prestamo_id, fecha_pago, monto_pago).
+    cuotas = prestamos["cuotas_pactadas"]
+    if metodo == "frances":
+        principal = prestamos["monto_solicitado"] + prestamos["prestamo_iva"] + prestamos["prestamo_cargos_administrativos"]
+        tasa_mensual = prestamos["porcentaje_interes"] / 100 / 12
+    else:
+        principal = prestamos["prestamo_total"]
+        tasa_mensual = np.zeros_like(principal)
+
+    montos, mascara = calcular_montos(principal, tasa_mensual, cuotas, metodo)
+    fechas = np.broadcast_to(calcular_fechas(fecha_inicio, mascara.shape[1]), mascara.shape)
+    return np.repeat(prestamos["prestamo_id"], cuotas), fechas[mascara], montos[mascara]
+
+
+def _cargar_prestamos(db: Session, prestamo_ids: list) -> dict:
+    filas = db.execute(
+        select(
+            models.Prestamos.prestamo_id,
+            models.Prestamos.monto_solicitado,
+            models.Prestamos.porcentaje_interes,
+            models.Prestamos.cuotas_pactadas,
+            models.CargosAdmin.prestamo_iva,
+            models.CargosAdmin.prestamo_cargos_administrativos,
+            models.CargosAdmin.prestamo_total,
+        )
+        .join(models.CargosAdmin, models.CargosAdmin.prestamo_id == models.Prestamos.prestamo_id)
+        .where(models.Prestamos.prestamo_id.in_(prestamo_ids), models.Prestamos.cuotas_pactadas > 0)
+    ).all()
+    columnas = list(zip(*filas)) if filas else [()] * 7
+    return {
+        "prestamo_id": np.array(columnas[0], dtype=np.int64),
+        "monto_solicitado": np.array(columnas[1], dtype=np.float64),
+        "porcentaje_interes": np.nan_to_num(np.array(columnas[2], dtype=np.float64)),
+        "cuotas_pactadas": np.array(columnas[3], dtype=np.int64),
+        "prestamo_iva": np.nan_to_num(np.array(columnas[4], dtype=np.float64)),
+        "prestamo_cargos_administrativos": np.nan_to_num(np.array(columnas[5], dtype=np.float64)),
+        "prestamo_total": np.nan_to_num(np.array(columnas[6], dtype=np.float64)),
+    }
+
+
+def programar_pagos(db: Session, prestamo_ids: list, metodo: str = "plano", fecha_inicio: Optional[date] = None) -> int:
+    # Reemplaza las cuotas impagas de los préstamos por su calendario
+    # completo dentro de la transacción de `db`; devuelve cuántas cuotas creó
+    fecha_inicio = fecha_inicio or date.today()
+    creadas = 0
+    for i in range(0, len(prestamo_ids), TAMANO_LOTE):
+        lote = prestamo_ids[i:i + TAMANO_LOTE]
+        prestamos = _cargar_prestamos(db, lote)
+        db.execute(delete(models.PagosFuturos).where(
+            models.PagosFuturos.prestamo_id.in_(lote), models.PagosFuturos.estado.in_(models.CUOTAS_IMPAGAS)
+        ))
+        if len(prestamos["prestamo_id"]) == 0:
+            continue
+        ids, fechas, montos = generar_calendario(prestamos, fecha_inicio, metodo)
+        contenido = "".join(
+            f"{p},{f},{m:.2f},pendiente\n"
+            for p, f, m in zip(ids.tolist(), np.datetime_as_string(fechas).tolist(), montos.tolist())
+        )
+        database.copiar_csv(db, "pagos_futuros", ["prestamo_id", "fecha_pago", "monto_pago", "estado"], contenido)
+        if metodo == "frances":
+            # prestamo_total = suma de las cuotas de cada préstamo (contiguas en `montos`)
+            inicios = np.concatenate([[0], np.cumsum(prestamos["cuotas_pactadas"])[:-1]])
+            totales = np.round(np.add.reduceat(montos, inicios), 2)
+            cargos = models.CargosAdmin.__table__
+            db.execute(
+                update(cargos).where(cargos.c.prestamo_id == bindparam("b_prestamo_id")).values(prestamo_total=bindparam("total")),
+                [{"b_prestamo_id": p, "total": t} for p, t in zip(prestamos["prestamo_id"].tolist(), totales.tolist())],
+            )
+        creadas += len(ids)
+    return creadas
+
+
+@router.post("/prestamos/aprobar-lote")
+def aprobar_prestamos_lote(solicitud: schemas.AprobacionLote, db: Session = Depends(database.get_db)):
+    if solicitud.metodo not in METODOS:
+        raise HTTPException(status_code=400, detail=f"Método debe ser uno de {', '.join(METODOS)}")
+
+    # Solo se aprueban los préstamos pendientes; el resto se informa como omitido
+    aprobados = db.execute(
+        update(models.Prestamos)
+        .where(
+            models.Prestamos.prestamo_id.in_(solicitud.prestamo_ids),
+            models.Prestamos.prestamo_estatus_id == catalogos.estatus_id("pendiente"),
+        )
+        .values(prestamo_estatus_id=catalogos.estatus_id("aprobado"))
+        .returning(models.Prestamos.prestamo_id)
+    ).scalars().all()
+    auditoria.registrar(db, "prestamo", "prestamo_estatus_id", [
+        (prestamo_id, catalogos.estatus_id("pendiente"), catalogos.estatus_id("aprobado")) for prestamo_id in aprobados
+    ])
+
+    # Mismo total que aprobar_prestamo, calculado en la base de datos
+    prestamo = models.Prestamos.__table__
+    cargos = models.CargosAdmin.__table__
+    db.execute(
+        update(cargos)
+        .where(cargos.c.prestamo_id == prestamo.c.prestamo_id, prestamo.c.prestamo_id.in_(aprobados))
+        .values(prestamo_total=(
+            prestamo.c.monto_solicitado + cargos.c.prestamo_iva + cargos.c.prestamo_cargos_administrativos
+        ) * (1 + prestamo.c.porcentaje_interes / 100))
+    )
+    cuotas = programar_pagos(db, aprobados, solicitud.metodo, solicitud.fecha_inicio)
+    db.commit()
+    cache.invalidar_prestamos(*aprobados)
+
+    return {
+        "message": f"{len(aprobados)} préstamos aprobados",
+        "aprobados": aprobados,
+        "omitidos": sorted(set(solicitud.prestamo_ids) - set(aprobados)),
+        "cuotas_generadas": cuotas,
+    }
@@ -0,0 +1,76 @@
+# asincrono.py
+# Versiones async def de los endpoints para el modo DB_MODO=async.
+#
+# Cada endpoint que depende de database.get_db (o get_read_db) se envuelve en
+# un endpoint async def que recibe una AsyncSession y ejecuta la lógica del
+# handler con AsyncSession.run_sync: la E/S hacia Postgres pasa por asyncpg en el event
+# loop, así que ninguna petición ocupa un hilo del threadpool mientras espera
+# a la base de datos. La lógica de cada handler sigue viviendo en un solo lugar.
+import inspect
+from fastapi import APIRouter, Depends
+from fastapi.routing import APIRoute
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import database
+
+
+# Dependencia síncrona -> equivalente asíncrona (primaria o lectura)
+DEPENDENCIAS = {
+    database.get_db: database.get_async_db,
+    database.get_read_db: database.get_async_read_db,
+}
+
+
+def _parametro_db(firma: inspect.Signature):
+    for parametro in firma.parameters.values():
+        dependencia = getattr(parametro.default, "dependency", None)
+        if dependencia in DEPENDENCIAS:
+            return parametro.name, DEPENDENCIAS[dependencia]
+    return None, None
+
+
+def version_async(endpoint):
+    firma = inspect.signature(endpoint)
+    nombre_db, dependencia = _parametro_db(firma)
+    if nombre_db is None:
+        # Endpoints sin sesión (o que abren la suya) se dejan tal cual
+        return endpoint
+
+    async def endpoint_async(**kwargs):
+        db = kwargs.pop(nombre_db)
+        return await db.run_sync(lambda sesion: endpoint(**kwargs, **{nombre_db: sesion}))
+
+    parametros = [
+        p.replace(default=Depends(dependencia), annotation=AsyncSession) if p.name == nombre_db else p
+        for p in firma.parameters.values()
+    ]
+    endpoint_async.__signature__ = firma.replace(parameters=parametros)
+    endpoint_async.__name__ = endpoint.__name__
+    endpoint_async.__doc__ = endpoint.__doc__
+    return endpoint_async
+
+
+# Atributos de APIRoute que add_api_route recibe con el mismo nombre; todos
+# pasan a la versión async para que la ruta y su OpenAPI no cambien
+ATRIBUTOS_RUTA = (
+    "response_model", "status_code", "tags", "dependencies", "summary", "description",
+    "response_description", "responses", "deprecated", "operation_id", "response_model_include",
+    "response_model_exclude", "response_model_by_alias", "response_model_exclude_unset",
+    "response_model_exclude_defaults", "response_model_exclude_none", "include_in_schema",
+    "response_class", "name", "callbacks", "openapi_extra", "generate_unique_id_function",
+)
+
+
+def convertir_router(router: APIRouter) -> APIRouter:
+    router_async = APIRouter()
+    for ruta in router.routes:
+        if not isinstance(ruta, APIRoute):
+            router_async.routes.append(ruta)
+            continue
+        router_async.add_api_route(
+            ruta.path,
+            version_async(ruta.endpoint),
+            methods=list(ruta.methods),
+            route_class_override=type(ruta),
+            **{atributo: getattr(ruta, atributo) for atributo in ATRIBUTOS_RUTA},
+        )
+    return router_async
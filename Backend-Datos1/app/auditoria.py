@@ -0,0 +1,331 @@
+# auditoria.py
+# Historial de cambios de estado de préstamos (prestamo_estatus_id) y pagos
+# (estado): quién, cuándo, valor anterior y valor nuevo.
+#
+# Quien cambia un estado llama a registrar(db, ...) y el evento se guarda en
+# db.info hasta el commit de la transacción externa: un cambio revertido no se
+# audita, tampoco el de un SAVEPOINT revertido. Según AUDITORIA_MODO:
+#
+#   lote (por defecto)  después del commit los eventos pasan a una cola en
+#       memoria y un hilo los escribe con COPY en lotes de hasta AUDITORIA_LOTE
+#       eventos, o los que haya cada AUDITORIA_INTERVALO segundos. La petición
+#       no espera a la base de datos; si el proceso termina de forma abrupta se
+#       pierden los eventos que estaban en la cola (al apagar se vacía).
+#   sincrono  los eventos se escriben antes del commit, en la misma
+#       transacción del cambio: se guardan los dos o ninguno.
+#
+# La cola tiene AUDITORIA_COLA lugares. Si está llena, los eventos que no caben
+# pasan a un segundo hilo que los escribe directamente en lugar de
+# descartarlos; quien registra nunca espera (se encola desde el hook de
+# commit, que en DB_MODO=async corre en el event loop).
+#
+# Quién: encabezado X-Usuario de la petición (MiddlewareAuditoria). Origen: la
+# ruta de la petición, o el proceso de fondo que hizo el cambio (ver origen()).
+import atexit
+import csv
+import io
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import date, datetime, timedelta
+from typing import Iterable, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import event, select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from . import database, metricas, models, schemas
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+MODO = os.getenv("AUDITORIA_MODO", "lote")
+TAMANO_COLA = int(os.getenv("AUDITORIA_COLA", "10000"))
+TAMANO_LOTE = int(os.getenv("AUDITORIA_LOTE", "500"))
+INTERVALO = float(os.getenv("AUDITORIA_INTERVALO", "1"))
+REINTENTO_MAXIMO = 30.0
+ENTIDADES = ("prestamo", "pago")
+
+if MODO not in ("lote", "sincrono"):
+    raise ValueError("AUDITORIA_MODO debe ser 'lote' o 'sincrono'")
+
+auditoria = models.AuditoriaEstado.__table__
+COLUMNAS = [
+    "entidad", "entidad_id", "campo", "valor_anterior", "valor_nuevo", "usuario", "origen", "registrado_en",
+]
+
+# Scope ASGI de la petición en curso, o nombre del proceso de fondo
+_contexto = ContextVar("auditoria_contexto", default=None)
+
+
+class MiddlewareAuditoria:
+    # Middleware ASGI puro, como metricas.MiddlewareMetricas
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = _contexto.set(scope)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _contexto.reset(token)
+
+
+@contextmanager
+def origen(nombre: str):
+    # Origen de los cambios hechos fuera de una petición (programador, CLI)
+    token = _contexto.set(nombre) if _contexto.get() is None else None
+    try:
+        yield
+    finally:
+        if token is not None:
+            _contexto.reset(token)
+
+
+def _quien() -> tuple:
+    contexto = _contexto.get()
+    if isinstance(contexto, dict):
+        # La ruta ya está resuelta cuando corre el endpoint
+        usuario = dict(contexto.get("headers") or ()).get(b"x-usuario")
+        ruta = f"{contexto['method']} {metricas.plantilla_ruta(contexto)}"
+        return (usuario.decode("latin-1")[:100] if usuario else None), ruta[:200]
+    return None, contexto
+
+
+def _texto(valor) -> Optional[str]:
+    return None if valor is None else str(valor)
+
+
+def registrar(db: Session, entidad: str, campo: str, cambios: Iterable[tuple]):
+    # cambios: (id, valor anterior, valor nuevo); los que no cambian se omiten
+    usuario, ruta = _quien()
+    ahora = datetime.now()
+    eventos = db.info.setdefault("auditoria", [])
+    for entidad_id, anterior, nuevo in cambios:
+        anterior, nuevo = _texto(anterior), _texto(nuevo)
+        if anterior != nuevo:
+            eventos.append((entidad, entidad_id, campo, anterior, nuevo, usuario, ruta, ahora))
+
+
+def _copiar(db: Session, eventos: list):
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    for evento in eventos:
+        escritor.writerow(["\\N" if valor is None else valor for valor in evento])
+    database.copiar_csv(db, auditoria.name, COLUMNAS, buffer.getvalue())
+
+
+def _escribir(eventos: list):
+    with database.SessionLocal() as db:
+        _copiar(db, eventos)
+        db.commit()
+
+
+class Escritor:
+    # Cola acotada y el hilo que la escribe por lotes (se inicia con el primer evento)
+    def __init__(self, tamano_cola: int = TAMANO_COLA, tamano_lote: int = TAMANO_LOTE, intervalo: float = INTERVALO):
+        self.cola = queue.Queue(maxsize=tamano_cola)
+        self.tamano_lote = tamano_lote
+        self.intervalo = intervalo
+        self._hilo = None
+        self._desborde = None
+        self._lock = threading.Lock()
+        self._fin = object()
+        self.escritos = 0
+        self.lotes = 0
+        self.desbordes = 0
+        self.directos = 0
+        self.perdidos = 0
+        self.errores = 0
+
+    def encolar(self, eventos: list):
+        desborde = self._iniciar()
+        for i, evento in enumerate(eventos):
+            try:
+                self.cola.put_nowait(evento)
+            except queue.Full:
+                self.desbordes += 1
+                desborde.submit(self._escribir_directo, eventos[i:])
+                return
+
+    def _escribir_directo(self, eventos: list):
+        # Eventos que no cupieron en la cola, en el hilo de desborde. El
+        # cambio ya tiene commit, así que un error aquí no se propaga.
+        try:
+            _escribir(eventos)
+            self.directos += len(eventos)
+        except SQLAlchemyError:
+            self.perdidos += len(eventos)
+            logger.exception("No se pudieron escribir %s eventos de auditoría", len(eventos))
+
+    def _iniciar(self) -> ThreadPoolExecutor:
+        desborde = self._desborde
+        if desborde is not None:
+            return desborde
+        with self._lock:
+            if self._desborde is None:
+                self._hilo = threading.Thread(target=self._ciclo, name="auditoria", daemon=True)
+                self._hilo.start()
+                self._desborde = ThreadPoolExecutor(max_workers=1, thread_name_prefix="auditoria-desborde")
+            return self._desborde
+
+    def _siguiente_lote(self) -> tuple:
+        # Espera el primer evento y junta los que lleguen durante `intervalo`
+        lote = []
+        primero = self.cola.get()
+        if primero is self._fin:
+            return lote, True
+        lote.append(primero)
+        limite = time.monotonic() + self.intervalo
+        while len(lote) < self.tamano_lote:
+            restante = limite - time.monotonic()
+            try:
+                evento = self.cola.get(timeout=restante) if restante > 0 else self.cola.get_nowait()
+            except queue.Empty:
+                break
+            if evento is self._fin:
+                return lote, True
+            lote.append(evento)
+        return lote, False
+
+    def _ciclo(self):
+        terminar = False
+        while not terminar:
+            lote, terminar = self._siguiente_lote()
+            espera = self.intervalo
+            while lote:
+                try:
+                    _escribir(lote)
+                    self.escritos += len(lote)
+                    self.lotes += 1
+                    lote = []
+                except SQLAlchemyError:
+                    # Se reintenta el mismo lote; mientras tanto la cola se
+                    # llena y lo demás va al hilo de desborde
+                    self.errores += 1
+                    logger.exception("No se pudo escribir un lote de %s eventos de auditoría", len(lote))
+                    if terminar:
+                        self.perdidos += len(lote)
+                        break
+                    time.sleep(espera)
+                    espera = min(espera * 2, REINTENTO_MAXIMO)
+
+    def detener(self, espera: float = 30):
+        # Escribe lo que quede en la cola y termina el hilo
+        with self._lock:
+            hilo, self._hilo = self._hilo, None
+            desborde, self._desborde = self._desborde, None
+        if hilo is not None:
+            self.cola.put(self._fin)
+            hilo.join(espera)
+        if desborde is not None:
+            desborde.shutdown(wait=True)
+
+    def estadisticas(self) -> dict:
+        return {
+            "modo": MODO,
+            "en_cola": self.cola.qsize(),
+            "capacidad": self.cola.maxsize,
+            "escritos": self.escritos,
+            "lotes": self.lotes,
+            "desbordes": self.desbordes,
+            "directos": self.directos,
+            "perdidos": self.perdidos,
+            "errores": self.errores,
+        }
+
+
+escritor = Escritor()
+# Procesos sin lifespan (CLI): la cola se vacía al salir
+atexit.register(escritor.detener)
+
+
+# Los hooks de commit y rollback también corren al liberar o revertir un
+# SAVEPOINT (begin_nested): solo marcan el resultado y la decisión se toma en
+# after_transaction_end. Al abrir un SAVEPOINT se guarda cuántos eventos había
+# para descartar solo los suyos si se revierte.
+
+@event.listens_for(Session, "before_commit")
+def _escribir_en_transaccion(db):
+    if MODO == "sincrono" and not db.in_nested_transaction() and db.info.get("auditoria"):
+        _copiar(db, db.info.pop("auditoria"))
+
+
+@event.listens_for(Session, "after_transaction_create")
+def _marcar_savepoint(db, transaccion):
+    if transaccion.nested:
+        db.info.setdefault("auditoria_savepoints", {})[transaccion] = len(db.info.get("auditoria", ()))
+
+
+@event.listens_for(Session, "after_commit")
+def _confirmada(db):
+    db.info["auditoria_confirmada"] = True
+
+
+@event.listens_for(Session, "after_rollback")
+def _revertida(db):
+    db.info["auditoria_confirmada"] = False
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _encolar_tras_commit(db, transaccion):
+    confirmada = db.info.pop("auditoria_confirmada", False)
+    if transaccion.parent is not None:
+        inicio = db.info.get("auditoria_savepoints", {}).pop(transaccion, None)
+        if transaccion.nested and not confirmada and inicio is not None:
+            del db.info.get("auditoria", [])[inicio:]
+        return
+    db.info.pop("auditoria_savepoints", None)
+    eventos = db.info.pop("auditoria", None)
+    if confirmada and eventos:
+        escritor.encolar(eventos)
+
+
+# --- API -------------------------------------------------------------------------
+
+@router.get("/auditoria", response_model=schemas.AuditoriaPagina)
+def historial_auditoria(
+    entidad: Optional[str] = Query(None, pattern=f"^({'|'.join(ENTIDADES)})$"),
+    entidad_id: Optional[int] = None,
+    usuario: Optional[str] = None,
+    desde: Optional[date] = None,
+    hasta: Optional[date] = None,
+    antes_de: Optional[int] = None,
+    limite: int = Query(100, ge=1, le=1000),
+    db: Session = Depends(database.get_read_db),
+):
+    # Del más reciente al más antiguo, paginado por auditoria_id
+    if entidad_id is not None and entidad is None:
+        raise HTTPException(status_code=400, detail="entidad_id necesita entidad")
+    consulta = select(auditoria).order_by(auditoria.c.auditoria_id.desc()).limit(limite)
+    if entidad is not None:
+        consulta = consulta.where(auditoria.c.entidad == entidad)
+    if entidad_id is not None:
+        consulta = consulta.where(auditoria.c.entidad_id == entidad_id)
+    if usuario is not None:
+        consulta = consulta.where(auditoria.c.usuario == usuario)
+    if desde is not None:
+        consulta = consulta.where(auditoria.c.registrado_en >= desde)
+    if hasta is not None:
+        consulta = consulta.where(auditoria.c.registrado_en < hasta + timedelta(days=1))
+    if antes_de is not None:
+        consulta = consulta.where(auditoria.c.auditoria_id < antes_de)
+    eventos = db.execute(consulta).mappings().all()
+    return {
+        "items": eventos,
+        "siguiente": eventos[-1]["auditoria_id"] if len(eventos) == limite else None,
+    }
+
+
+@router.get("/auditoria/cola")
+def estado_cola():
+    return escritor.estadisticas()
@@ -0,0 +1,108 @@
+# busqueda.py
+# Búsqueda de clientes para ventanilla: GET /usuarios/buscar?q=...
+#
+# q se normaliza como en la base de datos (minúsculas y sin tildes, ver
+# models.py) y se busca a la vez:
+#
+#   - como prefijo de cui o codigo_cliente (índices text_pattern_ops)
+#   - en el nombre completo: cada palabra de q aparece dentro del nombre, o q
+#     se parece a una parte del nombre aunque tenga errores de escritura
+#     (word_similarity). Ambas usan el índice de trigramas de pg_trgm.
+#
+# Si q tiene dígitos solo se busca en cui y codigo_cliente. El rango ordena
+# primero cui/código exactos, luego por prefijo y después por similitud del
+# nombre. Sin pg_trgm solo se buscan fragmentos exactos del nombre, sin
+# índice; cui y código no cambian.
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import and_, case, func, literal, or_, select, text
+from sqlalchemy.orm import Session
+
+from . import database, models, schemas
+
+router = APIRouter()
+
+MIN_CARACTERES = 3
+
+usuarios = models.User.__table__
+_sin_acentos = str.maketrans(models.ACENTOS, models.SIN_ACENTOS)
+_trigramas = None  # Si la base tiene pg_trgm; se consulta una vez
+
+COLUMNAS_NOMBRE = [
+    usuarios.c.primer_nombre, usuarios.c.segundo_nombre, usuarios.c.tercer_nombre,
+    usuarios.c.primer_apellido, usuarios.c.segundo_apellido, usuarios.c.apellido_casada,
+]
+
+
+def normalizar(texto: str) -> str:
+    # Como normalizar_busqueda() en la base de datos, con un solo espacio entre palabras
+    return " ".join(texto.lower().translate(_sin_acentos).split())
+
+
+def _hay_trigramas(db: Session) -> bool:
+    global _trigramas
+    if _trigramas is None:
+        _trigramas = db.execute(text("SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm')")).scalar()
+    return _trigramas
+
+
+def _escapar_like(texto: str) -> str:
+    return texto.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def buscar(db: Session, q: str, limite: int = 20, desplazamiento: int = 0) -> dict:
+    q = normalizar(q)
+    if len(q) < MIN_CARACTERES:
+        raise HTTPException(status_code=400, detail=f"La búsqueda necesita al menos {MIN_CARACTERES} caracteres")
+
+    nombre = func.usuarios_nombre_busqueda(*COLUMNAS_NOMBRE)
+    claves = [func.normalizar_busqueda(usuarios.c.cui), func.normalizar_busqueda(usuarios.c.codigo_cliente)]
+    # Prefijo como rango [q, q + 1) con los operadores de text_pattern_ops: a
+    # diferencia de LIKE 'q%' usa el índice también con planes genéricos
+    # (sentencias preparadas de asyncpg)
+    hasta = q[:-1] + chr(ord(q[-1]) + 1)
+    exacto = or_(*(clave == q for clave in claves))
+    prefijo = or_(*(and_(clave.op("~>=~")(q), clave.op("~<~")(hasta)) for clave in claves))
+    fragmentos = and_(*(nombre.like(f"%{_escapar_like(palabra)}%") for palabra in q.split()))
+
+    if any(c.isdigit() for c in q):
+        # Los nombres no llevan dígitos: es un cui o un código de cliente
+        coincide, similitud, desempate = prefijo, literal(0.0), usuarios.c.usuario_id
+    elif _hay_trigramas(db):
+        coincide = or_(prefijo, fragmentos, literal(q).op("<%")(nombre))
+        similitud = func.word_similarity(q, nombre)
+        desempate = func.similarity(q, nombre).desc()
+    else:
+        coincide = or_(prefijo, fragmentos)
+        similitud = case((nombre.like(f"{_escapar_like(q)}%"), 0.9), else_=0.5)
+        desempate = func.length(nombre)
+    rango = case((exacto, 3.0), (prefijo, 2.0), else_=similitud).label("rango")
+
+    filas = db.execute(
+        select(
+            usuarios.c.usuario_id,
+            usuarios.c.codigo_cliente,
+            usuarios.c.cui,
+            func.concat_ws(" ", *COLUMNAS_NOMBRE).label("nombre_completo"),
+            rango,
+        )
+        .where(coincide)
+        .order_by(rango.desc(), desempate, usuarios.c.usuario_id)
+        .offset(desplazamiento)
+        .limit(limite)
+    ).mappings().all()
+    return {
+        "items": filas,
+        "siguiente": desplazamiento + limite if len(filas) == limite else None,
+    }
+
+
+# --- API -------------------------------------------------------------------------
+
+@router.get("/buscar", response_model=schemas.BusquedaClientes)
+def buscar_clientes(
+    q: str = Query(..., min_length=MIN_CARACTERES, max_length=100),
+    limite: int = Query(20, ge=1, le=100),
+    desplazamiento: int = Query(0, ge=0, le=1000),
+    db: Session = Depends(database.get_read_db),
+):
+    return buscar(db, q, limite, desplazamiento)
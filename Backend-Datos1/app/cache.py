@@ -0,0 +1,88 @@
+# cache.py
+# Caché en memoria de respuestas por préstamo.
+#
+# Las entradas se guardan por prestamo_id; los endpoints que modifican un
+# préstamo o sus pagos llaman a invalidar_prestamos(...) después del commit y
+# cada caché registrada descarta las entradas de esos préstamos.
+#
+# La caché es por proceso: con varios workers de uvicorn una invalidación solo
+# llega al worker que atendió la escritura, por eso las entradas vencen además
+# a los CACHE_PRESTAMOS_TTL segundos (30 por defecto).
+import os
+import threading
+import time
+from collections import OrderedDict
+
+TTL = float(os.getenv("CACHE_PRESTAMOS_TTL", "30"))
+MAXIMO = int(os.getenv("CACHE_PRESTAMOS_MAXIMO", "10000"))
+
+_registradas = []
+
+
+class CachePrestamos:
+    def __init__(self, nombre: str, ttl: float = TTL, maximo: int = MAXIMO):
+        self.nombre = nombre
+        self.ttl = ttl
+        self.maximo = maximo
+        self.aciertos = 0
+        self.fallos = 0
+        self._entradas = OrderedDict()  # prestamo_id -> (vence, valor)
+        self._claves = {}  # clave alterna (p. ej. codigo_prestamo) -> prestamo_id
+        self._generacion = 0
+        self._lock = threading.Lock()
+        _registradas.append(self)
+
+    def generacion(self) -> int:
+        # Tomarla antes de consultar la base de datos y pasarla a guardar():
+        # si hubo una invalidación entre medio el valor leído puede ser viejo
+        return self._generacion
+
+    def obtener(self, prestamo_id=None, clave=None):
+        with self._lock:
+            if prestamo_id is None:
+                prestamo_id = self._claves.get(clave)
+            entrada = self._entradas.get(prestamo_id)
+            if entrada is None or entrada[0] < time.monotonic():
+                self.fallos += 1
+                return None
+            self._entradas.move_to_end(prestamo_id)
+            self.aciertos += 1
+            return entrada[1]
+
+    def guardar(self, prestamo_id: int, valor, generacion: int, clave=None):
+        with self._lock:
+            if generacion != self._generacion:
+                return
+            self._entradas[prestamo_id] = (time.monotonic() + self.ttl, valor)
+            self._entradas.move_to_end(prestamo_id)
+            if clave is not None:
+                self._claves[clave] = prestamo_id
+            while len(self._entradas) > self.maximo:
+                self._entradas.popitem(last=False)
+            if len(self._claves) > 2 * self.maximo:
+                self._claves = {c: p for c, p in self._claves.items() if p in self._entradas}
+
+    def invalidar(self, prestamo_ids):
+        with self._lock:
+            self._generacion += 1
+            for prestamo_id in prestamo_ids:
+                self._entradas.pop(prestamo_id, None)
+
+    def limpiar(self):
+        with self._lock:
+            self._generacion += 1
+            self._entradas.clear()
+            self._claves.clear()
+
+    def estadisticas(self) -> dict:
+        return {"entradas": len(self._entradas), "aciertos": self.aciertos, "fallos": self.fallos}
+
+
+def invalidar_prestamos(*prestamo_ids):
+    for cache in _registradas:
+        cache.invalidar(prestamo_ids)
+
+
+def limpiar_todo():
+    for cache in _registradas:
+        cache.limpiar()
@@ -0,0 +1,313 @@
+# carga_masiva.py
+# Importación masiva de solicitudes de préstamo (NDJSON o CSV).
+#
+# Las filas se leen como flujo y se procesan por lotes: cada lote se valida con
+# schemas.ClienteSolicitud, resuelve ocupaciones y usuarios existentes con una
+# consulta por lote y carga usuarios, direcciones, referencias, préstamos y
+# cargos administrativos con COPY. Si el lote choca con datos existentes se
+# reintenta fila por fila con crud.crear_solicitud para aislar los errores.
+#
+#   python -m app.carga_masiva solicitudes.ndjson
+#   python -m app.carga_masiva solicitudes.csv --formato csv --lote 2000
+import argparse
+import csv
+import io
+import json
+import sys
+from itertools import islice
+from typing import Iterable, Iterator
+
+from anyio import from_thread
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from pydantic import ValidationError
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import DataError, IntegrityError
+from sqlalchemy.orm import Session
+
+from . import catalogos, crud, database, models, schemas
+
+router = APIRouter()
+
+TAMANO_LOTE = 1000
+MAX_TAMANO_LOTE = 20000
+MAX_ERRORES_RESPUESTA = 1000
+
+COLUMNAS_USUARIO = [
+    "usuario_id", "codigo_cliente", "rol_id", "genero", "cui", "fecha_nacimiento", "estado_civil",
+    "nacionalidad", "primer_nombre", "segundo_nombre", "tercer_nombre", "primer_apellido",
+    "segundo_apellido", "apellido_casada", "ocupaciones_id",
+]
+COLUMNAS_REFERENCIA = ["usuario_id", "orden", *schemas.ReferenciaBase.model_fields]
+
+
+# --- Lectura de filas ---------------------------------------------------------
+
+def _anidar(plano: dict) -> dict:
+    # "direccion.vecindad" -> {"direccion": {"vecindad": ...}}; vacíos se omiten
+    anidado = {}
+    for clave, valor in plano.items():
+        if valor is None or valor == "":
+            continue
+        *ruta, hoja = clave.split(".")
+        destino = anidado
+        for parte in ruta:
+            destino = destino.setdefault(parte, {})
+        destino[hoja] = valor
+    return anidado
+
+
+def leer_filas(lineas: Iterable[str], formato: str) -> Iterator[tuple]:
+    # Devuelve (numero_de_fila, dict) sin cargar el archivo completo
+    if formato == "csv":
+        for n, fila in enumerate(csv.DictReader(lineas), start=1):
+            yield n, _anidar(fila)
+    elif formato == "ndjson":
+        for n, linea in enumerate(lineas, start=1):
+            if not linea.strip():
+                continue
+            try:
+                yield n, json.loads(linea)
+            except json.JSONDecodeError as e:
+                yield n, e
+    else:
+        raise ValueError(f"Formato no soportado: {formato}")
+
+
+# --- Carga de un lote -----------------------------------------------------------
+
+# Mensajes de error por fila; también los usan conciliacion.py y recepcion.py
+
+def mensaje_validacion(error: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(map(str, e['loc']))}: {e['msg']}" for e in error.errors())
+
+
+def mensaje_bd(error) -> str:
+    return str(getattr(error, "orig", error)).strip().splitlines()[0]
+
+
+def _reservar_ids(db: Session, tabla: str, columna: str, cantidad: int) -> list:
+    # Reserva `cantidad` valores de la secuencia serial en una sola consulta
+    if cantidad == 0:
+        return []
+    secuencia = func.pg_get_serial_sequence(tabla, columna)
+    return list(db.execute(select(func.nextval(secuencia)).select_from(func.generate_series(1, cantidad))).scalars())
+
+
+def _copiar(db: Session, tabla: str, columnas: list, filas: list):
+    if not filas:
+        return
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    for fila in filas:
+        # None se marca como \N para distinguirlo de la cadena vacía
+        escritor.writerow(["\\N" if valor is None else valor for valor in fila])
+    database.copiar_csv(db, tabla, columnas, buffer.getvalue())
+
+
+def _insertar_lote(db: Session, clientes: list) -> list:
+    # Carga set-based del lote; devuelve los índices de `clientes` rechazados
+    # por conflicto de codigo_cliente antes de escribir nada
+
+    # 1. Ocupaciones: las conocidas salen del catálogo; las nuevas con un
+    # upsert de los nombres del lote y un solo SELECT de ids
+    ocupaciones = {}
+    for nombre in {c.ocupacion for c in clientes}:
+        ocupaciones[nombre] = catalogos.id_por_nombre("ocupaciones", nombre)
+    nombres = [nombre for nombre, ocupacion_id in ocupaciones.items() if ocupacion_id is None]
+    if nombres:
+        db.execute(
+            pg_insert(models.Ocupaciones).on_conflict_do_nothing(index_elements=["nombre_ocupacion"]),
+            [{"nombre_ocupacion": nombre} for nombre in nombres],
+        )
+        ocupaciones.update(db.execute(
+            select(models.Ocupaciones.nombre_ocupacion, models.Ocupaciones.ocupacion_id)
+            .where(models.Ocupaciones.nombre_ocupacion.in_(nombres))
+        ).all())
+        catalogos.marcar_cambio(db)
+
+    # 2. Usuarios existentes por CUI y códigos de cliente ya ocupados
+    cuis = {c.cui for c in clientes}
+    usuarios = dict(db.execute(
+        select(models.User.cui, models.User.usuario_id).where(models.User.cui.in_(cuis))
+    ).all())
+    nuevos = {}
+    for c in clientes:
+        if c.cui not in usuarios:
+            nuevos.setdefault(c.cui, c)
+    codigos = {f"U-{cui[-4:]}" for cui in nuevos}
+    ocupados = set(db.execute(
+        select(models.User.codigo_cliente).where(models.User.codigo_cliente.in_(codigos))
+    ).scalars())
+
+    rechazados_cui = set()
+    for cui in list(nuevos):
+        codigo = f"U-{cui[-4:]}"
+        if codigo in ocupados:
+            rechazados_cui.add(cui)
+            del nuevos[cui]
+        else:
+            ocupados.add(codigo)
+
+    filas_usuario = []
+    rol_cliente = catalogos.rol_id("cliente")
+    for usuario_id, c in zip(_reservar_ids(db, "usuarios", "usuario_id", len(nuevos)), nuevos.values()):
+        usuarios[c.cui] = usuario_id
+        filas_usuario.append([
+            usuario_id, f"U-{c.cui[-4:]}", rol_cliente, c.genero, c.cui, c.fecha_nacimiento, c.estado_civil,
+            c.nacionalidad, c.primer_nombre, c.segundo_nombre, c.tercer_nombre, c.primer_apellido,
+            c.segundo_apellido, c.apellido_casada, ocupaciones[c.ocupacion],
+        ])
+
+    # 3. Préstamos con ids reservados para enlazar cargos sin RETURNING
+    aceptados = [(i, c) for i, c in enumerate(clientes) if c.cui not in rechazados_cui]
+    prestamo_ids = _reservar_ids(db, "prestamo", "prestamo_id", len(aceptados))
+    bases = {crud.codigo_prestamo_base(usuarios[c.cui], c.monto_prestamo) for _, c in aceptados}
+    codigos_prestamo = set(db.execute(
+        select(models.Prestamos.codigo_prestamo).where(models.Prestamos.codigo_prestamo.in_(bases))
+    ).scalars())
+    pendiente = catalogos.estatus_id("pendiente")
+    filas_direccion, filas_referencia, filas_prestamo, filas_cargo = [], [], [], []
+    for prestamo_id, (_, c) in zip(prestamo_ids, aceptados):
+        usuario_id = usuarios[c.cui]
+        codigo_prestamo = crud.codigo_prestamo_base(usuario_id, c.monto_prestamo)
+        if codigo_prestamo in codigos_prestamo:
+            codigo_prestamo = f"{codigo_prestamo}-{prestamo_id}"
+        codigos_prestamo.add(codigo_prestamo)
+        filas_direccion.append([
+            usuario_id, c.direccion.depto_nacimiento, c.direccion.muni_nacimiento, c.direccion.vecindad,
+        ])
+        filas_referencia.extend(
+            [fila[col] for col in COLUMNAS_REFERENCIA] for fila in crud._filas_referencias(usuario_id, c.referencias)
+        )
+        filas_prestamo.append([
+            prestamo_id, usuario_id, codigo_prestamo, c.motivo_prestamo,
+            pendiente, c.monto_prestamo, c.cuotas_pactadas, 0.0,
+        ])
+        filas_cargo.append([prestamo_id, 0.0, 0.0, 0.0])
+
+    _copiar(db, "usuarios", COLUMNAS_USUARIO, filas_usuario)
+    _copiar(db, "direccion_usuario", ["usuario_id", "depto_nacimiento", "muni_nacimiento", "vecindad"], filas_direccion)
+    _copiar(db, "referencias", COLUMNAS_REFERENCIA, filas_referencia)
+    _copiar(db, "prestamo", [
+        "prestamo_id", "usuario_id", "codigo_prestamo", "motivo_prestamo", "prestamo_estatus_id",
+        "monto_solicitado", "cuotas_pactadas", "porcentaje_interes",
+    ], filas_prestamo)
+    _copiar(db, "cargos_administrativos", [
+        "prestamo_id", "prestamo_iva", "prestamo_cargos_administrativos", "prestamo_total",
+    ], filas_cargo)
+
+    return [i for i, c in enumerate(clientes) if c.cui in rechazados_cui]
+
+
+def procesar_lote(db: Session, filas: list) -> dict:
+    # Procesa una lista de (numero_de_fila, datos) y confirma lo que se pudo crear
+    errores = []
+    validas = []
+    for n, datos in filas:
+        if isinstance(datos, Exception):
+            errores.append({"fila": n, "error": f"JSON inválido: {datos}"})
+            continue
+        try:
+            validas.append((n, schemas.ClienteSolicitud.model_validate(datos)))
+        except ValidationError as e:
+            errores.append({"fila": n, "error": mensaje_validacion(e)})
+
+    creadas = 0
+    if validas:
+        try:
+            with db.begin_nested():
+                rechazados = _insertar_lote(db, [c for _, c in validas])
+            creadas = len(validas) - len(rechazados)
+            for i in rechazados:
+                errores.append({"fila": validas[i][0], "error": "El código de cliente ya está en uso"})
+        except (IntegrityError, DataError):
+            # El lote chocó con datos existentes: reintentar fila por fila
+            for n, cliente in validas:
+                try:
+                    with db.begin_nested():
+                        crud.crear_solicitud(db, cliente)
+                    creadas += 1
+                except (IntegrityError, DataError) as e:
+                    errores.append({"fila": n, "error": mensaje_bd(e)})
+        db.commit()
+
+    errores.sort(key=lambda e: e["fila"])
+    return {"procesadas": len(filas), "creadas": creadas, "errores": errores}
+
+
+def importar(lineas: Iterable[str], formato: str = "ndjson", tamano_lote: int = TAMANO_LOTE) -> Iterator[dict]:
+    # Genera el resultado de cada lote; la memoria depende solo de tamano_lote
+    filas = leer_filas(lineas, formato)
+    with database.SessionLocal() as db:
+        while lote := list(islice(filas, tamano_lote)):
+            yield procesar_lote(db, lote)
+
+
+def resumir(resultados: Iterable[dict], max_errores: int = MAX_ERRORES_RESPUESTA) -> dict:
+    resumen = {"procesadas": 0, "creadas": 0, "total_errores": 0, "errores": []}
+    for resultado in resultados:
+        resumen["procesadas"] += resultado["procesadas"]
+        resumen["creadas"] += resultado["creadas"]
+        resumen["total_errores"] += len(resultado["errores"])
+        espacio = max_errores - len(resumen["errores"])
+        resumen["errores"].extend(resultado["errores"][:max(espacio, 0)])
+    return resumen
+
+
+# --- API -------------------------------------------------------------------------
+
+def lineas_del_cuerpo(request: Request) -> Iterator[str]:
+    # Lee el cuerpo de la petición por bloques; se consume desde el hilo de
+    # trabajo (run_in_threadpool)
+    cuerpo = request.stream().__aiter__()
+    pendiente = b""
+    while True:
+        try:
+            bloque = from_thread.run(cuerpo.__anext__)
+        except StopAsyncIteration:
+            break
+        pendiente += bloque
+        *completas, pendiente = pendiente.split(b"\n")
+        for linea in completas:
+            yield linea.decode("utf-8") + "\n"
+    if pendiente:
+        yield pendiente.decode("utf-8")
+
+
+@router.post("/prestamos/solicitudes/importar")
+async def importar_solicitudes(
+    request: Request, formato: str = "ndjson", tamano_lote: int = Query(TAMANO_LOTE, ge=1, le=MAX_TAMANO_LOTE),
+):
+    if formato not in ("ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="Formato debe ser 'ndjson' o 'csv'")
+
+    lineas = lineas_del_cuerpo(request)
+    return await run_in_threadpool(lambda: resumir(importar(lineas, formato, tamano_lote)))
+
+
+# --- CLI -------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Importación masiva de solicitudes de préstamo")
+    parser.add_argument("archivo", help="Archivo NDJSON o CSV ('-' para stdin)")
+    parser.add_argument("--formato", choices=["ndjson", "csv"], default=None)
+    parser.add_argument("--lote", type=int, default=TAMANO_LOTE)
+    args = parser.parse_args()
+
+    formato = args.formato or ("csv" if args.archivo.endswith(".csv") else "ndjson")
+    entrada = sys.stdin if args.archivo == "-" else open(args.archivo, encoding="utf-8", newline="")
+    procesadas = creadas = errores = 0
+    with entrada:
+        for resultado in importar(entrada, formato, args.lote):
+            procesadas += resultado["procesadas"]
+            creadas += resultado["creadas"]
+            errores += len(resultado["errores"])
+            for error in resultado["errores"]:
+                print(json.dumps(error, ensure_ascii=False), file=sys.stderr)
+            print(f"{procesadas} filas procesadas, {creadas} creadas, {errores} con error", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+# catalogos.py
+# Caché en proceso de las tablas de referencia: ocupaciones, roles,
+# prestamo_estatus y validadores.
+#
+# Se cargan al iniciar la aplicación en diccionarios inmutables
+# (nombre -> id e id -> fila) que se reemplazan completos en cada recarga.
+# Al vencer CATALOGOS_TTL segundos (300 por defecto) se siguen sirviendo los
+# datos actuales mientras un hilo los recarga. Quien escribe en estas tablas
+# llama a marcar_cambio(db) y la recarga se hace después del commit de esa
+# sesión, para no dejar en caché ids de una transacción revertida.
+#
+# Los estatus y roles se buscan por nombre sin distinguir mayúsculas; si la
+# tabla no tiene el nombre se usan los códigos de siempre (1 Aprobado,
+# 2 Pendiente, 3 Denegado, 4 En mora, rol 2 Cliente).
+import logging
+import os
+import threading
+import time
+from types import MappingProxyType
+from typing import Optional
+
+from fastapi import APIRouter
+from sqlalchemy import event, select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from . import database, models
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+TTL = float(os.getenv("CATALOGOS_TTL", "300"))
+
+# tabla -> (modelo, columna id, columna nombre)
+TABLAS = {
+    "ocupaciones": (models.Ocupaciones, "ocupacion_id", "nombre_ocupacion"),
+    "roles": (models.Roles, "rol_id", "nombre_rol"),
+    "estatus": (models.PrestamoEstatus, "estatus_id", "descripcion"),
+    "validadores": (models.Validadores, "validador_id", "validador_nombre"),
+}
+
+POR_DEFECTO = {
+    "estatus": {"aprobado": 1, "pendiente": 2, "denegado": 3, "en mora": 4},
+    "roles": {"cliente": 2},
+}
+
+_VACIO = MappingProxyType({})
+
+
+def _normalizar(nombre: str) -> str:
+    return nombre.strip().lower()
+
+
+class Tabla:
+    def __init__(self, filas: list, columna_id: str, columna_nombre: str):
+        self.por_id = MappingProxyType({fila[columna_id]: MappingProxyType(fila) for fila in filas})
+        self.por_nombre = MappingProxyType({
+            fila[columna_nombre]: fila[columna_id] for fila in filas if fila[columna_nombre] is not None
+        })
+        self.por_nombre_normalizado = MappingProxyType({
+            _normalizar(nombre): id_ for nombre, id_ in self.por_nombre.items()
+        })
+
+
+class Catalogos:
+    def __init__(self, ttl: float = TTL):
+        self.ttl = ttl
+        self._tablas = {}
+        self._vence = 0.0
+        self._recargando = False
+        self._lock = threading.Lock()
+        self.aciertos = {tabla: 0 for tabla in TABLAS}
+        self.fallos = {tabla: 0 for tabla in TABLAS}
+
+    def cargar(self):
+        tablas = {}
+        with database.SessionLocal() as db:
+            for nombre, (modelo, columna_id, columna_nombre) in TABLAS.items():
+                columnas = modelo.__table__.c
+                filas = [dict(fila) for fila in db.execute(select(columnas)).mappings()]
+                tablas[nombre] = Tabla(filas, columna_id, columna_nombre)
+        with self._lock:
+            self._tablas = tablas
+            self._vence = time.monotonic() + self.ttl
+            self._recargando = False
+
+    def _recargar(self):
+        try:
+            self.cargar()
+        except SQLAlchemyError:
+            logger.exception("No se pudieron recargar los catálogos")
+            with self._lock:
+                self._recargando = False
+
+    def _recargar_en_segundo_plano(self):
+        # Llamar con self._lock tomado
+        if not self._recargando:
+            self._recargando = True
+            threading.Thread(target=self._recargar, daemon=True).start()
+
+    def tabla(self, nombre: str) -> Optional[Tabla]:
+        # Nunca bloquea una petición: sin datos devuelve None y, si están
+        # vencidos, devuelve los actuales y recarga en segundo plano
+        with self._lock:
+            if time.monotonic() >= self._vence:
+                self._recargar_en_segundo_plano()
+            return self._tablas.get(nombre)
+
+    def id_por_nombre(self, tabla: str, nombre: str):
+        datos = self.tabla(tabla)
+        id_ = datos.por_nombre.get(nombre) if datos else None
+        if id_ is None:
+            self.fallos[tabla] += 1
+        else:
+            self.aciertos[tabla] += 1
+        return id_
+
+    def fila(self, tabla: str, id_):
+        datos = self.tabla(tabla)
+        fila = datos.por_id.get(id_) if datos else None
+        if fila is None:
+            self.fallos[tabla] += 1
+        else:
+            self.aciertos[tabla] += 1
+        return fila
+
+    def _codigo(self, tabla: str, nombre: str) -> int:
+        datos = self.tabla(tabla)
+        id_ = (datos.por_nombre_normalizado if datos else _VACIO).get(_normalizar(nombre))
+        if id_ is not None:
+            self.aciertos[tabla] += 1
+            return id_
+        self.fallos[tabla] += 1
+        return POR_DEFECTO[tabla][_normalizar(nombre)]
+
+    def estatus_id(self, nombre: str) -> int:
+        return self._codigo("estatus", nombre)
+
+    def rol_id(self, nombre: str) -> int:
+        return self._codigo("roles", nombre)
+
+    def invalidar(self):
+        with self._lock:
+            self._vence = 0.0
+            self._recargar_en_segundo_plano()
+
+    def estadisticas(self) -> dict:
+        return {
+            tabla: {
+                "filas": len(self._tablas[tabla].por_id) if tabla in self._tablas else 0,
+                "aciertos": self.aciertos[tabla],
+                "fallos": self.fallos[tabla],
+            }
+            for tabla in TABLAS
+        }
+
+
+catalogo = Catalogos()
+
+# Atajos para los módulos que consultan el catálogo
+cargar = catalogo.cargar
+invalidar = catalogo.invalidar
+id_por_nombre = catalogo.id_por_nombre
+fila = catalogo.fila
+estatus_id = catalogo.estatus_id
+rol_id = catalogo.rol_id
+
+
+def marcar_cambio(db: Session):
+    db.info["catalogos_cambiados"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _recargar_tras_commit(db):
+    if db.info.pop("catalogos_cambiados", False):
+        catalogo.invalidar()
+
+
+@router.get("/catalogos/estadisticas")
+def estadisticas_catalogos():
+    return catalogo.estadisticas()
@@ -0,0 +1,231 @@
+# conciliacion.py
+# Conciliación de comprobantes pendientes contra el extracto bancario.
+#
+# El extracto (CSV o NDJSON con codigo_transaccion, monto y fecha) se lee como
+# flujo y se procesa por bloques. Cada bloque se copia con COPY a una tabla
+# temporal y se cruza con pagos_realizados.codigo_transaccion en una sola
+# sentencia: los pagos pendientes cuyo monto coincide (con TOLERANCIA) se
+# aprueban con un UPDATE ... FROM y el estatus de sus préstamos (aprobado o en
+# mora) se actualiza con crud.actualizar_estatus_prestamos. Las líneas que no
+# se pueden conciliar se devuelven como observaciones y sus pagos quedan
+# pendientes para revisarlos a mano:
+#
+#   sin_pago       ningún comprobante tiene ese código de transacción
+#   monto_distinto el monto del extracto no coincide con el del comprobante
+#   ya_procesado   el comprobante ya estaba aprobado, rechazado o denegado
+#   duplicado      el código se repite dentro del mismo bloque del extracto
+#   invalida       la línea no tiene el formato esperado
+#
+#   python -m app.conciliacion extracto.csv
+#   python -m app.conciliacion extracto.ndjson --tolerancia 0.05 --bloque 10000
+import argparse
+import csv
+import io
+import json
+import sys
+from itertools import islice
+from typing import Iterable, Iterator
+
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from pydantic import ValidationError
+from sqlalchemy import Column, DateTime, Float, Integer, MetaData, String, Table, func, select, text, update
+from sqlalchemy.orm import Session
+
+from . import auditoria, cache, carga_masiva, crud, database, models, schemas
+
+router = APIRouter()
+
+TAMANO_BLOQUE = 5000
+MAX_TAMANO_BLOQUE = 100000
+TOLERANCIA = 0.01
+MAX_OBSERVACIONES_RESPUESTA = 1000
+
+pagos = models.PagosRealizados.__table__
+
+# Se crea en cada bloque y se borra en el commit (ON COMMIT DROP)
+movimientos = Table(
+    "conciliacion_movimientos", MetaData(),
+    Column("fila", Integer, primary_key=True),
+    Column("codigo_transaccion", String(50), nullable=False),
+    Column("monto", Float, nullable=False),
+    Column("fecha", DateTime),
+    prefixes=["TEMPORARY"],
+    postgresql_on_commit="DROP",
+)
+
+
+def _observacion(fila: int, codigo, motivo: str, detalle: str) -> dict:
+    return {"fila": fila, "codigo_transaccion": codigo, "motivo": motivo, "detalle": detalle}
+
+
+def _copiar_movimientos(db: Session, validos: list):
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    for n, movimiento in validos:
+        escritor.writerow([
+            n, movimiento.codigo_transaccion, movimiento.monto,
+            "\\N" if movimiento.fecha is None else movimiento.fecha.isoformat(),
+        ])
+    database.copiar_csv(db, movimientos.name, [c.name for c in movimientos.c], buffer.getvalue())
+
+
+def _cruzar(db: Session, tolerancia: float) -> list:
+    # Un solo viaje: aprueba los pendientes que coinciden y devuelve cada línea
+    # con el comprobante que le corresponde (si lo hay)
+    cruce = (
+        select(
+            movimientos.c.fila,
+            movimientos.c.codigo_transaccion,
+            movimientos.c.monto,
+            movimientos.c.fecha,
+            pagos.c.pago_realizado_id,
+            pagos.c.prestamo_id,
+            pagos.c.estado,
+            pagos.c.pago_realizado_monto_pagado,
+        )
+        .outerjoin(pagos, pagos.c.codigo_transaccion == movimientos.c.codigo_transaccion)
+        .cte("cruce")
+    )
+    aprobados = (
+        update(pagos)
+        .where(
+            pagos.c.pago_realizado_id == cruce.c.pago_realizado_id,
+            pagos.c.estado == "pendiente",
+            func.abs(pagos.c.pago_realizado_monto_pagado - cruce.c.monto) <= tolerancia,
+        )
+        .values(
+            estado="aprobado",
+            pago_realizado_fecha_pago=func.coalesce(pagos.c.pago_realizado_fecha_pago, cruce.c.fecha),
+        )
+        .returning(pagos.c.pago_realizado_id)
+        .cte("aprobados")
+    )
+    return db.execute(
+        select(cruce, aprobados.c.pago_realizado_id.is_not(None).label("aprobado"))
+        .outerjoin(aprobados, aprobados.c.pago_realizado_id == cruce.c.pago_realizado_id)
+        .order_by(cruce.c.fila)
+    ).mappings().all()
+
+
+def procesar_bloque(db: Session, filas: list, tolerancia: float = TOLERANCIA) -> dict:
+    # Concilia una lista de (numero_de_fila, datos) y confirma el bloque
+    observaciones = []
+    validos = []
+    vistos = set()
+    for n, datos in filas:
+        if isinstance(datos, Exception):
+            observaciones.append(_observacion(n, None, "invalida", f"JSON inválido: {datos}"))
+            continue
+        try:
+            movimiento = schemas.MovimientoBancario.model_validate(datos)
+        except ValidationError as e:
+            codigo = datos.get("codigo_transaccion") if isinstance(datos, dict) else None
+            observaciones.append(_observacion(n, codigo, "invalida", carga_masiva.mensaje_validacion(e)))
+            continue
+        if movimiento.codigo_transaccion in vistos:
+            observaciones.append(_observacion(n, movimiento.codigo_transaccion, "duplicado", "Código repetido en el extracto"))
+            continue
+        vistos.add(movimiento.codigo_transaccion)
+        validos.append((n, movimiento))
+
+    conciliados = 0
+    prestamos = set()
+    cambios = []
+    if validos:
+        movimientos.create(db.connection())
+        _copiar_movimientos(db, validos)
+        db.execute(text(f"ANALYZE {movimientos.name}"))
+        for linea in _cruzar(db, tolerancia):
+            if linea["aprobado"]:
+                conciliados += 1
+                prestamos.add(linea["prestamo_id"])
+                cambios.append((linea["pago_realizado_id"], "pendiente", "aprobado"))
+            elif linea["pago_realizado_id"] is None:
+                observaciones.append(_observacion(
+                    linea["fila"], linea["codigo_transaccion"], "sin_pago", "No hay comprobante con ese código de transacción",
+                ))
+            elif linea["estado"] != "pendiente":
+                observaciones.append(_observacion(
+                    linea["fila"], linea["codigo_transaccion"], "ya_procesado", f"El comprobante ya estaba {linea['estado']}",
+                ))
+            else:
+                observaciones.append(_observacion(
+                    linea["fila"], linea["codigo_transaccion"], "monto_distinto",
+                    f"Monto del extracto {linea['monto']} distinto del comprobante {linea['pago_realizado_monto_pagado']}",
+                ))
+        prestamos.discard(None)
+        auditoria.registrar(db, "pago", "estado", cambios)
+        crud.actualizar_estatus_prestamos(db, prestamos)
+        db.commit()
+        cache.invalidar_prestamos(*prestamos)
+
+    observaciones.sort(key=lambda o: o["fila"])
+    return {"procesadas": len(filas), "conciliados": conciliados, "observaciones": observaciones}
+
+
+def conciliar(
+    lineas: Iterable[str], formato: str = "csv", tamano_bloque: int = TAMANO_BLOQUE, tolerancia: float = TOLERANCIA,
+) -> Iterator[dict]:
+    # Genera el resultado de cada bloque; la memoria depende solo de tamano_bloque
+    filas = carga_masiva.leer_filas(lineas, formato)
+    with database.SessionLocal() as db:
+        while bloque := list(islice(filas, tamano_bloque)):
+            yield procesar_bloque(db, bloque, tolerancia)
+
+
+def resumir(resultados: Iterable[dict], max_observaciones: int = MAX_OBSERVACIONES_RESPUESTA) -> dict:
+    resumen = {"procesadas": 0, "conciliados": 0, "total_observaciones": 0, "por_motivo": {}, "observaciones": []}
+    for resultado in resultados:
+        resumen["procesadas"] += resultado["procesadas"]
+        resumen["conciliados"] += resultado["conciliados"]
+        resumen["total_observaciones"] += len(resultado["observaciones"])
+        for observacion in resultado["observaciones"]:
+            motivo = observacion["motivo"]
+            resumen["por_motivo"][motivo] = resumen["por_motivo"].get(motivo, 0) + 1
+        espacio = max_observaciones - len(resumen["observaciones"])
+        resumen["observaciones"].extend(resultado["observaciones"][:max(espacio, 0)])
+    return resumen
+
+
+# --- API -------------------------------------------------------------------------
+
+@router.post("/pagos/conciliar")
+async def conciliar_extracto(
+    request: Request,
+    formato: str = "csv",
+    tamano_bloque: int = Query(TAMANO_BLOQUE, ge=1, le=MAX_TAMANO_BLOQUE),
+    tolerancia: float = TOLERANCIA,
+):
+    if formato not in ("ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="Formato debe ser 'ndjson' o 'csv'")
+
+    lineas = carga_masiva.lineas_del_cuerpo(request)
+    return await run_in_threadpool(lambda: resumir(conciliar(lineas, formato, tamano_bloque, tolerancia)))
+
+
+# --- CLI -------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Conciliación de comprobantes contra el extracto bancario")
+    parser.add_argument("archivo", help="Extracto CSV o NDJSON ('-' para stdin)")
+    parser.add_argument("--formato", choices=["ndjson", "csv"], default=None)
+    parser.add_argument("--bloque", type=int, default=TAMANO_BLOQUE)
+    parser.add_argument("--tolerancia", type=float, default=TOLERANCIA, help="Diferencia de monto aceptada")
+    args = parser.parse_args()
+
+    formato = args.formato or ("ndjson" if args.archivo.endswith((".ndjson", ".jsonl")) else "csv")
+    entrada = sys.stdin if args.archivo == "-" else open(args.archivo, encoding="utf-8", newline="")
+    procesadas = conciliados = observaciones = 0
+    with entrada:
+        for resultado in conciliar(entrada, formato, args.bloque, args.tolerancia):
+            procesadas += resultado["procesadas"]
+            conciliados += resultado["conciliados"]
+            observaciones += len(resultado["observaciones"])
+            for observacion in resultado["observaciones"]:
+                print(json.dumps(observacion, ensure_ascii=False), file=sys.stderr)
+            print(f"{procesadas} líneas procesadas, {conciliados} conciliadas, {observaciones} observadas", flush=True)
+
+
+if __name__ == "__main__":
+    main()
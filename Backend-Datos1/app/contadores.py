@@ -0,0 +1,137 @@
+# contadores.py
+# Resumen de cartera para el tablero: préstamos y monto solicitado por
+# estatus, y pagos (cantidad y monto) por estado.
+#
+# Los totales salen de contadores_cartera, que los triggers de prestamo y
+# pagos_realizados actualizan en la misma transacción de cada escritura (ver
+# models.py y migrations/0005_contadores_cartera.sql), así que cubren todos
+# los caminos: solicitudes, carga masiva, aprobaciones, conciliación, etc.
+# Cada conexión suma en su propio slot y el resumen suma los slots.
+#
+# reconciliar() compara los contadores con un conteo completo leído en la
+# misma foto (REPEATABLE READ) y suma la diferencia en el slot 0; no bloquea
+# las escrituras que ocurren mientras tanto.
+#
+#   python -m app.contadores      # reconciliación (cron diario)
+import argparse
+import json
+
+from fastapi import APIRouter, Depends
+from sqlalchemy import String, cast, func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from . import catalogos, database, models
+
+router = APIRouter()
+
+# Diferencias de monto menores a esto se consideran redondeo del float
+TOLERANCIA_MONTO = 0.005
+
+contadores = models.ContadorCartera.__table__
+prestamo = models.Prestamos.__table__
+pagos = models.PagosRealizados.__table__
+
+
+def _contados(db: Session) -> dict:
+    filas = db.execute(
+        select(contadores.c.tipo, contadores.c.clave, func.sum(contadores.c.cantidad), func.sum(contadores.c.monto))
+        .group_by(contadores.c.tipo, contadores.c.clave)
+    ).all()
+    return {(tipo, clave): (int(cantidad), monto) for tipo, clave, cantidad, monto in filas}
+
+
+def _reales(db: Session) -> dict:
+    reales = {}
+    for tipo, clave, monto in (
+        ("prestamos", cast(prestamo.c.prestamo_estatus_id, String), prestamo.c.monto_solicitado),
+        ("pagos", pagos.c.estado, pagos.c.pago_realizado_monto_pagado),
+    ):
+        clave = func.coalesce(clave, "")
+        filas = db.execute(
+            select(clave, func.count(), func.coalesce(func.sum(func.coalesce(monto, 0.0)), 0.0)).group_by(clave)
+        ).all()
+        reales.update({(tipo, c): (cantidad, total) for c, cantidad, total in filas})
+    return reales
+
+
+def resumen(db: Session) -> dict:
+    prestamos, estados = [], []
+    for (tipo, clave), (cantidad, monto) in sorted(_contados(db).items()):
+        if cantidad == 0:
+            continue
+        if tipo == "prestamos":
+            estatus_id = int(clave) if clave else None
+            estatus = catalogos.fila("estatus", estatus_id)
+            prestamos.append({
+                "prestamo_estatus_id": estatus_id,
+                "estatus": estatus["descripcion"] if estatus else None,
+                "cantidad": cantidad,
+                "monto_solicitado": round(monto, 2),
+            })
+        else:
+            estados.append({"estado": clave or None, "cantidad": cantidad, "monto": round(monto, 2)})
+    pendientes = next((e for e in estados if e["estado"] == "pendiente"), {"cantidad": 0, "monto": 0.0})
+    return {
+        "prestamos": prestamos,
+        "total_prestamos": sum(p["cantidad"] for p in prestamos),
+        "monto_solicitado_total": round(sum(p["monto_solicitado"] for p in prestamos), 2),
+        "pagos": estados,
+        "pagos_pendientes": {"cantidad": pendientes["cantidad"], "monto": pendientes["monto"]},
+    }
+
+
+def reconciliar() -> dict:
+    with database.SessionLocal() as db:
+        # Datos y contadores de la misma foto: los triggers escriben ambos en
+        # la misma transacción, así que la diferencia es deriva real
+        db.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+        reales = _reales(db)
+        contados = _contados(db)
+        db.rollback()
+
+        correcciones = []
+        for clave in sorted(reales.keys() | contados.keys()):
+            cantidad_real, monto_real = reales.get(clave, (0, 0.0))
+            cantidad, monto = contados.get(clave, (0, 0.0))
+            if cantidad_real != cantidad or abs(monto_real - monto) > TOLERANCIA_MONTO:
+                correcciones.append({
+                    "tipo": clave[0], "clave": clave[1], "slot": 0,
+                    "cantidad": cantidad_real - cantidad, "monto": monto_real - monto,
+                })
+        if correcciones:
+            # Se suma (no se reemplaza) para no pisar lo escrito después de la foto
+            nuevas = pg_insert(contadores).values(correcciones)
+            db.execute(nuevas.on_conflict_do_update(
+                index_elements=["tipo", "clave", "slot"],
+                set_={
+                    "cantidad": contadores.c.cantidad + nuevas.excluded.cantidad,
+                    "monto": contadores.c.monto + nuevas.excluded.monto,
+                },
+            ))
+            db.commit()
+    return {"correcciones": [{k: v for k, v in c.items() if k != "slot"} for c in correcciones]}
+
+
+# --- API -------------------------------------------------------------------------
+
+@router.get("/resumen/cartera")
+def resumen_cartera(db: Session = Depends(database.get_read_db)):
+    return resumen(db)
+
+
+@router.post("/resumen/cartera/reconciliar")
+def reconciliar_cartera():
+    # Sesión propia: la lectura va en REPEATABLE READ
+    return reconciliar()
+
+
+# --- CLI -------------------------------------------------------------------------
+
+def main():
+    argparse.ArgumentParser(description="Reconciliación de los contadores de cartera").parse_args()
+    print(json.dumps(reconciliar(), ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+# correlativos.py
+# Asignación de pago_realizado_correlativo (PAGO-n) sin leer el último pago.
+#
+# Por defecto el correlativo lo pone la base de datos con el DEFAULT de la
+# columna (nextval de pago_realizado_correlativo_seq) dentro del mismo INSERT.
+# Con CORRELATIVO_BLOQUE=N cada proceso reserva N valores de la secuencia en
+# una sola consulta y los reparte en memoria, de modo que solo 1 de cada N
+# pagos consulta la secuencia.
+import os
+from collections import deque
+from typing import Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from . import models
+
+TAMANO_BLOQUE = int(os.getenv("CORRELATIVO_BLOQUE", "0"))
+
+
+def formatear(numero: int) -> str:
+    return f"PAGO-{numero}"
+
+
+class AsignadorBloques:
+    def __init__(self, tamano: int):
+        self.tamano = tamano
+        self._libres = deque()
+
+    def reservar(self, db: Session) -> list:
+        return list(db.execute(
+            select(models.CORRELATIVO_PAGO_SEQ.next_value()).select_from(func.generate_series(1, self.tamano))
+        ).scalars())
+
+    def siguiente(self, db: Session) -> str:
+        # Sin locks: popleft/extend de deque son atómicos y cada valor sale de
+        # la secuencia una sola vez. Dos recargas simultáneas solo dejan huecos.
+        try:
+            return formatear(self._libres.popleft())
+        except IndexError:
+            primero, *resto = self.reservar(db)
+            self._libres.extend(resto)
+            return formatear(primero)
+
+
+asignador = AsignadorBloques(TAMANO_BLOQUE) if TAMANO_BLOQUE > 1 else None
+
+
+def siguiente(db: Session) -> Optional[str]:
+    # None indica que el correlativo lo asigna el DEFAULT de la columna
+    return asignador.siguiente(db) if asignador else None
@@ -1,10 +1,25 @@
-from fastapi import APIRouter, HTTPException, Depends
+import json
+from typing import List, Optional
+from fastapi import APIRouter, HTTPException, Depends, Query, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy import JSON, Integer, String, case, cast, column, exists, func, insert, literal, select, text, update, values
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from . import models, schemas, database
-from datetime import datetime, timedelta
+from . import models, schemas, database, amortizacion, auditoria, cache, catalogos, correlativos, recepcion
+from datetime import date, datetime, timedelta
 
 router = APIRouter()
 
+TAMANO_EXPORTACION = 1000
+# Saldo vencido menor a esto (redondeo del float) no pone un préstamo en mora
+TOLERANCIA_MORA = 0.005
+
+# Respuestas de GET /prestamos/{codigo_prestamo}/detalle; se invalidan con
+# cache.invalidar_prestamos en cada escritura sobre el préstamo o sus pagos
+cache_detalle = cache.CachePrestamos("detalle_prestamo")
+
 def get_ocupacion_by_name(db: Session, ocupacion_name: str):
     return db.query(models.Ocupaciones).filter(models.Ocupaciones.nombre_ocupacion == ocupacion_name).first()
 
@@ -15,132 +30,248 @@ def create_ocupacion(db: Session, ocupacion_name: str):
     db.refresh(ocupacion)
     return ocupacion
 
-@router.post("/prestamos/solicitud", response_model=schemas.PrestamoResponse)
-def crear_solicitud_prestamo(
-    cliente: schemas.ClienteSolicitud, db: Session = Depends(database.get_db)
-):
-    # 1. Verificar si la ocupación ya existe o crearla
-    ocupacion = db.query(models.Ocupaciones).filter(models.Ocupaciones.nombre_ocupacion == cliente.ocupacion).first()
-    if not ocupacion:
-        ocupacion = models.Ocupaciones(nombre_ocupacion=cliente.ocupacion)
-        db.add(ocupacion)
-        db.commit()
-        db.refresh(ocupacion)
-
-    # 2. Verificar si el usuario ya existe
-    usuario = db.query(models.User).filter(models.User.cui == cliente.cui).first()
-    if not usuario:
-        # Crear usuario si no existe
-        usuario = models.User(
-            codigo_cliente=f"U-{cliente.cui[-4:]}",
-            genero=cliente.genero,
-            cui=cliente.cui,
-            fecha_nacimiento=cliente.fecha_nacimiento,
-            estado_civil=cliente.estado_civil,
-            nacionalidad=cliente.nacionalidad,
-            primer_nombre=cliente.primer_nombre,
-            segundo_nombre=cliente.segundo_nombre,
-            tercer_nombre=cliente.tercer_nombre,
-            primer_apellido=cliente.primer_apellido,
-            segundo_apellido=cliente.segundo_apellido,
-            apellido_casada=cliente.apellido_casada,
-            ocupaciones_id=ocupacion.ocupacion_id,
-            rol_id=2,  # Rol de cliente
+def _insertar_o_obtener(db: Session, modelo, valores: dict, clave, columna_id):
+    # INSERT ... ON CONFLICT DO NOTHING RETURNING y, si la fila ya existía,
+    # el id existente; todo en una sola sentencia
+    nueva = (
+        pg_insert(modelo)
+        .values(**valores)
+        .on_conflict_do_nothing(index_elements=[clave])
+        .returning(columna_id)
+        .cte()
+    )
+    existente = select(columna_id).where(clave == valores[clave.key])
+    fila_id = db.execute(select(nueva.c[columna_id.key]).union_all(existente).limit(1)).scalar()
+    if fila_id is None:
+        # Otra transacción insertó la misma clave a la vez: ON CONFLICT esperó
+        # su commit, pero el SELECT usa la foto del inicio de la sentencia y no
+        # la ve. Una sentencia nueva (READ COMMITTED) sí.
+        fila_id = db.execute(existente).scalar_one()
+    return fila_id
+
+
+def _filas_referencias(usuario_id: int, referencias: List[schemas.ReferenciaBase]) -> List[dict]:
+    # Una fila por referencia, numeradas desde 1 en el orden de la solicitud
+    return [
+        {"usuario_id": usuario_id, "orden": orden, **referencia.model_dump()}
+        for orden, referencia in enumerate(referencias, start=1)
+    ]
+
+
+def codigo_prestamo_base(usuario_id: int, monto: float) -> str:
+    # codigo_prestamo es único: si el cliente ya tiene un préstamo por el mismo
+    # monto, al código base se le agrega "-<prestamo_id>"
+    return f"P-{usuario_id}-{monto:.0f}"
+
+
+def crear_solicitud(db: Session, cliente: schemas.ClienteSolicitud) -> dict:
+    # Escribe la solicitud completa dentro de la transacción de `db` sin hacer
+    # commit: quien llama decide si confirma o revierte todo junto.
+
+    # 1. Ocupación: del catálogo en memoria o upsert por nombre si es nueva
+    ocupacion_id = catalogos.id_por_nombre("ocupaciones", cliente.ocupacion)
+    if ocupacion_id is None:
+        ocupacion_id = _insertar_o_obtener(
+            db, models.Ocupaciones, {"nombre_ocupacion": cliente.ocupacion},
+            models.Ocupaciones.nombre_ocupacion, models.Ocupaciones.ocupacion_id,
         )
-        db.add(usuario)
-        db.commit()
-        db.refresh(usuario)
+        catalogos.marcar_cambio(db)
+
+    # 2. Usuario: se crea solo si no existe otro con el mismo CUI
+    usuario_id = _insertar_o_obtener(
+        db,
+        models.User,
+        {
+            "codigo_cliente": f"U-{cliente.cui[-4:]}",
+            "genero": cliente.genero,
+            "cui": cliente.cui,
+            "fecha_nacimiento": cliente.fecha_nacimiento,
+            "estado_civil": cliente.estado_civil,
+            "nacionalidad": cliente.nacionalidad,
+            "primer_nombre": cliente.primer_nombre,
+            "segundo_nombre": cliente.segundo_nombre,
+            "tercer_nombre": cliente.tercer_nombre,
+            "primer_apellido": cliente.primer_apellido,
+            "segundo_apellido": cliente.segundo_apellido,
+            "apellido_casada": cliente.apellido_casada,
+            "ocupaciones_id": ocupacion_id,
+            "rol_id": catalogos.rol_id("cliente"),
+        },
+        models.User.cui,
+        models.User.usuario_id,
+    )
 
-    # 3. Crear dirección del usuario
-    direccion = models.DireccionUser(
-        usuario_id=usuario.usuario_id,
+    # 3. Dirección, referencias, préstamo y cargo administrativo en una sola
+    # sentencia con CTEs; el prestamo_id se toma de la secuencia al inicio para
+    # poder usarlo en codigo_prestamo cuando el código base ya existe
+    base = codigo_prestamo_base(usuario_id, cliente.monto_prestamo)
+    nuevo_id = select(
+        func.nextval(func.pg_get_serial_sequence("prestamo", "prestamo_id")).label("prestamo_id")
+    ).cte("nuevo_id")
+    codigo = case(
+        (exists().where(models.Prestamos.codigo_prestamo == base), literal(f"{base}-") + cast(nuevo_id.c.prestamo_id, String)),
+        else_=literal(base),
+    )
+    direccion = insert(models.DireccionUser).values(
+        usuario_id=usuario_id,
         depto_nacimiento=cliente.direccion.depto_nacimiento,
         muni_nacimiento=cliente.direccion.muni_nacimiento,
         vecindad=cliente.direccion.vecindad,
+    ).cte("direccion_nueva")
+    referencias = insert(models.Referencias).values(
+        _filas_referencias(usuario_id, cliente.referencias)
+    ).cte("referencias_nuevas")
+    prestamo = (
+        insert(models.Prestamos)
+        .from_select(
+            ["prestamo_id", "usuario_id", "codigo_prestamo", "motivo_prestamo", "prestamo_estatus_id",
+             "monto_solicitado", "cuotas_pactadas", "porcentaje_interes"],
+            select(
+                nuevo_id.c.prestamo_id, literal(usuario_id), codigo, literal(cliente.motivo_prestamo),
+                literal(catalogos.estatus_id("pendiente")),
+                literal(cliente.monto_prestamo), literal(cliente.cuotas_pactadas), literal(0.0),
+            ),
+        )
+        .returning(models.Prestamos.prestamo_id, models.Prestamos.codigo_prestamo)
+        .cte("prestamo_nuevo")
     )
-    db.add(direccion)
-
-    # 4. Crear referencias personales
-    referencias = models.Referencias(
-        usuario_id=usuario.usuario_id,
-        referencia1_primer_nombre=cliente.referencias.referencia1.primer_nombre,
-        referencia1_segundo_nombre=cliente.referencias.referencia1.segundo_nombre,
-        referencia1_tercer_nombre=cliente.referencias.referencia1.tercer_nombre,
-        referencia1_primer_apellido=cliente.referencias.referencia1.primer_apellido,
-        referencia1_segundo_apellido=cliente.referencias.referencia1.segundo_apellido,
-        referencia1_telefono=cliente.referencias.referencia1.telefono,
-        referencia2_primer_nombre=cliente.referencias.referencia2.primer_nombre,
-        referencia2_segundo_nombre=cliente.referencias.referencia2.segundo_nombre,
-        referencia2_tercer_nombre=cliente.referencias.referencia2.tercer_nombre,
-        referencia2_primer_apellido=cliente.referencias.referencia2.primer_apellido,
-        referencia2_segundo_apellido=cliente.referencias.referencia2.segundo_apellido,
-        referencia2_telefono=cliente.referencias.referencia2.telefono,
-        referencia3_primer_nombre=cliente.referencias.referencia3.primer_nombre,
-        referencia3_segundo_nombre=cliente.referencias.referencia3.segundo_nombre,
-        referencia3_tercer_nombre=cliente.referencias.referencia3.tercer_nombre,
-        referencia3_primer_apellido=cliente.referencias.referencia3.primer_apellido,
-        referencia3_segundo_apellido=cliente.referencias.referencia3.segundo_apellido,
-        referencia3_telefono=cliente.referencias.referencia3.telefono,
-        referencia4_primer_nombre=cliente.referencias.referencia4.primer_nombre,
-        referencia4_segundo_nombre=cliente.referencias.referencia4.segundo_nombre,
-        referencia4_tercer_nombre=cliente.referencias.referencia4.tercer_nombre,
-        referencia4_primer_apellido=cliente.referencias.referencia4.primer_apellido,
-        referencia4_segundo_apellido=cliente.referencias.referencia4.segundo_apellido,
-        referencia4_telefono=cliente.referencias.referencia4.telefono,
-    )
-    db.add(referencias)
-
-    # 5. Crear el préstamo
-    nuevo_prestamo = models.Prestamos(
-        usuario_id=usuario.usuario_id,
-        codigo_prestamo=f"P-{usuario.usuario_id}-{cliente.monto_prestamo:.0f}",
-        motivo_prestamo=cliente.motivo_prestamo,
-        prestamo_estatus_id=2,  # Estatus de pendiente
-        monto_solicitado=cliente.monto_prestamo,
-        cuotas_pactadas=cliente.cuotas_pactadas,
-        porcentaje_interes=0,
-    )
-    db.add(nuevo_prestamo)
-    db.commit()
-    db.refresh(nuevo_prestamo)
-
-    # 6. Crear el cargo administrativo asociado al préstamo
-    nuevo_cargo_admin = models.CargosAdmin(
-        prestamo_id=nuevo_prestamo.prestamo_id,
-        prestamo_iva=0.0,
-        prestamo_cargos_administrativos=0.0,
-        prestamo_total=0.0,
+    cargo = (
+        insert(models.CargosAdmin)
+        .from_select(
+            ["prestamo_id", "prestamo_iva", "prestamo_cargos_administrativos", "prestamo_total"],
+            select(prestamo.c.prestamo_id, literal(0.0), literal(0.0), literal(0.0)),
+        )
+        .returning(models.CargosAdmin.prestamo_id, models.CargosAdmin.cargos_id)
+        .cte("cargo_nuevo")
     )
-    db.add(nuevo_cargo_admin)
-    db.commit()
+    prestamo_id, codigo_prestamo, cargo_admin_id = db.execute(
+        select(prestamo.c.prestamo_id, prestamo.c.codigo_prestamo, cargo.c.cargos_id)
+        .join_from(prestamo, cargo, cargo.c.prestamo_id == prestamo.c.prestamo_id)
+        .add_cte(direccion, referencias)
+    ).one()
 
-    # 7. Responder con los datos del préstamo
     return {
         "message": "Solicitud de préstamo creada con éxito",
-        "usuario_id": usuario.usuario_id,
-        "codigo_prestamo": nuevo_prestamo.codigo_prestamo,
-        "prestamo_id": nuevo_prestamo.prestamo_id,
-        "cargo_admin_id": nuevo_cargo_admin.cargos_id,
-        "monto_solicitado": nuevo_prestamo.monto_solicitado,
-        "cuotas_pactadas": nuevo_prestamo.cuotas_pactadas,
-        "porcentaje_interes": nuevo_prestamo.porcentaje_interes,
-        "prestamo_estatus_id": nuevo_prestamo.prestamo_estatus_id,
-}
-# Endpoint para obtener préstamos pendientes
-@router.get("/prestamos/pendientes", response_model=list[schemas.PrestamoResponse])
-def obtener_prestamos_pendientes(db: Session = Depends(database.get_db)):
-    prestamos_pendientes = db.query(models.Prestamos).filter(
-        models.Prestamos.prestamo_estatus_id == 2  # 2 representa "Pendiente"
-    ).all()
+        "usuario_id": usuario_id,
+        "codigo_prestamo": codigo_prestamo,
+        "prestamo_id": prestamo_id,
+        "cargo_admin_id": cargo_admin_id,
+        "monto_solicitado": cliente.monto_prestamo,
+        "cuotas_pactadas": cliente.cuotas_pactadas,
+        "porcentaje_interes": 0.0,
+        "prestamo_estatus_id": catalogos.estatus_id("pendiente"),
+    }
+
+
+@router.post(
+    "/prestamos/solicitud",
+    response_model=schemas.PrestamoResponse,
+    responses={202: {"model": schemas.SolicitudEncolada}, 503: {"description": "Cola de solicitudes llena"}},
+)
+def crear_solicitud_prestamo(
+    cliente: schemas.ClienteSolicitud, db: Session = Depends(database.get_db)
+):
+    # Con SOLICITUDES_MODO=cola solo se encola y se responde 202 (ver recepcion.py)
+    if recepcion.MODO == "cola":
+        return recepcion.encolar(db, cliente)
+
+    # Toda la solicitud se escribe en una única transacción: si algo falla
+    # no quedan usuarios ni préstamos huérfanos
+    try:
+        respuesta = crear_solicitud(db, cliente)
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        # Puede venir de una ocupación del catálogo que ya no existe
+        catalogos.invalidar()
+        raise HTTPException(status_code=409, detail="La solicitud entra en conflicto con datos existentes")
+    return respuesta
+
+
+def _consulta_prestamos(
+    estatus: Optional[List[int]] = None,
+    monto_min: Optional[float] = None,
+    monto_max: Optional[float] = None,
+    cuotas: Optional[int] = None,
+    usuario_id: Optional[int] = None,
+    despues_de: Optional[int] = None,
+):
+    # Solo las columnas de PrestamoResponse, ordenadas por la llave del keyset
+    columnas = [getattr(models.Prestamos, campo) for campo in schemas.PrestamoResponse.model_fields]
+    consulta = select(*columnas).order_by(models.Prestamos.prestamo_id)
+    if estatus:
+        consulta = consulta.where(models.Prestamos.prestamo_estatus_id.in_(estatus))
+    if monto_min is not None:
+        consulta = consulta.where(models.Prestamos.monto_solicitado >= monto_min)
+    if monto_max is not None:
+        consulta = consulta.where(models.Prestamos.monto_solicitado <= monto_max)
+    if cuotas is not None:
+        consulta = consulta.where(models.Prestamos.cuotas_pactadas == cuotas)
+    if usuario_id is not None:
+        consulta = consulta.where(models.Prestamos.usuario_id == usuario_id)
+    if despues_de is not None:
+        consulta = consulta.where(models.Prestamos.prestamo_id > despues_de)
+    return consulta
+
+
+def _exportar_ndjson(consulta, sesion):
+    # Sesión propia (réplica o primaria, como get_read_db): la respuesta se
+    # sigue enviando después de que termina el endpoint. yield_per usa un
+    # cursor del lado del servidor.
+    with sesion() as db:
+        resultado = db.execute(consulta.execution_options(yield_per=TAMANO_EXPORTACION)).mappings()
+        for bloque in resultado.partitions():
+            yield "".join(json.dumps(dict(fila), ensure_ascii=False) + "\n" for fila in bloque)
+
+
+def _pagina_prestamos(db: Session, consulta, limite: int) -> dict:
+    prestamos = db.execute(consulta.limit(limite)).mappings().all()
+    return {
+        "items": prestamos,
+        "siguiente": prestamos[-1]["prestamo_id"] if len(prestamos) == limite else None,
+    }
 
-    if not prestamos_pendientes:
-        raise HTTPException(status_code=404, detail="No hay préstamos pendientes")
-    return prestamos_pendientes
+
+# Endpoint para listar préstamos con filtros y paginación por prestamo_id
+@router.get("/prestamos", response_model=schemas.PrestamoPagina)
+def listar_prestamos(
+    request: Request,
+    estatus: Optional[List[int]] = Query(None),
+    monto_min: Optional[float] = None,
+    monto_max: Optional[float] = None,
+    cuotas: Optional[int] = None,
+    usuario_id: Optional[int] = None,
+    despues_de: Optional[int] = None,
+    limite: int = Query(100, ge=1, le=1000),
+    formato: str = Query("json", pattern="^(json|ndjson)$"),
+    db: Session = Depends(database.get_read_db),
+):
+    consulta = _consulta_prestamos(estatus, monto_min, monto_max, cuotas, usuario_id, despues_de)
+
+    # formato=ndjson exporta todos los préstamos que cumplen el filtro
+    if formato == "ndjson":
+        contenido = _exportar_ndjson(consulta, database.sesion_lectura(request))
+        return StreamingResponse(contenido, media_type="application/x-ndjson")
+
+    return _pagina_prestamos(db, consulta, limite)
+
+
+# Endpoint para obtener préstamos pendientes
+@router.get("/prestamos/pendientes", response_model=schemas.PrestamoPagina)
+def obtener_prestamos_pendientes(
+    despues_de: Optional[int] = None,
+    limite: int = Query(100, ge=1, le=1000),
+    db: Session = Depends(database.get_read_db),
+):
+    # Paginado como GET /prestamos: pasar `siguiente` como despues_de hasta
+    # que sea null. Una lista vacía ya no es un error
+    pendiente = catalogos.estatus_id("pendiente")
+    return _pagina_prestamos(db, _consulta_prestamos(estatus=[pendiente], despues_de=despues_de), limite)
 
 
 # Endpoint para obtener detalles de un préstamo específico
 @router.get("/prestamos/{prestamo_id}", response_model=schemas.PrestamoResponse)
-def obtener_detalles_prestamo(prestamo_id: int, db: Session = Depends(database.get_db)):
+def obtener_detalles_prestamo(prestamo_id: int, db: Session = Depends(database.get_read_db)):
     prestamo = db.query(models.Prestamos).filter(models.Prestamos.prestamo_id == prestamo_id).first()
 
     if not prestamo:
@@ -179,6 +310,7 @@ def actualizar_datos_prestamo(
     )
 
     db.commit()
+    cache.invalidar_prestamos(prestamo_id)
     db.refresh(prestamo)
     db.refresh(cargo_admin)
 
@@ -191,16 +323,22 @@ def actualizar_datos_prestamo(
 
 # Endpoint para aprobar el estado del préstamo
 @router.put("/prestamos/{prestamo_id}/aprobar", response_model=schemas.PrestamoResponse)
-def aprobar_prestamo(prestamo_id: int, db: Session = Depends(database.get_db)):
-    # Obtener el préstamo
-    prestamo = db.query(models.Prestamos).filter(models.Prestamos.prestamo_id == prestamo_id).first()
+def aprobar_prestamo(prestamo_id: int, metodo: str = Query("plano", pattern="^(plano|frances)$"), db: Session = Depends(database.get_db)):
+    # Obtener el préstamo (bloqueado: dos aprobaciones a la vez no pasan las dos)
+    prestamo = db.query(models.Prestamos).filter(models.Prestamos.prestamo_id == prestamo_id).with_for_update().first()
     if not prestamo:
         raise HTTPException(status_code=404, detail="Préstamo no encontrado")
+    # Volver a aprobar reemplazaría el calendario y borraría la mora, como en
+    # aprobar_prestamos_lote solo se aprueban los pendientes
+    if prestamo.prestamo_estatus_id != catalogos.estatus_id("pendiente"):
+        raise HTTPException(status_code=409, detail="Solo se pueden aprobar préstamos pendientes")
 
     # Cambiar el estado a 'aprobado'
-    prestamo.prestamo_estatus_id = 1  # Suponiendo que 1 = 'Aprobado'
+    estatus_anterior = prestamo.prestamo_estatus_id
+    prestamo.prestamo_estatus_id = catalogos.estatus_id("aprobado")
 
-    # Calcular el monto total
+    # Calcular el monto total (con metodo=frances programar_pagos lo reemplaza
+    # por la suma del calendario)
     cargos_admin = db.query(models.CargosAdmin).filter(models.CargosAdmin.prestamo_id == prestamo_id).first()
     if not cargos_admin:
         raise HTTPException(status_code=404, detail="Cargos administrativos no encontrados para este préstamo")
@@ -213,8 +351,14 @@ def aprobar_prestamo(prestamo_id: int, db: Session = Depends(database.get_db)):
     monto_total += monto_total * (prestamo.porcentaje_interes / 100)
     cargos_admin.prestamo_total = monto_total
 
+    # Generar el calendario de pagos futuros
+    db.flush()
+    amortizacion.programar_pagos(db, [prestamo_id], metodo)
+    auditoria.registrar(db, "prestamo", "prestamo_estatus_id", [(prestamo_id, estatus_anterior, prestamo.prestamo_estatus_id)])
+
     # Guardar los cambios
     db.commit()
+    cache.invalidar_prestamos(prestamo_id)
     db.refresh(prestamo)
     db.refresh(cargos_admin)
 
@@ -238,10 +382,13 @@ def denegar_prestamo(prestamo_id: int, db: Session = Depends(database.get_db)):
         raise HTTPException(status_code=404, detail="Préstamo no encontrado")
 
     # Cambiar el estado a 'denegado'
-    prestamo.prestamo_estatus_id = 3  # Suponiendo que 3 = 'Denegado'
+    estatus_anterior = prestamo.prestamo_estatus_id
+    prestamo.prestamo_estatus_id = catalogos.estatus_id("denegado")
+    auditoria.registrar(db, "prestamo", "prestamo_estatus_id", [(prestamo_id, estatus_anterior, prestamo.prestamo_estatus_id)])
 
     # Guardar los cambios
     db.commit()
+    cache.invalidar_prestamos(prestamo_id)
     db.refresh(prestamo)
 
     return {
@@ -256,58 +403,326 @@ def denegar_prestamo(prestamo_id: int, db: Session = Depends(database.get_db)):
     }
 
 
+def _lista_json(columnas: list, orden: list, condicion):
+    # json_agg(json_build_object(...) ORDER BY ...), '[]' si no hay filas
+    objeto = func.json_build_object(*(valor for columna in columnas for valor in (columna.key, columna)))
+    return (
+        select(func.coalesce(func.json_agg(aggregate_order_by(objeto, *orden), type_=JSON), text("'[]'::json")))
+        .where(condicion)
+        .scalar_subquery()
+    )
+
+
+def consultar_detalle(db: Session, codigo_prestamo: str) -> Optional[dict]:
+    # Préstamo, cargos, pagos realizados, calendario y próxima cuota en una sola consulta
+    prestamo = models.Prestamos
+    cargos = models.CargosAdmin
+    realizados = models.PagosRealizados
+    futuros = models.PagosFuturos
+    proxima_cuota = (
+        select(func.json_build_object(
+            "pago_id", futuros.pago_id, "fecha_pago", futuros.fecha_pago, "total_pago", futuros.monto_pago,
+            type_=JSON,
+        ))
+        .where(futuros.prestamo_id == prestamo.prestamo_id, futuros.estado.in_(models.CUOTAS_IMPAGAS))
+        .order_by(futuros.fecha_pago, futuros.pago_id)
+        .limit(1)
+        .scalar_subquery()
+    )
+    fila = db.execute(
+        select(
+            prestamo.prestamo_id,
+            prestamo.codigo_prestamo,
+            prestamo.monto_solicitado,
+            prestamo.cuotas_pactadas,
+            prestamo.porcentaje_interes,
+            prestamo.prestamo_estatus_id,
+            cargos.prestamo_iva,
+            cargos.prestamo_cargos_administrativos,
+            _lista_json(
+                [realizados.pago_realizado_id, realizados.pago_realizado_correlativo,
+                 realizados.pago_realizado_fecha_creacion, realizados.pago_realizado_fecha_pago,
+                 realizados.pago_realizado_monto_pagado, realizados.estado, realizados.codigo_transaccion],
+                [realizados.pago_realizado_id],
+                realizados.prestamo_id == prestamo.prestamo_id,
+            ).label("pagos_realizados"),
+            _lista_json(
+                [futuros.pago_id, futuros.fecha_pago, futuros.monto_pago, futuros.estado],
+                [futuros.fecha_pago, futuros.pago_id],
+                futuros.prestamo_id == prestamo.prestamo_id,
+            ).label("pagos_futuros"),
+            proxima_cuota.label("proxima_cuota"),
+        )
+        .outerjoin(cargos, cargos.prestamo_id == prestamo.prestamo_id)
+        .where(prestamo.codigo_prestamo == codigo_prestamo)
+    ).mappings().first()
+    if fila is None:
+        return None
+
+    detalle = dict(fila)
+    proxima_cuota = detalle.pop("proxima_cuota")
+    iva = detalle.pop("prestamo_iva") or 0.0
+    cargos_adm = detalle.pop("prestamo_cargos_administrativos") or 0.0
+    # Sin calendario (préstamo no aprobado) se informa el total sin intereses
+    detalle["proximo_pago"] = proxima_cuota or {
+        "pago_id": None, "fecha_pago": None, "total_pago": (detalle["monto_solicitado"] or 0.0) + iva + cargos_adm,
+    }
+    return detalle
+
+
 @router.get("/prestamos/{codigo_prestamo}/detalle", response_model=schemas.PrestamoDetalleResponse)
 def obtener_detalle_prestamo(codigo_prestamo: str, db: Session = Depends(database.get_db)):
-    prestamo = db.query(models.Prestamos).filter(models.Prestamos.codigo_prestamo == codigo_prestamo).first()
-    if not prestamo:
+    # Los clientes consultan esta página constantemente: los aciertos de la
+    # caché no tocan la base de datos (la sesión no abre conexión si no se usa)
+    # Se lee de la primaria y no de la réplica: un fallo de caché leído de una
+    # réplica atrasada quedaría guardado hasta que venza la entrada
+    detalle = cache_detalle.obtener(clave=codigo_prestamo)
+    if detalle is not None:
+        return detalle
+
+    generacion = cache_detalle.generacion()
+    detalle = consultar_detalle(db, codigo_prestamo)
+    if detalle is None:
         raise HTTPException(status_code=404, detail="Préstamo no encontrado")
-    
-    pagos_realizados = db.query(models.PagosRealizados).filter(models.PagosRealizados.prestamo_id == prestamo.prestamo_id).all()
-    pagos_futuros = db.query(models.PagosFuturos).filter(models.PagosFuturos.prestamo_id == prestamo.prestamo_id).all()
-
-    detalle_proximo_pago = db.query(models.CargosAdmin).filter(models.CargosAdmin.prestamo_id == prestamo.prestamo_id).first()
-    total_pago = prestamo.monto_solicitado + detalle_proximo_pago.prestamo_iva + detalle_proximo_pago.prestamo_cargos_administrativos
+    cache_detalle.guardar(detalle["prestamo_id"], detalle, generacion, clave=codigo_prestamo)
+    return detalle
+
+
+def consultar_resumen(db: Session, usuario_id: int, hoy: date) -> Optional[dict]:
+    # Todos los préstamos del cliente con lo pagado, el saldo y la próxima
+    # cuota en una sola consulta. Los pagos aprobados no se asignan a cuotas:
+    # como en morosidad.py, cubren las cuotas impagas en orden de fecha, así
+    # que una cuota está pagada si el acumulado del calendario hasta ella no
+    # supera lo pagado.
+    usuarios = models.User.__table__
+    prestamo = models.Prestamos.__table__
+    cargos = models.CargosAdmin.__table__
+    realizados = models.PagosRealizados.__table__
+    futuros = models.PagosFuturos.__table__
+    del_cliente = select(prestamo.c.prestamo_id).where(prestamo.c.usuario_id == usuario_id)
+
+    pagado = (
+        select(
+            realizados.c.prestamo_id,
+            func.sum(realizados.c.pago_realizado_monto_pagado).filter(realizados.c.estado == "aprobado").label("monto"),
+            func.count().filter(realizados.c.estado == "pendiente").label("pendientes"),
+        )
+        .where(realizados.c.prestamo_id.in_(del_cliente))
+        .group_by(realizados.c.prestamo_id)
+        .cte("pagado")
+    )
+    cuotas = (
+        select(
+            futuros.c.prestamo_id,
+            futuros.c.pago_id,
+            futuros.c.fecha_pago,
+            futuros.c.monto_pago,
+            (
+                func.sum(futuros.c.monto_pago).over(
+                    partition_by=futuros.c.prestamo_id, order_by=(futuros.c.fecha_pago, futuros.c.pago_id),
+                )
+                - func.coalesce(pagado.c.monto, 0.0)
+            ).label("descubierto"),
+        )
+        .outerjoin(pagado, pagado.c.prestamo_id == futuros.c.prestamo_id)
+        .where(futuros.c.prestamo_id.in_(del_cliente), futuros.c.estado.in_(models.CUOTAS_IMPAGAS))
+        .cte("cuotas")
+    )
+    # Lo que falta de cada cuota, si algo falta
+    impaga = cuotas.c.descubierto > TOLERANCIA_MORA
+    resta = func.least(cuotas.c.monto_pago, cuotas.c.descubierto)
+    calendario = (
+        select(
+            cuotas.c.prestamo_id,
+            func.count().filter(impaga).label("cuotas_pendientes"),
+            func.count().filter(impaga & (cuotas.c.fecha_pago < hoy)).label("cuotas_vencidas"),
+            func.coalesce(func.sum(resta).filter(impaga), 0.0).label("saldo_pendiente"),
+            func.coalesce(func.sum(resta).filter(impaga & (cuotas.c.fecha_pago < hoy)), 0.0).label("saldo_vencido"),
+        )
+        .group_by(cuotas.c.prestamo_id)
+        .cte("calendario")
+    )
+    orden = func.row_number().over(
+        partition_by=cuotas.c.prestamo_id, order_by=(cuotas.c.fecha_pago, cuotas.c.pago_id),
+    )
+    proxima = (
+        select(cuotas.c.prestamo_id, cuotas.c.pago_id, cuotas.c.fecha_pago, cuotas.c.monto_pago,
+               resta.label("saldo_cuota"), orden.label("orden"))
+        .where(impaga)
+        .cte("proxima")
+    )
 
+    filas = db.execute(
+        select(
+            usuarios.c.usuario_id,
+            usuarios.c.codigo_cliente,
+            func.concat_ws(
+                " ", usuarios.c.primer_nombre, usuarios.c.segundo_nombre, usuarios.c.tercer_nombre,
+                usuarios.c.primer_apellido, usuarios.c.segundo_apellido, usuarios.c.apellido_casada,
+            ).label("nombre_completo"),
+            prestamo.c.prestamo_id,
+            prestamo.c.codigo_prestamo,
+            prestamo.c.prestamo_estatus_id,
+            prestamo.c.monto_solicitado,
+            prestamo.c.cuotas_pactadas,
+            prestamo.c.porcentaje_interes,
+            cargos.c.prestamo_total,
+            func.coalesce(pagado.c.monto, 0.0).label("monto_pagado"),
+            func.coalesce(pagado.c.pendientes, 0).label("pagos_pendientes"),
+            func.coalesce(calendario.c.saldo_pendiente, 0.0).label("saldo_pendiente"),
+            func.coalesce(calendario.c.saldo_vencido, 0.0).label("saldo_vencido"),
+            func.coalesce(calendario.c.cuotas_pendientes, 0).label("cuotas_pendientes"),
+            func.coalesce(calendario.c.cuotas_vencidas, 0).label("cuotas_vencidas"),
+            proxima.c.pago_id,
+            proxima.c.fecha_pago,
+            proxima.c.monto_pago,
+            proxima.c.saldo_cuota,
+        )
+        .select_from(usuarios)
+        .outerjoin(prestamo, prestamo.c.usuario_id == usuarios.c.usuario_id)
+        .outerjoin(cargos, cargos.c.prestamo_id == prestamo.c.prestamo_id)
+        .outerjoin(pagado, pagado.c.prestamo_id == prestamo.c.prestamo_id)
+        .outerjoin(calendario, calendario.c.prestamo_id == prestamo.c.prestamo_id)
+        .outerjoin(proxima, (proxima.c.prestamo_id == prestamo.c.prestamo_id) & (proxima.c.orden == 1))
+        .where(usuarios.c.usuario_id == usuario_id)
+        .order_by(prestamo.c.prestamo_id)
+    ).mappings().all()
+    if not filas:
+        return None
+
+    prestamos = []
+    for fila in filas:
+        if fila["prestamo_id"] is None:
+            continue  # Cliente sin préstamos
+        prestamo_fila = {c: fila[c] for c in fila.keys() if c not in ("usuario_id", "codigo_cliente", "nombre_completo")}
+        cuota = {c: prestamo_fila.pop(c) for c in ("pago_id", "fecha_pago", "monto_pago", "saldo_cuota")}
+        prestamo_fila["proxima_cuota"] = cuota if cuota["pago_id"] is not None else None
+        prestamos.append(prestamo_fila)
     return {
-        "prestamo_id": prestamo.prestamo_id,
-        "monto_solicitado": prestamo.monto_solicitado,
-        "cuotas_pactadas": prestamo.cuotas_pactadas,
-        "porcentaje_interes": prestamo.porcentaje_interes,
-        "pagos_realizados": pagos_realizados,
-        "pagos_futuros": pagos_futuros,
-        "proximo_pago": {
-            "total_pago": total_pago,
-            "fecha_pago": pagos_futuros[0].fecha_pago if pagos_futuros else None
-        }
+        "usuario_id": filas[0]["usuario_id"],
+        "codigo_cliente": filas[0]["codigo_cliente"],
+        "nombre_completo": filas[0]["nombre_completo"],
+        "prestamos": prestamos,
+        "totales": {
+            "prestamos": len(prestamos),
+            **{
+                campo: sum(p[campo] for p in prestamos)
+                for campo in ("monto_pagado", "saldo_pendiente", "saldo_vencido", "cuotas_vencidas")
+            },
+        },
     }
 
 
+@router.get("/{usuario_id}/resumen", response_model=schemas.ResumenCliente)
+def obtener_resumen_cliente(usuario_id: int, db: Session = Depends(database.get_read_db)):
+    # Posición del cliente en una petición, en lugar de un /detalle por préstamo
+    resumen = consultar_resumen(db, usuario_id, date.today())
+    if resumen is None:
+        raise HTTPException(status_code=404, detail="Usuario no encontrado")
+    return resumen
+
+
+def _insertar_pago(db: Session, origen, **valores):
+    # Un solo INSERT ... SELECT ... RETURNING: el prestamo_id sale de la
+    # consulta `origen` y el correlativo de la secuencia, sin leer pagos previos
+    correlativo = correlativos.siguiente(db)
+    if correlativo is not None:
+        valores["pago_realizado_correlativo"] = correlativo
+    columnas = ["prestamo_id", *valores]
+    nuevo_pago = (
+        insert(models.PagosRealizados)
+        .from_select(columnas, origen.add_columns(*(literal(v) for v in valores.values())).limit(1))
+        .returning(models.PagosRealizados.pago_realizado_id, models.PagosRealizados.prestamo_id)
+    )
+    try:
+        pago = db.execute(nuevo_pago).first()
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="El código de transacción ya fue registrado")
+    if pago:
+        cache.invalidar_prestamos(pago.prestamo_id)
+    return pago
+
+
 @router.post("/pagos/comprobante-general")
 def registrar_comprobante_pago(
     comprobante: schemas.ComprobantePagoRequest, db: Session = Depends(database.get_db)
 ):
-    prestamo = db.query(models.Prestamos).filter(models.Prestamos.codigo_prestamo == comprobante.codigo_prestamo).first()
-    if not prestamo:
-        raise HTTPException(status_code=404, detail="Préstamo no encontrado")
-    
-    # Aquí generas un correlativo, lo cual está bien para pago_realizado_correlativo.
-    ultimo_pago = db.query(models.PagosRealizados).order_by(models.PagosRealizados.pago_realizado_id.desc()).first()
-    correlativo = f"PAGO-{(ultimo_pago.pago_realizado_id + 1) if ultimo_pago else 1}"
-
-    # Sin embargo, verifica que no estás intentando establecer manualmente pago_realizado_id.
-    nuevo_pago = models.PagosRealizados(
-        prestamo_id=prestamo.prestamo_id,
+    pago = _insertar_pago(
+        db,
+        select(models.Prestamos.prestamo_id).where(models.Prestamos.codigo_prestamo == comprobante.codigo_prestamo),
         pago_realizado_fecha_creacion=datetime.now(),
         pago_realizado_monto_pagado=comprobante.monto_pagado,
         codigo_transaccion=comprobante.codigo_transaccion,
         estado="pendiente",
-        pago_realizado_correlativo=correlativo  # Esto está bien
     )
-    db.add(nuevo_pago)  # pago_realizado_id se genera automáticamente aquí.
-    db.commit()
-    db.refresh(nuevo_pago)
-    return {"message": "Comprobante registrado exitosamente", "pago_realizado_id": nuevo_pago.pago_realizado_id}
-
+    if not pago:
+        raise HTTPException(status_code=404, detail="Préstamo no encontrado")
+    return {"message": "Comprobante registrado exitosamente", "pago_realizado_id": pago.pago_realizado_id}
+
+
+
+def actualizar_estatus_prestamos(db: Session, prestamo_ids) -> list:
+    # Solo cambian los préstamos aprobados o en mora: los que tienen saldo
+    # vencido (cuotas vencidas que los pagos aprobados no cubren) pasan a en
+    # mora y vuelven a aprobado cuando se cubre o cuando ya no tienen cuotas
+    # impagas. Los pendientes o denegados conservan su estatus aunque no
+    # tengan calendario (aprobarlos es aprobar_prestamo). Una sola sentencia para
+    # cualquier cantidad de préstamos. Devuelve los ids que cambiaron y los
+    # cambios quedan en la auditoría.
+    if not prestamo_ids:
+        return []
+    aprobado = catalogos.estatus_id("aprobado")
+    en_mora = catalogos.estatus_id("en mora")
+    ids = list(prestamo_ids)
+    prestamo = models.Prestamos
+    futuros = models.PagosFuturos
+    realizados = models.PagosRealizados
+    # Cada suma se calcula una vez por préstamo (solo filas de los préstamos
+    # del lote, por los índices prestamo_id + estado)
+    vencido = (
+        select(futuros.prestamo_id, func.sum(futuros.monto_pago).label("monto"))
+        .where(futuros.prestamo_id.in_(ids), futuros.estado == "vencido")
+        .group_by(futuros.prestamo_id)
+        .subquery("vencido")
+    )
+    pagado = (
+        select(realizados.prestamo_id, func.sum(realizados.pago_realizado_monto_pagado).label("monto"))
+        .where(realizados.prestamo_id.in_(ids), realizados.estado == "aprobado")
+        .group_by(realizados.prestamo_id)
+        .subquery("pagado")
+    )
+    cuotas_impagas = exists().where(
+        futuros.prestamo_id == prestamo.prestamo_id, futuros.estado.in_(models.CUOTAS_IMPAGAS),
+    )
+    saldo_vencido = func.coalesce(vencido.c.monto, 0.0) - func.coalesce(pagado.c.monto, 0.0)
+    estatus = prestamo.prestamo_estatus_id
+    calculo = (
+        select(
+            prestamo.prestamo_id,
+            estatus.label("anterior"),
+            case(
+                (estatus.in_([aprobado, en_mora]) & ~cuotas_impagas, aprobado),
+                (estatus.in_([aprobado, en_mora]) & (saldo_vencido > TOLERANCIA_MORA), en_mora),
+                (estatus == en_mora, aprobado),
+                else_=estatus,
+            ).label("estatus"),
+        )
+        .outerjoin(vencido, vencido.c.prestamo_id == prestamo.prestamo_id)
+        .outerjoin(pagado, pagado.c.prestamo_id == prestamo.prestamo_id)
+        .where(prestamo.prestamo_id.in_(ids))
+        .subquery("calculo")
+    )
+    cambios = db.execute(
+        update(prestamo)
+        .where(prestamo.prestamo_id == calculo.c.prestamo_id, estatus.is_distinct_from(calculo.c.estatus))
+        .values(prestamo_estatus_id=calculo.c.estatus)
+        .returning(prestamo.prestamo_id, calculo.c.anterior, prestamo.prestamo_estatus_id)
+        .execution_options(synchronize_session=False)
+    ).all()
+    auditoria.registrar(db, "prestamo", "prestamo_estatus_id", cambios)
+    return [cambio.prestamo_id for cambio in cambios]
 
 
 @router.put("/pagos/{pago_realizado_id}/validar")
@@ -318,71 +733,44 @@ def validar_comprobante(
     if not pago:
         raise HTTPException(status_code=404, detail="Pago no encontrado")
     
+    estado_anterior = pago.estado
     if estado.aprobado:
         pago.estado = "aprobado"
-        # Actualizar estado del préstamo si todas las cuotas están pagadas
-        prestamo = db.query(models.Prestamos).filter(models.Prestamos.prestamo_id == pago.prestamo_id).first()
-        pagos_futuros = db.query(models.PagosFuturos).filter(models.PagosFuturos.prestamo_id == prestamo.prestamo_id, models.PagosFuturos.estado == "pendiente").all()
-        if not pagos_futuros:
-            prestamo.prestamo_estatus_id = 1  # Estatus aprobado
+        # Actualizar estado del préstamo si todas las cuotas están pagadas o
+        # si el pago cubre su saldo vencido
+        db.flush()
+        actualizar_estatus_prestamos(db, [pago.prestamo_id])
     else:
         pago.estado = "rechazado"
+    auditoria.registrar(db, "pago", "estado", [(pago_realizado_id, estado_anterior, pago.estado)])
 
+    prestamo_id = pago.prestamo_id
     db.commit()
+    cache.invalidar_prestamos(prestamo_id)
     return {"message": f"Comprobante {'aprobado' if estado.aprobado else 'rechazado'} exitosamente"}
 
-@router.get("/prestamos/{codigo_prestamo}/detalle", response_model=schemas.PrestamoDetalle)
-def obtener_detalle_prestamo(codigo_prestamo: str, db: Session = Depends(database.get_db)):
-    prestamo = db.query(models.Prestamos).filter(models.Prestamos.codigo_prestamo == codigo_prestamo).first()
-
-    if not prestamo:
-        raise HTTPException(status_code=404, detail="Préstamo no encontrado")
-
-    pagos_realizados = db.query(models.PagosRealizados).filter(models.PagosRealizados.prestamo_id == prestamo.prestamo_id).all()
-    pagos_futuros = db.query(models.PagosFuturos).filter(models.PagosFuturos.prestamo_id == prestamo.prestamo_id).all()
-
-    return {
-        "prestamo": prestamo,
-        "pagos_realizados": pagos_realizados,
-        "pagos_futuros": pagos_futuros
-    }
-
-
 @router.post("/pagos/{pago_id}/registrar-cuota", response_model=schemas.RegistroComprobanteResponse)
 def registrar_comprobante_pago(
     pago_id: int,
     comprobante: schemas.RegistroComprobante,
     db: Session = Depends(database.get_db),
 ):
-    # Buscar el pago futuro relacionado
-    pago = db.query(models.PagosFuturos).filter(models.PagosFuturos.pago_id == pago_id).first()
-
-    if not pago:
-        raise HTTPException(status_code=404, detail="Pago futuro no encontrado")
-
-    # Obtener el último pago realizado para generar el correlativo
-    ultimo_pago = db.query(models.PagosRealizados).order_by(models.PagosRealizados.pago_realizado_id.desc()).first()
-    correlativo = f"PAGO-{(ultimo_pago.pago_realizado_id + 1) if ultimo_pago else 1}"
-
-    # Crear un nuevo registro en pagos realizados
-    nuevo_pago_realizado = models.PagosRealizados(
-        prestamo_id=pago.prestamo_id,
+    # Crear el pago realizado a partir del pago futuro relacionado
+    pago = _insertar_pago(
+        db,
+        select(models.PagosFuturos.prestamo_id).where(models.PagosFuturos.pago_id == pago_id),
         pago_realizado_fecha_creacion=datetime.now(),  # Fecha actual como creación
         pago_realizado_fecha_pago=comprobante.fecha_pago,
         pago_realizado_monto_pagado=comprobante.monto_pagado,
         codigo_transaccion=comprobante.codigo_transaccion,
         estado="pendiente",  # Estado inicial del pago
-        pago_realizado_correlativo=correlativo,  # Correlativo generado
     )
-
-    # Guardar el nuevo pago en la base de datos
-    db.add(nuevo_pago_realizado)
-    db.commit()
-    db.refresh(nuevo_pago_realizado)
+    if not pago:
+        raise HTTPException(status_code=404, detail="Pago futuro no encontrado")
 
     return {
         "message": "Comprobante registrado con estado pendiente",
-        "pago_realizado_id": nuevo_pago_realizado.pago_realizado_id,
+        "pago_realizado_id": pago.pago_realizado_id,
     }
 
 
@@ -398,9 +786,14 @@ def aprobar_pago(pago_realizado_id: int, db: Session = Depends(database.get_db))
     if pago_realizado.estado != "pendiente":
         raise HTTPException(status_code=400, detail="Solo se pueden aprobar pagos pendientes")
 
-    # Actualizar estado a aprobado
+    # Actualizar estado a aprobado; el pago puede sacar al préstamo de mora
     pago_realizado.estado = "aprobado"
+    prestamo_id = pago_realizado.prestamo_id
+    auditoria.registrar(db, "pago", "estado", [(pago_realizado_id, "pendiente", "aprobado")])
+    db.flush()
+    actualizar_estatus_prestamos(db, [prestamo_id])
     db.commit()
+    cache.invalidar_prestamos(prestamo_id)
 
     return {
         "message": "Pago aprobado exitosamente",
@@ -420,9 +813,90 @@ def denegar_pago(pago_realizado_id: int, db: Session = Depends(database.get_db))
 
     # Actualizar estado a denegado
     pago_realizado.estado = "denegado"
+    prestamo_id = pago_realizado.prestamo_id
+    auditoria.registrar(db, "pago", "estado", [(pago_realizado_id, "pendiente", "denegado")])
     db.commit()
+    cache.invalidar_prestamos(prestamo_id)
 
     return {
         "message": "Pago denegado exitosamente",
         "pago_realizado_id": pago_realizado.pago_realizado_id
-    }
\ No newline at end of file
+    }
+
+@router.post("/pagos/decisiones", response_model=schemas.DecisionesPagosResponse)
+def decidir_pagos(solicitud: schemas.DecisionesPagos, db: Session = Depends(database.get_db)):
+    # Aprobación/denegación por lote: un UPDATE ... WHERE estado = 'pendiente'
+    # RETURNING para todos los pagos y una sola sentencia para el estatus de
+    # los préstamos con pagos aprobados
+    unicas = {}
+    for decision in solicitud.decisiones:
+        unicas.setdefault(decision.pago_realizado_id, decision.decision)
+
+    pagos = models.PagosRealizados.__table__
+    decisiones = values(
+        column("pago_realizado_id", Integer), column("decision", String), name="decisiones",
+    ).data(list(unicas.items()))
+    cambiados = (
+        update(pagos)
+        .where(pagos.c.pago_realizado_id == decisiones.c.pago_realizado_id, pagos.c.estado == "pendiente")
+        .values(estado=decisiones.c.decision)
+        .returning(pagos.c.pago_realizado_id, pagos.c.prestamo_id, pagos.c.estado)
+        .cte("cambiados")
+    )
+    # pagos_realizados fuera del CTE se ve como antes del UPDATE: sirve para
+    # informar el estado de los que no cambiaron
+    filas = db.execute(
+        select(
+            decisiones.c.pago_realizado_id,
+            cambiados.c.estado.label("nuevo_estado"),
+            func.coalesce(cambiados.c.prestamo_id, pagos.c.prestamo_id).label("prestamo_id"),
+            pagos.c.pago_realizado_id.label("existente"),
+            pagos.c.estado.label("estado_anterior"),
+        )
+        .select_from(decisiones)
+        .outerjoin(cambiados, cambiados.c.pago_realizado_id == decisiones.c.pago_realizado_id)
+        .outerjoin(pagos, pagos.c.pago_realizado_id == decisiones.c.pago_realizado_id)
+    ).all()
+
+    resultados = {}
+    aprobados, afectados = set(), set()
+    aplicados = 0
+    for fila in filas:
+        if fila.nuevo_estado is not None:
+            aplicados += 1
+            resultado, estado = fila.nuevo_estado, fila.nuevo_estado
+            afectados.add(fila.prestamo_id)
+            if fila.nuevo_estado == "aprobado":
+                aprobados.add(fila.prestamo_id)
+        elif fila.existente is None:
+            resultado, estado = "no_encontrado", None
+        else:
+            resultado, estado = "no_pendiente", fila.estado_anterior
+        resultados[fila.pago_realizado_id] = {
+            "pago_realizado_id": fila.pago_realizado_id, "resultado": resultado, "estado": estado,
+            "prestamo_id": fila.prestamo_id,
+        }
+
+    aprobados.discard(None)
+    afectados.discard(None)
+    auditoria.registrar(db, "pago", "estado", [
+        (fila.pago_realizado_id, "pendiente", fila.nuevo_estado) for fila in filas if fila.nuevo_estado is not None
+    ])
+    actualizados = actualizar_estatus_prestamos(db, aprobados)
+    db.commit()
+    cache.invalidar_prestamos(*afectados)
+
+    # Un resultado por elemento, en el orden de la solicitud
+    respuesta, vistos = [], set()
+    for decision in solicitud.decisiones:
+        resultado = resultados[decision.pago_realizado_id]
+        if decision.pago_realizado_id in vistos:
+            resultado = {**resultado, "resultado": "duplicado"}
+        vistos.add(decision.pago_realizado_id)
+        respuesta.append(resultado)
+    return {
+        "procesados": len(solicitud.decisiones),
+        "aplicados": aplicados,
+        "prestamos_actualizados": sorted(actualizados),
+        "resultados": respuesta,
+    }
@@ -0,0 +1,384 @@
+# exportacion.py
+# Exportación de la cartera para el cierre de mes, en CSV o Parquet.
+#
+# Tres niveles de detalle:
+#
+#   prestamos  una fila por préstamo con cliente, cargos y resumen de cuotas
+#              (pagos_futuros) y comprobantes (pagos_realizados)
+#   cuotas     una fila por cuota, con datos del préstamo y del cliente
+#   pagos      una fila por comprobante, con datos del préstamo y del cliente
+#
+# columnas elige qué columnas salen (y solo se hacen los JOIN que esas
+# columnas necesitan). desde/hasta filtran por fecha_pago de las cuotas y de
+# los comprobantes; en prestamos limitan las cuotas y pagos que entran al
+# resumen, sin quitar préstamos.
+#
+# Todo se lee de la réplica y se envía por trozos a medida que llega: la
+# memoria no depende del total de filas. El CSV lo arma el servidor con
+# COPY (consulta) TO STDOUT (unas 6 veces más rápido que formatear las filas
+# en Python). Parquet lee con un cursor del lado del servidor por bloques de
+# TAMANO_BLOQUE filas y cada bloque es un row group; necesita pyarrow
+# (opcional, solo para este formato).
+#
+#   python -m app.exportacion prestamos --salida cartera.csv
+#   python -m app.exportacion cuotas --formato parquet --salida cuotas.parquet \
+#       --desde 2024-01-01 --hasta 2024-01-31 --columnas pago_id,prestamo_id,fecha_pago,monto_pago,estado
+import argparse
+import io
+import queue
+import sys
+import threading
+from datetime import date, datetime, timedelta
+from typing import Iterator, List, Optional
+
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from sqlalchemy import String, func, select, text
+
+from . import database, models
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Solo hace falta para formato=parquet
+    pa = pq = None
+
+router = APIRouter()
+
+TAMANO_BLOQUE = 50000
+TAMANO_TROZO = 1 << 20  # Bytes de CSV por trozo enviado
+TABLAS = ("prestamos", "cuotas", "pagos")
+FORMATOS = {"csv": "text/csv", "parquet": "application/vnd.apache.parquet"}
+
+prestamo = models.Prestamos.__table__
+usuarios = models.User.__table__
+cargos = models.CargosAdmin.__table__
+cuotas = models.PagosFuturos.__table__
+pagos = models.PagosRealizados.__table__
+
+
+def _en_rango(columna, desde: Optional[date], hasta: Optional[date]) -> list:
+    filtros = []
+    if desde is not None:
+        filtros.append(columna >= desde)
+    if hasta is not None:
+        # hasta incluye todo el día también en columnas DateTime
+        filtros.append(columna < hasta + timedelta(days=1))
+    return filtros
+
+
+def _resumen_cuotas(desde, hasta):
+    pendiente = cuotas.c.estado.in_(models.CUOTAS_IMPAGAS)
+    return (
+        select(
+            cuotas.c.prestamo_id,
+            func.count().label("cuotas"),
+            func.count().filter(pendiente).label("cuotas_pendientes"),
+            func.sum(cuotas.c.monto_pago).label("monto_cuotas"),
+            func.sum(cuotas.c.monto_pago).filter(pendiente).label("saldo_pendiente"),
+            func.min(cuotas.c.fecha_pago).filter(pendiente).label("proxima_cuota"),
+        )
+        .where(*_en_rango(cuotas.c.fecha_pago, desde, hasta))
+        .group_by(cuotas.c.prestamo_id)
+        .subquery("resumen_cuotas")
+    )
+
+
+def _resumen_pagos(desde, hasta):
+    return (
+        select(
+            pagos.c.prestamo_id,
+            func.count().label("pagos"),
+            func.count().filter(pagos.c.estado == "pendiente").label("pagos_pendientes"),
+            func.sum(pagos.c.pago_realizado_monto_pagado).filter(pagos.c.estado == "aprobado").label("monto_pagado"),
+            func.max(pagos.c.pago_realizado_fecha_pago).label("ultimo_pago"),
+        )
+        .where(*_en_rango(pagos.c.pago_realizado_fecha_pago, desde, hasta))
+        .group_by(pagos.c.prestamo_id)
+        .subquery("resumen_pagos")
+    )
+
+
+def _columnas(tabla: str, resumenes: dict) -> dict:
+    # nombre -> (fuente, expresión); la fuente indica el JOIN que necesita
+    nombre_completo = func.concat_ws(
+        " ", usuarios.c.primer_nombre, usuarios.c.segundo_nombre, usuarios.c.tercer_nombre,
+        usuarios.c.primer_apellido, usuarios.c.segundo_apellido, usuarios.c.apellido_casada,
+        type_=String,
+    )
+    columnas = {}
+    if tabla != "prestamos":
+        # Las columnas de la fila (cuota o comprobante) van primero
+        columnas.update({c.name: ("base", c) for c in (cuotas if tabla == "cuotas" else pagos).c})
+    columnas.update({
+        "prestamo_id": columnas.get("prestamo_id", ("prestamo", prestamo.c.prestamo_id)),
+        "codigo_prestamo": ("prestamo", prestamo.c.codigo_prestamo),
+        "usuario_id": ("prestamo", prestamo.c.usuario_id),
+        "prestamo_estatus_id": ("prestamo", prestamo.c.prestamo_estatus_id),
+        "monto_solicitado": ("prestamo", prestamo.c.monto_solicitado),
+        "cuotas_pactadas": ("prestamo", prestamo.c.cuotas_pactadas),
+        "porcentaje_interes": ("prestamo", prestamo.c.porcentaje_interes),
+        "codigo_cliente": ("usuario", usuarios.c.codigo_cliente),
+        "cui": ("usuario", usuarios.c.cui),
+        "nombre_completo": ("usuario", nombre_completo),
+        "prestamo_iva": ("cargos", cargos.c.prestamo_iva),
+        "prestamo_cargos_administrativos": ("cargos", cargos.c.prestamo_cargos_administrativos),
+        "prestamo_total": ("cargos", cargos.c.prestamo_total),
+    })
+    if tabla == "prestamos":
+        columnas["motivo_prestamo"] = ("prestamo", prestamo.c.motivo_prestamo)
+        for fuente, resumen in resumenes.items():
+            columnas.update({c.name: (fuente, c) for c in resumen.c if c.name != "prestamo_id"})
+    return columnas
+
+
+def columnas_disponibles(tabla: str) -> List[str]:
+    return list(_columnas(tabla, {"cuotas": _resumen_cuotas(None, None), "pagos": _resumen_pagos(None, None)}))
+
+
+def construir_consulta(tabla: str, columnas: Optional[List[str]] = None, desde=None, hasta=None):
+    # ValueError si la tabla o alguna columna no existe
+    if tabla not in TABLAS:
+        raise ValueError("La tabla debe ser 'prestamos', 'cuotas' o 'pagos'")
+    resumenes = {"cuotas": _resumen_cuotas(desde, hasta), "pagos": _resumen_pagos(desde, hasta)}
+    disponibles = _columnas(tabla, resumenes)
+    columnas = columnas or list(disponibles)
+    desconocidas = [c for c in columnas if c not in disponibles]
+    if desconocidas:
+        raise ValueError(f"Columnas desconocidas: {', '.join(desconocidas)}. Disponibles: {', '.join(disponibles)}")
+
+    fuentes = {disponibles[c][0] for c in columnas}
+    consulta = select(*(disponibles[c][1].label(c) for c in columnas))
+    if tabla == "prestamos":
+        desde_tabla = prestamo
+        for fuente, resumen in resumenes.items():
+            if fuente in fuentes:
+                desde_tabla = desde_tabla.outerjoin(resumen, resumen.c.prestamo_id == prestamo.c.prestamo_id)
+    else:
+        base = cuotas if tabla == "cuotas" else pagos
+        fecha = base.c.fecha_pago if tabla == "cuotas" else base.c.pago_realizado_fecha_pago
+        consulta = consulta.where(*_en_rango(fecha, desde, hasta))
+        desde_tabla = base
+        if fuentes & {"prestamo", "usuario", "cargos"}:
+            desde_tabla = desde_tabla.join(prestamo, prestamo.c.prestamo_id == base.c.prestamo_id)
+    if "usuario" in fuentes:
+        desde_tabla = desde_tabla.outerjoin(usuarios, usuarios.c.usuario_id == prestamo.c.usuario_id)
+    if "cargos" in fuentes:
+        desde_tabla = desde_tabla.outerjoin(cargos, cargos.c.prestamo_id == prestamo.c.prestamo_id)
+    # Sin ORDER BY: las filas salen en el orden en que las produce el plan
+    return consulta.select_from(desde_tabla)
+
+
+def _bloques(consulta, tamano_bloque: int) -> Iterator[list]:
+    # Sesión propia de la réplica; yield_per usa un cursor del lado del servidor
+    with database.SessionLectura() as db:
+        resultado = db.execute(consulta.execution_options(yield_per=tamano_bloque))
+        for bloque in resultado.partitions():
+            yield bloque
+
+
+def _copiar_psycopg2(conexion, cursor, sql: str) -> Iterator[bytes]:
+    # copy_expert escribe en un archivo: un hilo hace el COPY y pasa los trozos
+    # por una cola acotada, así el COPY espera si el cliente lee lento
+    trozos = queue.Queue(maxsize=4)
+    fin = object()
+
+    class Destino:
+        def __init__(self):
+            self.partes, self.tamano = [], 0
+
+        def write(self, datos):
+            self.partes.append(datos)
+            self.tamano += len(datos)
+            if self.tamano >= TAMANO_TROZO:
+                self.enviar()
+
+        def enviar(self):
+            if self.partes:
+                trozos.put(b"".join(self.partes))
+                self.partes, self.tamano = [], 0
+
+    def copiar():
+        destino = Destino()
+        try:
+            cursor.copy_expert(sql, destino)
+            destino.enviar()
+            trozos.put(fin)
+        except Exception as e:
+            trozos.put(e)
+
+    hilo = threading.Thread(target=copiar, daemon=True)
+    hilo.start()
+    terminado = False
+    try:
+        while True:
+            trozo = trozos.get()
+            if trozo is fin:
+                terminado = True
+                return
+            if isinstance(trozo, Exception):
+                terminado = True
+                raise trozo
+            yield trozo
+    finally:
+        if not terminado:
+            # El cliente se fue: se cancela el COPY y se vacía la cola hasta
+            # que el hilo termina (con el error de la cancelación o con fin si el
+            # COPY ya había terminado)
+            conexion.cancel()
+            trozo = None
+            while trozo is not fin and not isinstance(trozo, Exception):
+                trozo = trozos.get()
+        hilo.join()
+
+
+def _csv(consulta, tamano_bloque: int) -> Iterator[bytes]:
+    # tamano_bloque no aplica: COPY envía las filas a medida que las produce
+    with database.SessionLectura() as db:
+        # Es una sola sentencia para toda la exportación
+        db.execute(text("SET LOCAL statement_timeout = 0"))
+        compilada = consulta.compile(dialect=db.get_bind().dialect)
+        sql = f"COPY ({compilada}) TO STDOUT WITH (FORMAT csv, HEADER)"
+        conexion = db.connection().connection.driver_connection
+        cursor = conexion.cursor()
+        try:
+            if hasattr(cursor, "copy_expert"):  # psycopg2
+                yield from _copiar_psycopg2(conexion, cursor, cursor.mogrify(sql, compilada.params).decode())
+            else:  # psycopg 3
+                with cursor.copy(sql, compilada.params) as copia:
+                    partes, tamano = [], 0
+                    for datos in copia:
+                        partes.append(bytes(datos))
+                        tamano += len(datos)
+                        if tamano >= TAMANO_TROZO:
+                            yield b"".join(partes)
+                            partes, tamano = [], 0
+                    if partes:
+                        yield b"".join(partes)
+        finally:
+            cursor.close()
+
+
+def _tipo_arrow(columna):
+    tipo = columna.type.python_type
+    if tipo is datetime:
+        return pa.timestamp("us")
+    if tipo is date:
+        return pa.date32()
+    return {int: pa.int64(), float: pa.float64(), bool: pa.bool_()}.get(tipo, pa.string())
+
+
+class _Salida(io.RawIOBase):
+    # Destino de ParquetWriter: guarda lo escrito hasta que se envía
+    def __init__(self):
+        super().__init__()
+        self.trozos = []
+        self.posicion = 0
+
+    def writable(self):
+        return True
+
+    def write(self, datos):
+        self.trozos.append(bytes(datos))
+        self.posicion += len(datos)
+        return len(datos)
+
+    def tell(self):
+        return self.posicion
+
+    def vaciar(self) -> bytes:
+        datos = b"".join(self.trozos)
+        self.trozos.clear()
+        return datos
+
+
+def _parquet(consulta, tamano_bloque: int) -> Iterator[bytes]:
+    esquema = pa.schema([(c.name, _tipo_arrow(c)) for c in consulta.selected_columns])
+    salida = _Salida()
+    escritor = pq.ParquetWriter(salida, esquema, compression="snappy")
+    try:
+        for bloque in _bloques(consulta, tamano_bloque):
+            columnas = list(zip(*bloque))
+            escritor.write_table(pa.Table.from_arrays(
+                [pa.array(valores, type=campo.type) for valores, campo in zip(columnas, esquema)], schema=esquema,
+            ))
+            yield salida.vaciar()
+    finally:
+        escritor.close()
+    # Pie del archivo (metadatos); sin filas el archivo solo tiene el esquema
+    yield salida.vaciar()
+
+
+def exportar(consulta, formato: str = "csv", tamano_bloque: int = TAMANO_BLOQUE) -> Iterator[bytes]:
+    if formato not in FORMATOS:
+        raise ValueError("Formato debe ser 'csv' o 'parquet'")
+    if formato == "parquet":
+        if pa is None:
+            raise ValueError("El formato parquet necesita pyarrow (pip install pyarrow)")
+        return _parquet(consulta, tamano_bloque)
+    return _csv(consulta, tamano_bloque)
+
+
+# --- API -------------------------------------------------------------------------
+
+@router.get("/exportaciones/{tabla}")
+def exportar_cartera(
+    tabla: str,
+    formato: str = "csv",
+    columnas: Optional[str] = Query(None, description="Nombres separados por coma"),
+    desde: Optional[date] = None,
+    hasta: Optional[date] = None,
+    tamano_bloque: int = Query(
+        TAMANO_BLOQUE, ge=1000, le=500000, description="Filas por row group; solo aplica a formato=parquet",
+    ),
+):
+    try:
+        consulta = construir_consulta(tabla, columnas.split(",") if columnas else None, desde, hasta)
+        contenido = exportar(consulta, formato, tamano_bloque)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return StreamingResponse(
+        contenido,
+        media_type=FORMATOS[formato],
+        headers={"Content-Disposition": f'attachment; filename="{tabla}.{formato}"'},
+        # Si el cliente se desconecta StreamingResponse deja el generador sin
+        # cerrar; close() cancela el COPY y devuelve la conexión
+        background=BackgroundTask(contenido.close),
+    )
+
+
+# --- CLI -------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Exportación de la cartera en CSV o Parquet")
+    parser.add_argument("tabla", choices=TABLAS)
+    parser.add_argument("--formato", choices=list(FORMATOS), default=None)
+    parser.add_argument("--salida", default="-", help="Archivo de salida ('-' para stdout)")
+    parser.add_argument("--columnas", default=None, help="Nombres separados por coma")
+    parser.add_argument("--desde", type=date.fromisoformat, default=None)
+    parser.add_argument("--hasta", type=date.fromisoformat, default=None)
+    parser.add_argument("--bloque", type=int, default=TAMANO_BLOQUE)
+    parser.add_argument("--listar-columnas", action="store_true")
+    args = parser.parse_args()
+
+    if args.listar_columnas:
+        print("\n".join(columnas_disponibles(args.tabla)))
+        return
+    formato = args.formato or ("parquet" if args.salida.endswith(".parquet") else "csv")
+    try:
+        consulta = construir_consulta(
+            args.tabla, args.columnas.split(",") if args.columnas else None, args.desde, args.hasta,
+        )
+        contenido = exportar(consulta, formato, args.bloque)
+    except ValueError as e:
+        parser.error(str(e))
+
+    salida = sys.stdout.buffer if args.salida == "-" else open(args.salida, "wb")
+    with salida:
+        for trozo in contenido:
+            salida.write(trozo)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,52 @@
 # main.py
+import logging
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from . import crud, models, database
+from sqlalchemy.exc import SQLAlchemyError
+from . import (
+    crud, models, database, asincrono, carga_masiva, amortizacion, recalculo, catalogos, metricas, conciliacion,
+    morosidad, contadores, busqueda, exportacion, vencimientos, auditoria, recepcion, puntaje,
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Catálogos en memoria desde el arranque; si la base de datos no responde
+    # se cargan en segundo plano con el primer uso
+    try:
+        await run_in_threadpool(catalogos.cargar)
+    except SQLAlchemyError:
+        logging.getLogger(__name__).exception("No se pudieron cargar los catálogos al iniciar")
+    # Vencimiento de cuotas en segundo plano (VENCIMIENTOS_INTERVALO=0 lo desactiva)
+    vencimientos.programador.iniciar()
+    # Trabajadores de la cola de solicitudes; también en modo directo, para
+    # terminar lo que haya quedado en cola (SOLICITUDES_TRABAJADORES=0 los desactiva)
+    recepcion.trabajadores.iniciar()
+    yield
+    await run_in_threadpool(recepcion.trabajadores.detener)
+    await run_in_threadpool(vencimientos.programador.detener)
+    # Escribir los eventos de auditoría que sigan en cola
+    await run_in_threadpool(auditoria.escritor.detener)
+
 
 # Crear la aplicación FastAPI
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+
+# Métricas por ruta, SQL y pool de conexiones en GET /metrics
+metricas.instrumentar_engine(database.engine)
+if database.engine_lectura is not database.engine:
+    metricas.instrumentar_engine(database.engine_lectura, "lectura")
+if database.ASYNC:
+    metricas.instrumentar_engine(database.async_engine, "async")
+    if database.async_engine_lectura is not database.async_engine:
+        metricas.instrumentar_engine(database.async_engine_lectura, "async_lectura")
+app.add_middleware(metricas.MiddlewareMetricas)
+# Usuario (X-Usuario) y ruta de cada cambio de estado para la auditoría
+app.add_middleware(auditoria.MiddlewareAuditoria)
+app.add_api_route("/metrics", metricas.endpoint_metricas, include_in_schema=False)
+app.add_api_route("/metrics/consultas-lentas", metricas.endpoint_consultas_lentas, include_in_schema=False)
 
 # Configuración de CORS
 app.add_middleware(
@@ -15,8 +57,15 @@ app.add_middleware(
     allow_headers=["*"],  # Permitir todos los encabezados
 )
 
-# Incluir el enrutador de usuarios
-app.include_router(crud.router, prefix="/usuarios", tags=["usuarios"])
+# Incluir los enrutadores de usuarios (versiones async def si DB_MODO=async)
+for router in (
+    crud.router, carga_masiva.router, amortizacion.router, recalculo.router, catalogos.router,
+    conciliacion.router, morosidad.router, contadores.router, busqueda.router,
+    exportacion.router, vencimientos.router, auditoria.router, recepcion.router, puntaje.router,
+):
+    if database.ASYNC:
+        router = asincrono.convertir_router(router)
+    app.include_router(router, prefix="/usuarios", tags=["usuarios"])
 
 # Ruta raíz
 @app.get("/")
@@ -0,0 +1,280 @@
+# metricas.py
+# Métricas de la API en formato Prometheus (GET /metrics):
+#
+#   - latencia por ruta (histograma) y peticiones por código de estado
+#   - sentencias SQL y tiempo en SQL por petición (histogramas por ruta)
+#   - consultas lentas (más de METRICAS_SQL_LENTA_MS ms): solo el total; las
+#     últimas muestras con su SQL están en GET /metrics/consultas-lentas (JSON)
+#   - pool de conexiones: tamaño, en uso, overflow, checkouts, conexiones
+#     nuevas y lo que tardan en abrirse, errores al conectar y pool agotado
+#
+# El pool se mide con eventos de SQLAlchemy registrados en el engine: siguen
+# activos después de engine.dispose() y funcionan igual con NullPool
+# (DB_PGBOUNCER), donde cada checkout abre una conexión nueva.
+#
+# La ruta se etiqueta con su plantilla (/usuarios/prestamos/{prestamo_id}),
+# no con la URL, para que la cantidad de series no crezca con los ids. Cada
+# petición solo guarda un contador de SQL en un ContextVar; los hilos del
+# threadpool y run_sync heredan el contexto y suman sobre el mismo objeto.
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextvars import ContextVar
+from datetime import datetime
+
+from fastapi.responses import PlainTextResponse
+from sqlalchemy import event, exc
+
+SQL_LENTA = float(os.getenv("METRICAS_SQL_LENTA_MS", "200")) / 1000
+MUESTRAS_LENTAS = 20
+
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BUCKETS_SQL = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+
+_lock = threading.Lock()
+
+
+class Histograma:
+    __slots__ = ("buckets", "conteos", "suma", "total")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.conteos = [0] * (len(buckets) + 1)
+        self.suma = 0.0
+        self.total = 0
+
+    def observar(self, valor):
+        self.conteos[bisect_left(self.buckets, valor)] += 1
+        self.suma += valor
+        self.total += 1
+
+    def exponer(self, nombre: str, etiquetas: str, lineas: list):
+        acumulado = 0
+        for limite, conteo in zip(self.buckets, self.conteos):
+            acumulado += conteo
+            lineas.append(f'{nombre}_bucket{{{etiquetas},le="{limite}"}} {acumulado}')
+        lineas.append(f'{nombre}_bucket{{{etiquetas},le="+Inf"}} {self.total}')
+        lineas.append(f"{nombre}_sum{{{etiquetas}}} {self.suma}")
+        lineas.append(f"{nombre}_count{{{etiquetas}}} {self.total}")
+
+
+class MetricasRuta:
+    __slots__ = ("latencia", "sql", "tiempo_sql", "estados")
+
+    def __init__(self):
+        self.latencia = Histograma(BUCKETS_SEGUNDOS)
+        self.sql = Histograma(BUCKETS_SQL)
+        self.tiempo_sql = Histograma(BUCKETS_SEGUNDOS)
+        self.estados = {}
+
+
+_rutas = {}  # (método, plantilla) -> MetricasRuta
+_consultas_lentas = deque(maxlen=MUESTRAS_LENTAS)
+_engines = {}  # nombre -> (engine, EstadoPool)
+_totales = {"consultas_lentas": 0, "pool_agotado": 0}
+
+# [sentencias, segundos en SQL] de la petición en curso
+_peticion = ContextVar("metricas_peticion", default=None)
+
+
+def plantilla_ruta(scope) -> str:
+    # Plantilla de la ruta resuelta de la petición (también la usa auditoria.py)
+    ruta = scope.get("route")
+    return getattr(ruta, "path_format", None) or getattr(ruta, "path", None) or "sin_ruta"
+
+
+class MiddlewareMetricas:
+    # Middleware ASGI puro: sin BaseHTTPMiddleware para no envolver la respuesta
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        actual = [0, 0.0]
+        token = _peticion.set(actual)
+        estado = [500]
+
+        async def enviar(mensaje):
+            if mensaje["type"] == "http.response.start":
+                estado[0] = mensaje["status"]
+            await send(mensaje)
+
+        inicio = time.perf_counter()
+        try:
+            await self.app(scope, receive, enviar)
+        except exc.TimeoutError:
+            # QueuePool sin conexiones libres después de DB_POOL_TIMEOUT
+            _totales["pool_agotado"] += 1
+            raise
+        finally:
+            transcurrido = time.perf_counter() - inicio
+            _peticion.reset(token)
+            clave = (scope["method"], plantilla_ruta(scope))
+            with _lock:
+                metricas = _rutas.get(clave)
+                if metricas is None:
+                    metricas = _rutas[clave] = MetricasRuta()
+                metricas.latencia.observar(transcurrido)
+                metricas.sql.observar(actual[0])
+                metricas.tiempo_sql.observar(actual[1])
+                metricas.estados[estado[0]] = metricas.estados.get(estado[0], 0) + 1
+
+
+def _antes_de_ejecutar(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.metricas_inicio = time.perf_counter()
+
+
+def _despues_de_ejecutar(conn, cursor, statement, parameters, context, executemany):
+    inicio = getattr(context, "metricas_inicio", None)
+    if inicio is None:
+        return
+    transcurrido = time.perf_counter() - inicio
+    actual = _peticion.get()
+    if actual is not None:
+        actual[0] += 1
+        actual[1] += transcurrido
+    if transcurrido >= SQL_LENTA:
+        _totales["consultas_lentas"] += 1
+        _consultas_lentas.append((time.time(), transcurrido, " ".join(statement.split())[:500]))
+
+
+class EstadoPool:
+    # Contadores de un engine alimentados por eventos del pool
+    __slots__ = ("en_uso", "checkouts", "conexiones", "errores", "tiempo_conexion")
+
+    def __init__(self):
+        self.en_uso = 0
+        self.checkouts = 0
+        self.conexiones = 0
+        self.errores = 0
+        self.tiempo_conexion = Histograma(BUCKETS_SEGUNDOS)
+
+
+def instrumentar_engine(engine, nombre: str = "principal"):
+    # Eventos de ejecución y del pool de conexiones
+    engine = getattr(engine, "sync_engine", engine)
+    if nombre in _engines:
+        return
+    event.listen(engine, "before_cursor_execute", _antes_de_ejecutar)
+    event.listen(engine, "after_cursor_execute", _despues_de_ejecutar)
+
+    estado = EstadoPool()
+
+    @event.listens_for(engine, "do_connect")
+    def abriendo(dialect, registro, cargs, cparams):
+        registro.info["metricas_conexion"] = time.perf_counter()
+
+    @event.listens_for(engine, "connect")
+    def conectada(dbapi_connection, registro):
+        estado.conexiones += 1
+        inicio = registro.info.pop("metricas_conexion", None)
+        if inicio is not None:
+            estado.tiempo_conexion.observar(time.perf_counter() - inicio)
+
+    @event.listens_for(engine, "checkout")
+    def entregada(dbapi_connection, registro, proxy):
+        estado.checkouts += 1
+        estado.en_uso += 1
+
+    @event.listens_for(engine, "checkin")
+    def devuelta(dbapi_connection, registro):
+        estado.en_uso -= 1
+
+    @event.listens_for(engine, "handle_error")
+    def error(contexto):
+        # Sin conexión: falló al abrirla
+        if contexto.connection is None and not contexto.is_pre_ping:
+            estado.errores += 1
+
+    _engines[nombre] = (engine, estado)
+
+
+def _escapar(valor) -> str:
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+def exponer() -> str:
+    from . import auditoria, cache, catalogos
+
+    lineas = []
+    with _lock:
+        rutas = sorted(_rutas.items())
+        lineas.append("# TYPE http_request_duration_seconds histogram")
+        for (metodo, ruta), m in rutas:
+            m.latencia.exponer("http_request_duration_seconds", f'method="{metodo}",route="{_escapar(ruta)}"', lineas)
+        lineas.append("# TYPE http_requests_total counter")
+        for (metodo, ruta), m in rutas:
+            for estado, total in sorted(m.estados.items()):
+                lineas.append(f'http_requests_total{{method="{metodo}",route="{_escapar(ruta)}",status="{estado}"}} {total}')
+        lineas.append("# TYPE http_request_sql_statements histogram")
+        for (metodo, ruta), m in rutas:
+            m.sql.exponer("http_request_sql_statements", f'method="{metodo}",route="{_escapar(ruta)}"', lineas)
+        lineas.append("# TYPE http_request_sql_seconds histogram")
+        for (metodo, ruta), m in rutas:
+            m.tiempo_sql.exponer("http_request_sql_seconds", f'method="{metodo}",route="{_escapar(ruta)}"', lineas)
+
+    engines = sorted(_engines.items())
+    for metrica, funcion in (("db_pool_size", "size"), ("db_pool_overflow", "overflow")):
+        lineas.append(f"# TYPE {metrica} gauge")
+        for nombre, (engine, _) in engines:
+            if hasattr(engine.pool, funcion):
+                lineas.append(f'{metrica}{{engine="{nombre}"}} {getattr(engine.pool, funcion)()}')
+    lineas.append("# TYPE db_pool_checked_out gauge")
+    for nombre, (_, estado) in engines:
+        lineas.append(f'db_pool_checked_out{{engine="{nombre}"}} {estado.en_uso}')
+    for metrica, campo in (
+        ("db_pool_checkouts_total", "checkouts"), ("db_pool_connections_total", "conexiones"),
+        ("db_pool_connect_errors_total", "errores"),
+    ):
+        lineas.append(f"# TYPE {metrica} counter")
+        for nombre, (_, estado) in engines:
+            lineas.append(f'{metrica}{{engine="{nombre}"}} {getattr(estado, campo)}')
+    lineas.append("# TYPE db_pool_connect_seconds histogram")
+    for nombre, (_, estado) in engines:
+        estado.tiempo_conexion.exponer("db_pool_connect_seconds", f'engine="{nombre}"', lineas)
+    lineas.append("# TYPE db_pool_timeouts_total counter")
+    lineas.append(f"db_pool_timeouts_total {_totales['pool_agotado']}")
+
+    caches = [(c.nombre, c.aciertos, c.fallos) for c in cache._registradas]
+    caches += [
+        (f"catalogo_{tabla}", datos["aciertos"], datos["fallos"])
+        for tabla, datos in catalogos.catalogo.estadisticas().items()
+    ]
+    lineas.append("# TYPE cache_hits_total counter")
+    for nombre, aciertos, _ in caches:
+        lineas.append(f'cache_hits_total{{cache="{nombre}"}} {aciertos}')
+    lineas.append("# TYPE cache_misses_total counter")
+    for nombre, _, fallos in caches:
+        lineas.append(f'cache_misses_total{{cache="{nombre}"}} {fallos}')
+
+    # Escritura de la auditoría: eventos en cola y su destino
+    cola = auditoria.escritor.estadisticas()
+    lineas.append("# TYPE audit_queue_size gauge")
+    lineas.append(f"audit_queue_size {cola['en_cola']}")
+    lineas.append("# TYPE audit_events_total counter")
+    for destino in ("escritos", "directos", "perdidos"):
+        lineas.append(f'audit_events_total{{destino="{destino}"}} {cola[destino]}')
+    lineas.append("# TYPE audit_queue_overflows_total counter")
+    lineas.append(f"audit_queue_overflows_total {cola['desbordes']}")
+
+    lineas.append("# TYPE db_slow_queries_total counter")
+    lineas.append(f"db_slow_queries_total {_totales['consultas_lentas']}")
+    return "\n".join(lineas) + "\n"
+
+
+def endpoint_metricas():
+    return PlainTextResponse(exponer(), media_type="text/plain; version=0.0.4")
+
+
+def endpoint_consultas_lentas():
+    # Últimas MUESTRAS_LENTAS consultas lentas, la más reciente primero
+    return [
+        {"registrada_en": datetime.fromtimestamp(momento).isoformat(), "segundos": duracion, "sql": sql}
+        for momento, duracion, sql in reversed(list(_consultas_lentas))
+    ]
@@ -0,0 +1,121 @@
+# migraciones.py
+# Aplica en orden los archivos migrations/NNNN_nombre.sql que todavía no
+# están registrados en schema_migrations.
+#
+# Cada archivo se ejecuta sentencia por sentencia en modo autocommit: el
+# archivo controla sus propias transacciones con BEGIN/COMMIT y puede usar
+# sentencias que no admiten transacción (CREATE INDEX CONCURRENTLY).
+#
+#   python -m app.migraciones               # aplica las pendientes
+#   python -m app.migraciones --estado      # lista aplicadas y pendientes
+#   python -m app.migraciones --marcar 0003 # registra hasta 0003 sin ejecutarlas
+#
+# --marcar sirve para bases creadas con Base.metadata.create_all, que ya
+# tienen el esquema de models.py.
+import argparse
+import re
+from pathlib import Path
+
+from sqlalchemy import text
+
+from . import database
+
+CARPETA = Path(__file__).resolve().parent.parent / "migrations"
+
+_ARCHIVO = re.compile(r"^(\d{4})_.+\.sql$")
+# Comentarios, cadenas y bloques $tag$...$tag$ se recorren completos para no
+# cortar en un ';' que esté dentro de ellos
+_TOKEN = re.compile(r"--[^\n]*|/\*.*?\*/|'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|(\$\w*\$).*?\1|;", re.S)
+_COMENTARIO = re.compile(r"--[^\n]*|/\*.*?\*/", re.S)
+
+
+def archivos() -> list:
+    encontrados = []
+    for archivo in sorted(CARPETA.glob("*.sql")):
+        coincidencia = _ARCHIVO.match(archivo.name)
+        if coincidencia:
+            encontrados.append((coincidencia.group(1), archivo))
+    return encontrados
+
+
+def sentencias(sql: str) -> list:
+    partes, inicio = [], 0
+    for token in _TOKEN.finditer(sql):
+        if token.group() == ";":
+            partes.append(sql[inicio:token.start()])
+            inicio = token.end()
+    partes.append(sql[inicio:])
+    return [parte.strip() for parte in partes if _COMENTARIO.sub("", parte).strip()]
+
+
+def _registrar(conexion, version: str, nombre: str):
+    conexion.execute(
+        text("INSERT INTO schema_migrations (version, nombre) VALUES (:version, :nombre)"),
+        {"version": version, "nombre": nombre},
+    )
+
+
+def _aplicadas(conexion) -> set:
+    conexion.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        " version VARCHAR(4) PRIMARY KEY,"
+        " nombre VARCHAR(200) NOT NULL,"
+        " aplicada_en TIMESTAMPTZ NOT NULL DEFAULT now())"
+    ))
+    return set(conexion.execute(text("SELECT version FROM schema_migrations")).scalars())
+
+
+def aplicar(hasta: str = None, solo_marcar: bool = False) -> list:
+    # Devuelve los nombres de archivo aplicados (o marcados)
+    hechas = []
+    with database.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conexion:
+        # Los índices CONCURRENTLY y los backfills no se cortan por DB_STATEMENT_TIMEOUT_MS
+        conexion.exec_driver_sql("SET statement_timeout = 0")
+        aplicadas = _aplicadas(conexion)
+        for version, archivo in archivos():
+            if version in aplicadas:
+                continue
+            if hasta is not None and version > hasta:
+                break
+            if not solo_marcar:
+                # Cursor del driver: el SQL se envía tal cual, sin interpretar '%'
+                cursor = conexion.connection.driver_connection.cursor()
+                try:
+                    for sentencia in sentencias(archivo.read_text(encoding="utf-8")):
+                        cursor.execute(sentencia)
+                finally:
+                    cursor.close()
+            _registrar(conexion, version, archivo.name)
+            hechas.append(archivo.name)
+    return hechas
+
+
+def estado() -> list:
+    with database.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conexion:
+        aplicadas = _aplicadas(conexion)
+    return [(archivo.name, version in aplicadas) for version, archivo in archivos()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migraciones SQL versionadas")
+    parser.add_argument("--estado", action="store_true", help="Listar migraciones aplicadas y pendientes")
+    parser.add_argument("--hasta", help="Aplicar solo hasta esta versión (NNNN)")
+    parser.add_argument("--marcar", metavar="VERSION", help="Registrar hasta VERSION como aplicadas sin ejecutarlas")
+    args = parser.parse_args()
+
+    if args.estado:
+        for nombre, aplicada in estado():
+            print(f"{'aplicada ' if aplicada else 'pendiente'}  {nombre}")
+        return
+    if args.marcar:
+        hechas = aplicar(args.marcar, solo_marcar=True)
+    else:
+        hechas = aplicar(args.hasta)
+    for nombre in hechas:
+        print(f"{'marcada' if args.marcar else 'aplicada'}  {nombre}")
+    if not hechas:
+        print("Sin migraciones pendientes")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,34 @@
 from .database import Base
-from sqlalchemy import Column, Integer, VARCHAR, Date, String, DateTime, Text, Float, ForeignKey
+from sqlalchemy import DDL, BigInteger, Column, Integer, VARCHAR, Date, String, DateTime, Text, Float, ForeignKey, Index, Sequence, SmallInteger, event, text
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
 
 
+# Índices: solo los que usan las consultas de crud.py y los demás módulos;
+# cada índice extra es un B-tree más que actualizar en cada solicitud.
+
+# Secuencia de los correlativos de pagos (PAGO-n), ver app/correlativos.py
+CORRELATIVO_PAGO_SEQ = Sequence("pago_realizado_correlativo_seq", metadata=Base.metadata)
+
+
 class User(Base):
     __tablename__ = "usuarios"
 
-    usuario_id = Column(Integer, primary_key=True, index=True)
+    usuario_id = Column(Integer, primary_key=True)
     codigo_cliente = Column(VARCHAR(50), unique=True, index=True)
-    rol_id = Column(Integer, ForeignKey('roles.rol_id'), index=True)
-    genero = Column(String, index=True)
+    rol_id = Column(Integer, ForeignKey('roles.rol_id'))
+    genero = Column(String)
     cui = Column(VARCHAR(20), unique=True, index=True)
-    fecha_nacimiento = Column(Date, index=True)
-    estado_civil = Column(VARCHAR(50), index=True)
-    nacionalidad = Column(VARCHAR(50), index=True)
-    primer_nombre = Column(VARCHAR(100), index=True)
-    segundo_nombre = Column(VARCHAR(100), index=True)
-    tercer_nombre = Column(VARCHAR(100), index=True)
-    primer_apellido = Column(VARCHAR(100), index=True)
-    segundo_apellido = Column(VARCHAR(100), index=True)
-    apellido_casada = Column(VARCHAR(100), index=True)
-    ocupaciones_id = Column(Integer, ForeignKey('ocupaciones.ocupacion_id'), index=True)
+    fecha_nacimiento = Column(Date)
+    estado_civil = Column(VARCHAR(50))
+    nacionalidad = Column(VARCHAR(50))
+    primer_nombre = Column(VARCHAR(100))
+    segundo_nombre = Column(VARCHAR(100))
+    tercer_nombre = Column(VARCHAR(100))
+    primer_apellido = Column(VARCHAR(100))
+    segundo_apellido = Column(VARCHAR(100))
+    apellido_casada = Column(VARCHAR(100))
+    ocupaciones_id = Column(Integer, ForeignKey('ocupaciones.ocupacion_id'))
 
     direccion = relationship("DireccionUser", back_populates="usuarios")
     prestamos = relationship("Prestamos", back_populates="usuario")
@@ -29,14 +37,67 @@ class User(Base):
     ocupacion = relationship("Ocupaciones", back_populates="usuarios")
 
 
+# --- Búsqueda de clientes (app/busqueda.py) ----------------------------------
+# Los textos se comparan en minúsculas y sin tildes. Las funciones son SQL
+# simple con funciones inmutables de pg_catalog (sin concat_ws, que es STABLE)
+# para que PostgreSQL las expanda en línea: llamadas como función serían
+# varias veces más lentas al evaluar fila por fila. El índice de trigramas
+# necesita pg_trgm; si la extensión no está disponible se omite y la búsqueda
+# por nombre recorre la tabla (ver migrations/0007_busqueda_clientes.sql).
+
+ACENTOS = "áàäâéèëêíìïîóòöôúùüûñçÁÀÄÂÉÈËÊÍÌÏÎÓÒÖÔÚÙÜÛÑÇ"
+SIN_ACENTOS = "aaaaeeeeiiiioooouuuuncaaaaeeeeiiiioooouuuunc"
+
+
+def _normalizado(expresion: str) -> str:
+    return f"translate(lower({expresion}), '{ACENTOS}', '{SIN_ACENTOS}')"
+
+
+COLUMNAS_NOMBRE_BUSQUEDA = [
+    "primer_nombre", "segundo_nombre", "tercer_nombre", "primer_apellido", "segundo_apellido", "apellido_casada",
+]
+NOMBRE_BUSQUEDA = f"usuarios_nombre_busqueda({', '.join(COLUMNAS_NOMBRE_BUSQUEDA)})"
+# Nombres no vacíos separados por un espacio
+_NOMBRE_COMPLETO = " || ".join(f"coalesce({columna} || ' ', '')" for columna in COLUMNAS_NOMBRE_BUSQUEDA)
+
+BUSQUEDA_FUNCIONES = f"""
+CREATE OR REPLACE FUNCTION normalizar_busqueda(texto text) RETURNS text
+LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+    SELECT {_normalizado("texto")}
+$$;
+CREATE OR REPLACE FUNCTION usuarios_nombre_busqueda(
+    primer_nombre text, segundo_nombre text, tercer_nombre text,
+    primer_apellido text, segundo_apellido text, apellido_casada text
+) RETURNS text
+LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+    SELECT rtrim({_normalizado(_NOMBRE_COMPLETO)})
+$$;
+"""
+
+BUSQUEDA_INDICES = f"""
+CREATE INDEX IF NOT EXISTS ix_usuarios_cui_busqueda ON usuarios (normalizar_busqueda(cui) text_pattern_ops);
+CREATE INDEX IF NOT EXISTS ix_usuarios_codigo_cliente_busqueda ON usuarios (normalizar_busqueda(codigo_cliente) text_pattern_ops);
+DO $$
+BEGIN
+    CREATE EXTENSION IF NOT EXISTS pg_trgm;
+    CREATE INDEX IF NOT EXISTS ix_usuarios_nombre_trgm ON usuarios USING gin ({NOMBRE_BUSQUEDA} gin_trgm_ops);
+EXCEPTION WHEN feature_not_supported OR undefined_file OR undefined_object OR insufficient_privilege THEN
+    RAISE NOTICE 'pg_trgm no disponible: la búsqueda por nombre no tendrá índice';
+END
+$$;
+"""
+
+event.listen(Base.metadata, "after_create", DDL(BUSQUEDA_FUNCIONES + BUSQUEDA_INDICES).execute_if(dialect="postgresql"))
+
+
 class CargosAdmin(Base):
     __tablename__ = "cargos_administrativos"
 
-    cargos_id = Column(Integer, primary_key=True, index=True)
+    cargos_id = Column(Integer, primary_key=True)
     prestamo_id = Column(Integer, ForeignKey("prestamo.prestamo_id"), index=True)
-    prestamo_iva = Column(Float, index=True, default=0.0)
-    prestamo_cargos_administrativos = Column(Float, index=True, default=0.0)
-    prestamo_total = Column(Float, index=True, default=0.0)
+    prestamo_iva = Column(Float, default=0.0)
+    prestamo_cargos_administrativos = Column(Float, default=0.0)
+    prestamo_total = Column(Float, default=0.0)
 
     prestamo = relationship("Prestamos", back_populates="cargos_administrativos")
 
@@ -44,11 +105,11 @@ class CargosAdmin(Base):
 class DireccionUser(Base):
     __tablename__ = "direccion_usuario"
 
-    direccion_usuario_id = Column(Integer, primary_key=True, index=True)
+    direccion_usuario_id = Column(Integer, primary_key=True)
     usuario_id = Column(Integer, ForeignKey('usuarios.usuario_id'), index=True)
-    depto_nacimiento = Column(VARCHAR(100), index=True)
-    muni_nacimiento = Column(VARCHAR(100), index=True)
-    vecindad = Column(VARCHAR(100), index=True)
+    depto_nacimiento = Column(VARCHAR(100))
+    muni_nacimiento = Column(VARCHAR(100))
+    vecindad = Column(VARCHAR(100))
 
     usuarios = relationship("User", back_populates="direccion")
 
@@ -56,23 +117,32 @@ class DireccionUser(Base):
 class Ocupaciones(Base):
     __tablename__ = "ocupaciones"
 
-    ocupacion_id = Column(Integer, primary_key=True, index=True)
-    nombre_ocupacion = Column(VARCHAR(100), index=True)
+    ocupacion_id = Column(Integer, primary_key=True)
+    nombre_ocupacion = Column(VARCHAR(100), unique=True, index=True)
 
     usuarios = relationship("User", back_populates="ocupacion")
 
 
 class PagosRealizados(Base):
     __tablename__ = "pagos_realizados"
-
-    pago_realizado_id = Column(Integer, primary_key=True, index=True)
-    prestamo_id = Column(Integer, ForeignKey("prestamo.prestamo_id"), index=True)
-    pago_realizado_fecha_creacion = Column(DateTime, index=True)
-    pago_realizado_fecha_pago = Column(DateTime, index=True)
-    pago_realizado_monto_pagado = Column(Float, index=True)
-    pago_realizado_correlativo = Column(String(50), nullable=False)
-    validacion1_validado_por = Column(VARCHAR(100), ForeignKey("validadores.validador_id"), index=True)
-    estado = Column(String(20), default="pendiente", index=True)
+    __table_args__ = (
+        # Pagos de un préstamo (detalle) y por estado
+        Index("ix_pagos_realizados_prestamo_estado", "prestamo_id", "estado"),
+        # Cola de comprobantes por validar
+        Index("ix_pagos_realizados_pendientes", "pago_realizado_id", postgresql_where=text("estado = 'pendiente'")),
+    )
+
+    pago_realizado_id = Column(Integer, primary_key=True)
+    prestamo_id = Column(Integer, ForeignKey("prestamo.prestamo_id"))
+    pago_realizado_fecha_creacion = Column(DateTime)
+    pago_realizado_fecha_pago = Column(DateTime)
+    pago_realizado_monto_pagado = Column(Float)
+    pago_realizado_correlativo = Column(
+        String(50), nullable=False,
+        server_default=text("('PAGO-' || nextval('pago_realizado_correlativo_seq'))"),
+    )
+    validacion1_validado_por = Column(VARCHAR(100), ForeignKey("validadores.validador_id"))
+    estado = Column(String(20), default="pendiente")
     codigo_transaccion = Column(VARCHAR(50), unique=True, nullable=True)
     monto_pagado = Column(Float, nullable=True, default=0.0)
 
@@ -82,14 +152,18 @@ class PagosRealizados(Base):
 
 class Prestamos(Base):
     __tablename__ = "prestamo"
+    __table_args__ = (
+        # Listado paginado por prestamo_id con filtro de estatus (GET /prestamos, /prestamos/pendientes)
+        Index("ix_prestamo_estatus_prestamo", "prestamo_estatus_id", "prestamo_id"),
+    )
 
-    prestamo_id = Column(Integer, primary_key=True, index=True)
+    prestamo_id = Column(Integer, primary_key=True)
     usuario_id = Column(Integer, ForeignKey('usuarios.usuario_id'), index=True)
-    codigo_prestamo = Column(VARCHAR(50), index=True)
-    motivo_prestamo = Column(Text, index=True)
-    prestamo_estatus_id = Column(Integer, ForeignKey("prestamo_estatus.estatus_id"), index=True)
-    monto_solicitado = Column(Float, index=True)
-    cuotas_pactadas = Column(Integer, index=True)
+    codigo_prestamo = Column(VARCHAR(50), unique=True, index=True)
+    motivo_prestamo = Column(Text)
+    prestamo_estatus_id = Column(Integer, ForeignKey("prestamo_estatus.estatus_id"))
+    monto_solicitado = Column(Float)
+    cuotas_pactadas = Column(Integer)
     porcentaje_interes = Column(Float, nullable=False, default=0.0)
 
     usuario = relationship("User", back_populates="prestamos")
@@ -102,42 +176,27 @@ class Prestamos(Base):
 class PrestamoEstatus(Base):
     __tablename__ = "prestamo_estatus"
 
-    estatus_id = Column(Integer, primary_key=True, index=True)
-    descripcion = Column(VARCHAR(100), index=True)
+    estatus_id = Column(Integer, primary_key=True)
+    descripcion = Column(VARCHAR(100))
 
     prestamo = relationship("Prestamos", back_populates="estatus")
 
 
 class Referencias(Base):
+    # Una fila por referencia personal (antes 4 referencias en 24 columnas por
+    # fila); solo se indexa usuario_id, que es por donde se consultan
     __tablename__ = "referencias"
 
-    referencia_id = Column(Integer, primary_key=True, index=True)
-    usuario_id = Column(Integer, ForeignKey('usuarios.usuario_id'), index=True)
+    referencia_id = Column(Integer, primary_key=True)
+    usuario_id = Column(Integer, ForeignKey('usuarios.usuario_id'), index=True, nullable=False)
+    orden = Column(SmallInteger, nullable=False)  # Posición en la solicitud, desde 1
 
-    referencia1_primer_nombre = Column(VARCHAR(100), index=True)
-    referencia1_segundo_nombre = Column(VARCHAR(100), index=True)
-    referencia1_tercer_nombre = Column(VARCHAR(100), index=True)
-    referencia1_primer_apellido = Column(VARCHAR(100), index=True)
-    referencia1_segundo_apellido = Column(VARCHAR(100), index=True)
-    referencia1_telefono = Column(VARCHAR(20), index=True)
-    referencia2_primer_nombre = Column(VARCHAR(100), index=True)
-    referencia2_segundo_nombre = Column(VARCHAR(100), index=True)
-    referencia2_tercer_nombre = Column(VARCHAR(100), index=True)
-    referencia2_primer_apellido = Column(VARCHAR(100), index=True)
-    referencia2_segundo_apellido = Column(VARCHAR(100), index=True)
-    referencia2_telefono = Column(VARCHAR(20), index=True)
-    referencia3_primer_nombre = Column(VARCHAR(100), index=True)
-    referencia3_segundo_nombre = Column(VARCHAR(100), index=True)
-    referencia3_tercer_nombre = Column(VARCHAR(100), index=True)
-    referencia3_primer_apellido = Column(VARCHAR(100), index=True)
-    referencia3_segundo_apellido = Column(VARCHAR(100), index=True)
-    referencia3_telefono = Column(VARCHAR(20), index=True)
-    referencia4_primer_nombre = Column(VARCHAR(100), index=True)
-    referencia4_segundo_nombre = Column(VARCHAR(100), index=True)
-    referencia4_tercer_nombre = Column(VARCHAR(100), index=True)
-    referencia4_primer_apellido = Column(VARCHAR(100), index=True)
-    referencia4_segundo_apellido = Column(VARCHAR(100), index=True)
-    referencia4_telefono = Column(VARCHAR(20), index=True)
+    primer_nombre = Column(VARCHAR(100))
+    segundo_nombre = Column(VARCHAR(100))
+    tercer_nombre = Column(VARCHAR(100))
+    primer_apellido = Column(VARCHAR(100))
+    segundo_apellido = Column(VARCHAR(100))
+    telefono = Column(VARCHAR(20))
 
     usuario = relationship("User", back_populates="referencias")
 
@@ -145,9 +204,9 @@ class Referencias(Base):
 class Roles(Base):
     __tablename__ = "roles"
 
-    rol_id = Column(Integer, primary_key=True, index=True)
-    nombre_rol = Column(VARCHAR(100), index=True)
-    descripcion = Column(Text, index=True)
+    rol_id = Column(Integer, primary_key=True)
+    nombre_rol = Column(VARCHAR(100))
+    descripcion = Column(Text)
 
     usuarios = relationship("User", back_populates="rol")
 
@@ -155,19 +214,274 @@ class Roles(Base):
 class Validadores(Base):
     __tablename__ = "validadores"
 
-    validador_id = Column(VARCHAR(100), primary_key=True, index=True)
-    validador_nombre = Column(VARCHAR(100), index=True)
+    validador_id = Column(VARCHAR(100), primary_key=True)
+    validador_nombre = Column(VARCHAR(100))
 
     pagos_realizados = relationship("PagosRealizados", back_populates="validador1")
 
 
+# Estados de una cuota que todavía se debe: pendiente (no ha llegado la fecha
+# de pago) y vencido (la fecha pasó, lo marca app/vencimientos.py)
+CUOTAS_IMPAGAS = ("pendiente", "vencido")
+
+
 class PagosFuturos(Base):
     __tablename__ = "pagos_futuros"
-
-    pago_id = Column(Integer, primary_key=True, index=True)
-    prestamo_id = Column(Integer, ForeignKey("prestamo.prestamo_id"), index=True)
-    fecha_pago = Column(Date, index=True, nullable=False)
-    monto_pago = Column(Float, index=True, nullable=False)
-    estado = Column(String(20), default="pendiente", index=True)
+    __table_args__ = (
+        # Cuotas de un préstamo por estado (detalle, reprogramación en amortizacion.py)
+        Index("ix_pagos_futuros_prestamo_estado", "prestamo_id", "estado"),
+        # Próximas cuotas por vencer; vencimientos.py las recorre por fecha
+        Index("ix_pagos_futuros_pendientes_fecha", "fecha_pago", postgresql_where=text("estado = 'pendiente'")),
+        # Cuotas vencidas por fecha (tramos de atraso en morosidad.py)
+        Index("ix_pagos_futuros_vencidos_fecha", "fecha_pago", postgresql_where=text("estado = 'vencido'")),
+    )
+
+    pago_id = Column(Integer, primary_key=True)
+    prestamo_id = Column(Integer, ForeignKey("prestamo.prestamo_id"))
+    fecha_pago = Column(Date, nullable=False)
+    monto_pago = Column(Float, nullable=False)
+    estado = Column(String(20), default="pendiente")
 
     prestamo = relationship("Prestamos", back_populates="pagos_futuros")
+
+
+# --- Vencimiento de cuotas (app/vencimientos.py) -----------------------------
+
+class VencimientoCorrida(Base):
+    # Una fila por corrida; se actualiza en la misma transacción de cada bloque
+    __tablename__ = "vencimientos_corridas"
+    __table_args__ = (
+        # Una sola corrida en curso: las demás la retoman
+        Index(
+            "ix_vencimientos_corridas_en_curso", "estado", unique=True,
+            postgresql_where=text("estado = 'en_curso'"),
+        ),
+    )
+
+    corrida_id = Column(Integer, primary_key=True)
+    fecha_referencia = Column(Date, nullable=False)  # vencen las cuotas con fecha_pago anterior
+    estado = Column(String(20), nullable=False, server_default="en_curso")
+    iniciada_en = Column(DateTime, nullable=False)
+    actualizada_en = Column(DateTime)
+    terminada_en = Column(DateTime)
+    bloques = Column(Integer, nullable=False, server_default="0")
+    cuotas_vencidas = Column(Integer, nullable=False, server_default="0")
+    prestamos_actualizados = Column(Integer, nullable=False, server_default="0")
+    cuotas_omitidas = Column(Integer)  # bloqueadas por otra transacción; quedan para la siguiente
+    hasta_fecha = Column(Date)  # fecha_pago más reciente procesada
+    duracion_ms = Column(Float, nullable=False, server_default="0")  # suma de los bloques
+    bloque_max_ms = Column(Float, nullable=False, server_default="0")
+
+
+# --- Auditoría de cambios de estado (app/auditoria.py) -----------------------
+
+class AuditoriaEstado(Base):
+    # Un cambio de prestamo.prestamo_estatus_id o pagos_realizados.estado
+    __tablename__ = "auditoria_estados"
+    __table_args__ = (
+        # Historial de un préstamo o pago y de un usuario, del más reciente al más antiguo
+        Index("ix_auditoria_estados_entidad", "entidad", "entidad_id", "auditoria_id"),
+        Index("ix_auditoria_estados_usuario", "usuario", "auditoria_id"),
+    )
+
+    auditoria_id = Column(BigInteger, primary_key=True)
+    entidad = Column(String(20), nullable=False)  # "prestamo" o "pago"
+    entidad_id = Column(Integer, nullable=False)
+    campo = Column(String(30), nullable=False)
+    valor_anterior = Column(String(30))
+    valor_nuevo = Column(String(30))
+    usuario = Column(VARCHAR(100))  # encabezado X-Usuario de la petición
+    origen = Column(VARCHAR(200))  # ruta o proceso que hizo el cambio
+    registrado_en = Column(DateTime, nullable=False)  # momento del cambio
+
+
+# --- Recepción de solicitudes en cola (app/recepcion.py) ---------------------
+
+class SolicitudRecibida(Base):
+    # Solicitud validada que espera a los trabajadores; solicitud_id es el
+    # número de seguimiento que recibe el cliente
+    __tablename__ = "solicitudes_recibidas"
+    __table_args__ = (
+        # Los trabajadores toman las pendientes en orden de llegada
+        Index(
+            "ix_solicitudes_recibidas_pendientes", "solicitud_id",
+            postgresql_where=text("estado = 'pendiente'"),
+        ),
+    )
+
+    solicitud_id = Column(BigInteger, primary_key=True)
+    estado = Column(String(20), nullable=False, server_default="pendiente")  # pendiente, creada o error
+    datos = Column(JSONB, nullable=False)  # schemas.ClienteSolicitud
+    recibida_en = Column(DateTime, nullable=False)
+    procesada_en = Column(DateTime)
+    usuario_id = Column(Integer)
+    prestamo_id = Column(Integer)
+    codigo_prestamo = Column(VARCHAR(50))
+    error = Column(Text)
+
+
+# --- Reporte de morosidad (app/morosidad.py) ---------------------------------
+
+class MorosidadPrestamo(Base):
+    # Situación de cada préstamo con cuotas impagas a la fecha del último refresco
+    __tablename__ = "morosidad_prestamo"
+
+    prestamo_id = Column(Integer, ForeignKey("prestamo.prestamo_id"), primary_key=True)
+    tramo = Column(String(10), nullable=False)
+    prestamo_estatus_id = Column(Integer, nullable=False, server_default="0")
+    ocupacion_id = Column(Integer, nullable=False, server_default="0")
+    depto_nacimiento = Column(VARCHAR(100), nullable=False, server_default="")
+    fecha_atraso = Column(Date)  # cuota impaga más antigua
+    cuotas_vencidas = Column(Integer, nullable=False)
+    saldo_vencido = Column(Float, nullable=False)
+
+
+class MorosidadResumen(Base):
+    # Suma de morosidad_prestamo por tramo, estatus, ocupación y departamento;
+    # 0 y '' marcan préstamos sin estatus, ocupación o dirección
+    __tablename__ = "morosidad_resumen"
+
+    tramo = Column(String(10), primary_key=True)
+    prestamo_estatus_id = Column(Integer, primary_key=True)
+    ocupacion_id = Column(Integer, primary_key=True)
+    depto_nacimiento = Column(VARCHAR(100), primary_key=True)
+    prestamos = Column(Integer, nullable=False)
+    cuotas_vencidas = Column(Integer, nullable=False)
+    saldo_vencido = Column(Float, nullable=False)
+
+
+class MorosidadPendiente(Base):
+    # Préstamos con cambios desde el último refresco (los llenan los triggers)
+    __tablename__ = "morosidad_pendientes"
+
+    prestamo_id = Column(Integer, primary_key=True, autoincrement=False)
+
+
+class MorosidadControl(Base):
+    __tablename__ = "morosidad_control"
+
+    control_id = Column(Integer, primary_key=True, autoincrement=False)
+    fecha_referencia = Column(Date)  # "hoy" del último refresco
+    actualizado_en = Column(DateTime)
+
+
+# Triggers por sentencia que anotan en morosidad_pendientes los préstamos cuyas
+# cuotas, pagos o estatus cambian. Igual que migrations/0004_morosidad.sql.
+MOROSIDAD_TRIGGERS = """
+CREATE OR REPLACE FUNCTION morosidad_marcar_nuevas() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    INSERT INTO morosidad_pendientes (prestamo_id)
+    SELECT DISTINCT prestamo_id FROM nuevas WHERE prestamo_id IS NOT NULL ORDER BY 1
+    ON CONFLICT DO NOTHING;
+    RETURN NULL;
+END
+$$;
+
+CREATE OR REPLACE FUNCTION morosidad_marcar_anteriores() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    INSERT INTO morosidad_pendientes (prestamo_id)
+    SELECT DISTINCT prestamo_id FROM anteriores WHERE prestamo_id IS NOT NULL ORDER BY 1
+    ON CONFLICT DO NOTHING;
+    RETURN NULL;
+END
+$$;
+
+DROP TRIGGER IF EXISTS morosidad_pagos_futuros_insert ON pagos_futuros;
+CREATE TRIGGER morosidad_pagos_futuros_insert AFTER INSERT ON pagos_futuros
+    REFERENCING NEW TABLE AS nuevas FOR EACH STATEMENT EXECUTE FUNCTION morosidad_marcar_nuevas();
+DROP TRIGGER IF EXISTS morosidad_pagos_futuros_update ON pagos_futuros;
+CREATE TRIGGER morosidad_pagos_futuros_update AFTER UPDATE ON pagos_futuros
+    REFERENCING NEW TABLE AS nuevas FOR EACH STATEMENT EXECUTE FUNCTION morosidad_marcar_nuevas();
+DROP TRIGGER IF EXISTS morosidad_pagos_futuros_delete ON pagos_futuros;
+CREATE TRIGGER morosidad_pagos_futuros_delete AFTER DELETE ON pagos_futuros
+    REFERENCING OLD TABLE AS anteriores FOR EACH STATEMENT EXECUTE FUNCTION morosidad_marcar_anteriores();
+DROP TRIGGER IF EXISTS morosidad_pagos_realizados_insert ON pagos_realizados;
+CREATE TRIGGER morosidad_pagos_realizados_insert AFTER INSERT ON pagos_realizados
+    REFERENCING NEW TABLE AS nuevas FOR EACH STATEMENT EXECUTE FUNCTION morosidad_marcar_nuevas();
+DROP TRIGGER IF EXISTS morosidad_pagos_realizados_update ON pagos_realizados;
+CREATE TRIGGER morosidad_pagos_realizados_update AFTER UPDATE ON pagos_realizados
+    REFERENCING NEW TABLE AS nuevas FOR EACH STATEMENT EXECUTE FUNCTION morosidad_marcar_nuevas();
+DROP TRIGGER IF EXISTS morosidad_pagos_realizados_delete ON pagos_realizados;
+CREATE TRIGGER morosidad_pagos_realizados_delete AFTER DELETE ON pagos_realizados
+    REFERENCING OLD TABLE AS anteriores FOR EACH STATEMENT EXECUTE FUNCTION morosidad_marcar_anteriores();
+DROP TRIGGER IF EXISTS morosidad_prestamo_update ON prestamo;
+CREATE TRIGGER morosidad_prestamo_update AFTER UPDATE ON prestamo
+    REFERENCING NEW TABLE AS nuevas FOR EACH STATEMENT EXECUTE FUNCTION morosidad_marcar_nuevas();
+"""
+
+event.listen(Base.metadata, "after_create", DDL(MOROSIDAD_TRIGGERS).execute_if(dialect="postgresql"))
+
+
+# --- Contadores de cartera (app/contadores.py) -------------------------------
+
+# Cada conexión suma en su propia fila (slot = pid del backend % SLOTS) para
+# que las escrituras concurrentes no se bloqueen en un solo contador
+SLOTS_CONTADORES = 16
+
+
+class ContadorCartera(Base):
+    # tipo "prestamos": clave = prestamo_estatus_id, monto = monto_solicitado
+    # tipo "pagos": clave = estado del pago, monto = pago_realizado_monto_pagado
+    __tablename__ = "contadores_cartera"
+
+    tipo = Column(String(20), primary_key=True)
+    clave = Column(String(30), primary_key=True)
+    slot = Column(Integer, primary_key=True, autoincrement=False)
+    cantidad = Column(Integer, nullable=False)
+    monto = Column(Float, nullable=False)
+
+
+def _funcion_contadores(nombre: str, tipo: str, clave: str, monto: str) -> str:
+    def sumar(origenes):
+        cambios = "\n        UNION ALL ".join(
+            f"SELECT coalesce({clave}, ''), {signo}, {signo} * coalesce({monto}, 0) FROM {tabla}"
+            for tabla, signo in origenes
+        )
+        return f"""INSERT INTO contadores_cartera (tipo, clave, slot, cantidad, monto)
+        SELECT '{tipo}', clave, mod(pg_backend_pid(), {SLOTS_CONTADORES}), sum(cantidad), sum(monto)
+        FROM ({cambios}) AS cambios (clave, cantidad, monto)
+        GROUP BY clave
+        HAVING sum(cantidad) <> 0 OR sum(monto) <> 0
+        ORDER BY clave
+        ON CONFLICT (tipo, clave, slot) DO UPDATE
+        SET cantidad = contadores_cartera.cantidad + excluded.cantidad,
+            monto = contadores_cartera.monto + excluded.monto;"""
+
+    return f"""CREATE OR REPLACE FUNCTION {nombre}() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        {sumar([("nuevas", 1)])}
+    ELSIF TG_OP = 'DELETE' THEN
+        {sumar([("anteriores", -1)])}
+    ELSE
+        {sumar([("nuevas", 1), ("anteriores", -1)])}
+    END IF;
+    RETURN NULL;
+END
+$$;
+"""
+
+
+def _triggers_contadores(tabla: str, funcion: str) -> str:
+    return f"""DROP TRIGGER IF EXISTS contadores_{tabla}_insert ON {tabla};
+CREATE TRIGGER contadores_{tabla}_insert AFTER INSERT ON {tabla}
+    REFERENCING NEW TABLE AS nuevas FOR EACH STATEMENT EXECUTE FUNCTION {funcion}();
+DROP TRIGGER IF EXISTS contadores_{tabla}_update ON {tabla};
+CREATE TRIGGER contadores_{tabla}_update AFTER UPDATE ON {tabla}
+    REFERENCING OLD TABLE AS anteriores NEW TABLE AS nuevas FOR EACH STATEMENT EXECUTE FUNCTION {funcion}();
+DROP TRIGGER IF EXISTS contadores_{tabla}_delete ON {tabla};
+CREATE TRIGGER contadores_{tabla}_delete AFTER DELETE ON {tabla}
+    REFERENCING OLD TABLE AS anteriores FOR EACH STATEMENT EXECUTE FUNCTION {funcion}();
+"""
+
+
+# Triggers por sentencia que suman la diferencia de cada INSERT, UPDATE o
+# DELETE en la misma transacción. Igual que migrations/0005_contadores_cartera.sql.
+CONTADORES_TRIGGERS = "\n".join([
+    _funcion_contadores("contadores_prestamo", "prestamos", "prestamo_estatus_id::text", "monto_solicitado"),
+    _funcion_contadores("contadores_pagos", "pagos", "estado", "pago_realizado_monto_pagado"),
+    _triggers_contadores("prestamo", "contadores_prestamo"),
+    _triggers_contadores("pagos_realizados", "contadores_pagos"),
+])
+
+event.listen(Base.metadata, "after_create", DDL(CONTADORES_TRIGGERS).execute_if(dialect="postgresql"))
@@ -0,0 +1,329 @@
+# morosidad.py
+# Reporte de morosidad por tramos de atraso (al día, 1-30, 31-60, 61-90 y
+# más de 90 días) agrupado por estatus, ocupación y departamento.
+#
+# El reporte lee morosidad_resumen, una tabla chica con los totales ya
+# sumados. Se mantiene de forma incremental:
+#
+#   - triggers sobre pagos_futuros, pagos_realizados y prestamo anotan en
+#     morosidad_pendientes los préstamos que cambian (ver models.py y
+#     migrations/0004_morosidad.sql)
+#   - al refrescar se anotan también los préstamos con una cuota impaga que
+#     desde el refresco anterior cumplió 1, 31, 61 o 91 días de atraso
+#     (rangos sobre ix_pagos_futuros_pendientes_fecha y
+#     ix_pagos_futuros_vencidos_fecha)
+#   - por bloques, se recalcula morosidad_prestamo solo para los préstamos
+#     anotados y la diferencia con la fila anterior se suma a morosidad_resumen
+#
+# Así el costo de refrescar depende de cuántos préstamos cambiaron y no del
+# tamaño de la cartera. Los pagos aprobados se aplican a las cuotas impagas en
+# orden de fecha; la cuota más antigua que no alcanzan a cubrir define el tramo.
+# Los cambios de ocupación o dirección de un usuario no se detectan: se
+# corrigen con un refresco completo.
+#
+#   python -m app.morosidad               # refresco incremental (cron)
+#   python -m app.morosidad --completo
+import argparse
+import json
+from datetime import date, datetime, timedelta
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import ARRAY, Integer, any_, case, delete, func, literal, or_, select, union, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from . import catalogos, database, models
+
+router = APIRouter()
+
+TRAMOS = ("al_dia", "1-30", "31-60", "61-90", "90+")
+# Días de atraso con los que se entra a cada tramo después de "al_dia"
+LIMITES = (1, 31, 61, 91)
+ESTADOS_IMPAGOS = models.CUOTAS_IMPAGAS
+TAMANO_BLOQUE = 5000
+CONTROL_ID = 1
+
+# Dimensiones del reporte -> columna de morosidad_resumen
+DIMENSIONES = {
+    "tramo": "tramo",
+    "estatus": "prestamo_estatus_id",
+    "ocupacion": "ocupacion_id",
+    "departamento": "depto_nacimiento",
+}
+CLAVES = ("tramo", "prestamo_estatus_id", "ocupacion_id", "depto_nacimiento")
+METRICAS = ("cuotas_vencidas", "saldo_vencido")
+
+futuros = models.PagosFuturos.__table__
+realizados = models.PagosRealizados.__table__
+prestamo = models.Prestamos.__table__
+usuarios = models.User.__table__
+direccion = models.DireccionUser.__table__
+por_prestamo = models.MorosidadPrestamo.__table__
+resumen = models.MorosidadResumen.__table__
+pendientes = models.MorosidadPendiente.__table__
+control = models.MorosidadControl.__table__
+
+
+def _en(columna, ids: list):
+    # columna = ANY(:ids): un solo parámetro para todo el bloque
+    return columna == any_(literal(ids, ARRAY(Integer)))
+
+
+def _tramo(fecha_atraso, hoy: date):
+    return case(
+        (fecha_atraso.is_(None) | (fecha_atraso > hoy - timedelta(days=LIMITES[0])), TRAMOS[0]),
+        *(
+            (fecha_atraso > hoy - timedelta(days=siguiente), tramo)
+            for tramo, siguiente in zip(TRAMOS[1:], LIMITES[1:])
+        ),
+        else_=TRAMOS[-1],
+    )
+
+
+def _calculo(ids: list, hoy: date):
+    # Una fila por préstamo con cuotas impagas, con las columnas de morosidad_prestamo
+    pagado = (
+        select(realizados.c.prestamo_id, func.sum(realizados.c.pago_realizado_monto_pagado).label("monto"))
+        .where(_en(realizados.c.prestamo_id, ids), realizados.c.estado == "aprobado")
+        .group_by(realizados.c.prestamo_id)
+        .cte("pagado")
+    )
+    cuotas = (
+        select(
+            futuros.c.prestamo_id,
+            futuros.c.fecha_pago,
+            futuros.c.monto_pago,
+            func.sum(futuros.c.monto_pago).over(
+                partition_by=futuros.c.prestamo_id, order_by=(futuros.c.fecha_pago, futuros.c.pago_id),
+            ).label("acumulado"),
+            func.coalesce(pagado.c.monto, 0.0).label("pagado"),
+        )
+        .outerjoin(pagado, pagado.c.prestamo_id == futuros.c.prestamo_id)
+        .where(_en(futuros.c.prestamo_id, ids), futuros.c.estado.in_(ESTADOS_IMPAGOS))
+        .cte("cuotas")
+    )
+    impaga = cuotas.c.acumulado > cuotas.c.pagado
+    vencida = cuotas.c.fecha_pago < hoy
+    atraso = (
+        select(
+            cuotas.c.prestamo_id,
+            func.min(cuotas.c.fecha_pago).filter(impaga).label("fecha_atraso"),
+            func.count().filter(vencida & impaga).label("cuotas_vencidas"),
+            func.greatest(
+                func.coalesce(func.sum(cuotas.c.monto_pago).filter(vencida), 0.0) - func.max(cuotas.c.pagado), 0.0,
+            ).label("saldo_vencido"),
+        )
+        .group_by(cuotas.c.prestamo_id)
+        .cte("atraso")
+    )
+    depto = (
+        select(direccion.c.depto_nacimiento)
+        .where(direccion.c.usuario_id == prestamo.c.usuario_id)
+        .order_by(direccion.c.direccion_usuario_id)
+        .limit(1)
+        .scalar_subquery()
+    )
+    return (
+        select(
+            atraso.c.prestamo_id,
+            _tramo(atraso.c.fecha_atraso, hoy).label("tramo"),
+            func.coalesce(prestamo.c.prestamo_estatus_id, 0).label("prestamo_estatus_id"),
+            func.coalesce(usuarios.c.ocupaciones_id, 0).label("ocupacion_id"),
+            func.coalesce(depto, "").label("depto_nacimiento"),
+            atraso.c.fecha_atraso,
+            atraso.c.cuotas_vencidas,
+            atraso.c.saldo_vencido,
+        )
+        .join(prestamo, prestamo.c.prestamo_id == atraso.c.prestamo_id)
+        .outerjoin(usuarios, usuarios.c.usuario_id == prestamo.c.usuario_id)
+    )
+
+
+def _marcar(db: Session, consulta):
+    db.execute(pg_insert(pendientes).from_select(["prestamo_id"], consulta).on_conflict_do_nothing())
+
+
+def _marcar_todos(db: Session):
+    _marcar(db, union(
+        select(futuros.c.prestamo_id).where(futuros.c.estado.in_(ESTADOS_IMPAGOS), futuros.c.prestamo_id.is_not(None)),
+        select(por_prestamo.c.prestamo_id),
+    ))
+
+
+def _marcar_vencimientos(db: Session, desde: date, hoy: date):
+    # Una cuota cumple `dias` de atraso el día fecha_pago + dias: entre el día
+    # siguiente a `desde` y `hoy` eso pasa para fecha_pago en
+    # [desde - dias + 1, hoy - dias]
+    rangos = [
+        futuros.c.fecha_pago.between(desde - timedelta(days=dias - 1), hoy - timedelta(days=dias))
+        for dias in LIMITES
+    ]
+    # Una consulta por estado: cada una usa el índice parcial de ese estado
+    _marcar(db, union(*(
+        select(futuros.c.prestamo_id).where(
+            futuros.c.estado == estado, futuros.c.prestamo_id.is_not(None), or_(*rangos),
+        )
+        for estado in ESTADOS_IMPAGOS
+    )))
+
+
+def _aplicar_diferencias(db: Session, anteriores: list, nuevos: list):
+    diferencias = {}
+    for filas, signo in ((anteriores, -1), (nuevos, 1)):
+        for fila in filas:
+            clave = tuple(fila[c] for c in CLAVES)
+            acumulado = diferencias.setdefault(clave, [0, 0, 0.0])
+            acumulado[0] += signo
+            acumulado[1] += signo * fila["cuotas_vencidas"]
+            acumulado[2] += signo * fila["saldo_vencido"]
+    valores = [
+        {**dict(zip(CLAVES, clave)), "prestamos": n, "cuotas_vencidas": cuotas, "saldo_vencido": saldo}
+        for clave, (n, cuotas, saldo) in diferencias.items()
+        if n or cuotas or saldo
+    ]
+    if not valores:
+        return
+    nuevas = pg_insert(resumen).values(valores)
+    db.execute(nuevas.on_conflict_do_update(
+        index_elements=list(CLAVES),
+        set_={
+            columna: resumen.c[columna] + nuevas.excluded[columna]
+            for columna in ("prestamos", *METRICAS)
+        },
+    ))
+    db.execute(delete(resumen).where(resumen.c.prestamos <= 0))
+
+
+def _refrescar_bloque(db: Session, hoy: date, tamano_bloque: int) -> int:
+    bloque = select(pendientes.c.prestamo_id).limit(tamano_bloque).with_for_update(skip_locked=True)
+    ids = db.execute(
+        delete(pendientes).where(pendientes.c.prestamo_id.in_(bloque)).returning(pendientes.c.prestamo_id)
+    ).scalars().all()
+    if not ids:
+        return 0
+    columnas = [por_prestamo.c[c] for c in (*CLAVES, *METRICAS)]
+    anteriores = db.execute(
+        delete(por_prestamo).where(_en(por_prestamo.c.prestamo_id, ids)).returning(*columnas)
+    ).mappings().all()
+    calculo = _calculo(ids, hoy)
+    nuevos = db.execute(
+        pg_insert(por_prestamo)
+        .from_select([c.name for c in calculo.selected_columns], calculo)
+        .returning(*columnas)
+    ).mappings().all()
+    _aplicar_diferencias(db, anteriores, nuevos)
+    return len(ids)
+
+
+def _fecha_referencia(db: Session) -> Optional[date]:
+    # Bloquea la fila de control: los refrescos concurrentes se turnan
+    db.execute(pg_insert(control).values(control_id=CONTROL_ID).on_conflict_do_nothing())
+    return db.execute(
+        select(control.c.fecha_referencia).where(control.c.control_id == CONTROL_ID).with_for_update()
+    ).scalar()
+
+
+def refrescar(hoy: Optional[date] = None, completo: bool = False, tamano_bloque: int = TAMANO_BLOQUE) -> dict:
+    hoy = hoy or date.today()
+    prestamos = 0
+    with database.SessionLocal() as db:
+        anterior = _fecha_referencia(db)
+        if anterior is not None and hoy < anterior and not completo:
+            raise ValueError(f"El último refresco fue con fecha {anterior}; para una fecha anterior use completo")
+        if completo or anterior is None:
+            _marcar_todos(db)
+        elif hoy > anterior:
+            _marcar_vencimientos(db, anterior, hoy)
+        db.execute(
+            update(control).where(control.c.control_id == CONTROL_ID)
+            .values(fecha_referencia=hoy, actualizado_en=datetime.now())
+        )
+        db.commit()
+
+        # Un commit por bloque para no retener los préstamos que los triggers
+        # vuelven a anotar; si otro refresco cambió la fecha, se detiene
+        while True:
+            if _fecha_referencia(db) != hoy:
+                break
+            procesados = _refrescar_bloque(db, hoy, tamano_bloque)
+            db.commit()
+            if not procesados:
+                break
+            prestamos += procesados
+    return {"fecha_referencia": hoy, "prestamos_actualizados": prestamos}
+
+
+def reporte(db: Session, agrupar: List[str]) -> dict:
+    columnas = [resumen.c[DIMENSIONES[d]] for d in agrupar]
+    filas = db.execute(
+        select(
+            *columnas,
+            func.sum(resumen.c.prestamos).label("prestamos"),
+            func.sum(resumen.c.cuotas_vencidas).label("cuotas_vencidas"),
+            func.sum(resumen.c.saldo_vencido).label("saldo_vencido"),
+        ).group_by(*columnas)
+    ).mappings().all()
+
+    grupos = []
+    for fila in filas:
+        grupo = dict(fila)
+        if "prestamo_estatus_id" in grupo:
+            estatus = catalogos.fila("estatus", grupo["prestamo_estatus_id"])
+            grupo["estatus"] = estatus["descripcion"] if estatus else None
+        if "ocupacion_id" in grupo:
+            ocupacion = catalogos.fila("ocupaciones", grupo["ocupacion_id"])
+            grupo["ocupacion"] = ocupacion["nombre_ocupacion"] if ocupacion else None
+        if grupo.get("depto_nacimiento") == "":
+            grupo["depto_nacimiento"] = None
+        grupos.append(grupo)
+    if "tramo" in agrupar:
+        grupos.sort(key=lambda g: TRAMOS.index(g["tramo"]))
+
+    estado = db.execute(
+        select(
+            control.c.fecha_referencia,
+            control.c.actualizado_en,
+            select(func.count()).select_from(pendientes).scalar_subquery().label("pendientes"),
+        ).where(control.c.control_id == CONTROL_ID)
+    ).mappings().first()
+    return {
+        "fecha_referencia": estado["fecha_referencia"] if estado else None,
+        "actualizado_en": estado["actualizado_en"] if estado else None,
+        "prestamos_por_refrescar": estado["pendientes"] if estado else None,
+        "grupos": grupos,
+    }
+
+
+# --- API -------------------------------------------------------------------------
+
+@router.get("/reportes/morosidad")
+def reporte_morosidad(
+    agrupar: List[str] = Query(["tramo"]),
+    db: Session = Depends(database.get_read_db),
+):
+    invalidas = [d for d in agrupar if d not in DIMENSIONES]
+    if invalidas:
+        raise HTTPException(status_code=400, detail=f"Dimensiones válidas: {', '.join(DIMENSIONES)}")
+    return reporte(db, list(dict.fromkeys(agrupar)))
+
+
+@router.post("/reportes/morosidad/refrescar")
+def refrescar_morosidad(completo: bool = False):
+    # Sesión propia con commits por bloque
+    return refrescar(completo=completo)
+
+
+# --- CLI -------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Refresco del reporte de morosidad")
+    parser.add_argument("--completo", action="store_true", help="Recalcular todos los préstamos")
+    parser.add_argument("--fecha", type=date.fromisoformat, default=None, help="Fecha de referencia (AAAA-MM-DD)")
+    parser.add_argument("--bloque", type=int, default=TAMANO_BLOQUE)
+    args = parser.parse_args()
+    print(json.dumps(refrescar(args.fecha, args.completo, args.bloque), default=str))
+
+
+if __name__ == "__main__":
+    main()
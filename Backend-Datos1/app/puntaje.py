@@ -0,0 +1,352 @@
+# puntaje.py
+# Precalificación de las solicitudes pendientes para ordenar la cola de
+# análisis por riesgo: GET /usuarios/prestamos/pendientes/puntaje.
+#
+# Las solicitudes pendientes se cargan como arreglos por columna (monto,
+# cuotas, edad, ocupación y el historial de pagos del cliente en
+# pagos_realizados) y se califican todas a la vez con NumPy. El puntaje va de
+# 0 (más riesgo) a 1000. Los modelos son intercambiables: cualquier función
+# que reciba el dict de arreglos y devuelva un arreglo de puntajes; se
+# registran con registrar_modelo() y se eligen con ?modelo= (PUNTAJE_MODELO
+# por defecto). Los pesos de los modelos incluidos son una política inicial,
+# no un modelo ajustado con datos.
+#
+# Caché: los arreglos y los puntajes quedan en memoria. La caché se registra
+# junto a las de cache.py, así que cache.invalidar_prestamos(...) marca los
+# préstamos modificados y la siguiente consulta solo recarga esos, las demás
+# pendientes de los mismos clientes (su historial pudo cambiar) y las
+# solicitudes nuevas. Todo se recarga cada PUNTAJE_TTL segundos (300) por los
+# cambios hechos en otros procesos.
+#
+#   python -m app.puntaje --modelo reglas --limite 20
+import argparse
+import io
+import json
+import os
+import threading
+import time
+from datetime import date
+from typing import Callable, Dict, Optional
+
+import numpy as np
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import Float, cast, func, literal, or_, select
+from sqlalchemy.orm import Session
+
+from . import cache, catalogos, database, models, schemas
+
+router = APIRouter()
+
+TTL = float(os.getenv("PUNTAJE_TTL", "300"))
+MODELO = os.getenv("PUNTAJE_MODELO", "coeficientes")
+ORDENES = ("puntaje", "monto_solicitado", "prestamo_id")
+
+prestamo = models.Prestamos.__table__
+usuarios = models.User.__table__
+realizados = models.PagosRealizados.__table__
+NAN = literal(float("nan"), Float)
+
+# Columna -> dtype de los arreglos; los nulos se cargan como 0 y edad como NaN
+COLUMNAS = {
+    "prestamo_id": np.int64,
+    "usuario_id": np.int64,
+    "monto_solicitado": np.float64,
+    "cuotas_pactadas": np.int64,
+    "edad": np.float64,
+    "ocupacion_id": np.int64,
+    "prestamos_previos": np.int64,
+    "pagos_aprobados": np.int64,
+    "pagos_rechazados": np.int64,
+    "monto_pagado": np.float64,
+}
+
+
+# --- Carga por columnas -----------------------------------------------------------
+
+def _consulta(hoy: date, condicion=None):
+    # Una fila por solicitud pendiente con el historial agregado de su cliente
+    historial = (
+        select(
+            prestamo.c.usuario_id,
+            func.count(func.distinct(prestamo.c.prestamo_id)).label("prestamos"),
+            func.count().filter(realizados.c.estado == "aprobado").label("aprobados"),
+            func.count().filter(realizados.c.estado.in_(["rechazado", "denegado"])).label("rechazados"),
+            func.sum(realizados.c.pago_realizado_monto_pagado).filter(realizados.c.estado == "aprobado").label("pagado"),
+        )
+        .join(realizados, realizados.c.prestamo_id == prestamo.c.prestamo_id)
+        .group_by(prestamo.c.usuario_id)
+        .subquery("historial")
+    )
+    consulta = (
+        select(
+            prestamo.c.prestamo_id,
+            func.coalesce(prestamo.c.usuario_id, 0),
+            func.coalesce(prestamo.c.monto_solicitado, 0.0),
+            func.coalesce(prestamo.c.cuotas_pactadas, 0),
+            func.coalesce(cast(func.date_part("year", func.age(hoy, usuarios.c.fecha_nacimiento)), Float), NAN),
+            func.coalesce(usuarios.c.ocupaciones_id, 0),
+            func.coalesce(historial.c.prestamos, 0),
+            func.coalesce(historial.c.aprobados, 0),
+            func.coalesce(historial.c.rechazados, 0),
+            func.coalesce(historial.c.pagado, 0.0),
+        )
+        .outerjoin(usuarios, usuarios.c.usuario_id == prestamo.c.usuario_id)
+        .outerjoin(historial, historial.c.usuario_id == prestamo.c.usuario_id)
+        .where(prestamo.c.prestamo_estatus_id == catalogos.estatus_id("pendiente"))
+    )
+    return consulta if condicion is None else consulta.where(condicion)
+
+
+def cargar(db: Session, hoy: date, condicion=None) -> Dict[str, np.ndarray]:
+    consulta = _consulta(hoy, condicion)
+    conexion = db.connection().connection.driver_connection
+    if db.get_bind().dialect.driver == "asyncpg":
+        # Sesión de run_sync (DB_MODO=async): filas y una lista por columna
+        filas = db.execute(consulta).all()
+        columnas = list(zip(*filas)) if filas else [()] * len(COLUMNAS)
+        return {nombre: np.array(valores, dtype=dtype) for (nombre, dtype), valores in zip(COLUMNAS.items(), columnas)}
+
+    # COPY (consulta) TO STDOUT y np.loadtxt: con un millón de pendientes tarda
+    # menos de la mitad que armar las filas (todas las columnas son numéricas
+    # y sin nulos)
+    compilada = consulta.compile(dialect=db.get_bind().dialect, compile_kwargs={"render_postcompile": True})
+    sql = f"COPY ({compilada}) TO STDOUT"
+    buffer = io.BytesIO()
+    cursor = conexion.cursor()
+    try:
+        if hasattr(cursor, "copy_expert"):  # psycopg2
+            cursor.copy_expert(cursor.mogrify(sql, compilada.params).decode(), buffer)
+        else:  # psycopg 3
+            with cursor.copy(sql, compilada.params) as copia:
+                for datos in copia:
+                    buffer.write(datos)
+    finally:
+        cursor.close()
+    if not buffer.tell():
+        return {nombre: np.empty(0, dtype=dtype) for nombre, dtype in COLUMNAS.items()}
+    buffer.seek(0)
+    matriz = np.loadtxt(buffer, dtype=np.float64, delimiter="\t", ndmin=2)
+    return {nombre: matriz[:, i].astype(dtype) for i, (nombre, dtype) in enumerate(COLUMNAS.items())}
+
+
+# --- Modelos --------------------------------------------------------------------------
+
+def variables(datos: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    # Variables derivadas comunes; los faltantes quedan en un valor neutro
+    con_historial = datos["pagos_aprobados"] + datos["pagos_rechazados"]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cuota = np.where(datos["cuotas_pactadas"] > 0, datos["monto_solicitado"] / datos["cuotas_pactadas"], datos["monto_solicitado"])
+        tasa_aprobados = np.where(con_historial > 0, datos["pagos_aprobados"] / con_historial, 0.5)
+    return {
+        "log_monto": np.log10(datos["monto_solicitado"].clip(min=0) + 1),
+        "log_cuota": np.log10(cuota.clip(min=0) + 1),
+        "cuotas": datos["cuotas_pactadas"].astype(np.float64),
+        "edad": np.nan_to_num((datos["edad"] - 35) / 10, nan=0.0).clip(-2, 3),
+        "tasa_aprobados": tasa_aprobados,
+        "pagos_rechazados": np.minimum(datos["pagos_rechazados"], 10).astype(np.float64),
+        "prestamos_previos": np.minimum(datos["prestamos_previos"], 5).astype(np.float64),
+    }
+
+
+class ModeloCoeficientes:
+    # Logístico: 1000 / (1 + e^-(intercepto + Σ coeficiente · variable + ajuste por ocupación))
+    def __init__(self, intercepto: float, coeficientes: Dict[str, float], ocupaciones: Optional[Dict[int, float]] = None):
+        self.intercepto = intercepto
+        self.coeficientes = coeficientes
+        self.ocupaciones = ocupaciones or {}
+
+    def __call__(self, datos: Dict[str, np.ndarray]) -> np.ndarray:
+        derivadas = variables(datos)
+        z = np.full(len(datos["prestamo_id"]), self.intercepto)
+        for nombre, coeficiente in self.coeficientes.items():
+            z += coeficiente * derivadas[nombre]
+        if self.ocupaciones:
+            ids = np.fromiter(self.ocupaciones, dtype=np.int64)
+            ajustes = np.fromiter(self.ocupaciones.values(), dtype=np.float64)
+            orden = np.argsort(ids)
+            posicion = np.searchsorted(ids[orden], datos["ocupacion_id"]).clip(max=len(ids) - 1)
+            encontrada = ids[orden][posicion] == datos["ocupacion_id"]
+            z += np.where(encontrada, ajustes[orden][posicion], 0.0)
+        return np.rint(1000 / (1 + np.exp(-z))).astype(np.int64)
+
+
+class ModeloReglas:
+    # base + los puntos de cada regla que se cumple, entre 0 y 1000
+    def __init__(self, base: int, reglas: list):
+        self.base = base
+        self.reglas = reglas  # (descripción, función(datos) -> máscara, puntos)
+
+    def __call__(self, datos: Dict[str, np.ndarray]) -> np.ndarray:
+        puntaje = np.full(len(datos["prestamo_id"]), self.base, dtype=np.int64)
+        for _, condicion, puntos in self.reglas:
+            puntaje += np.where(condicion(datos), puntos, 0)
+        return puntaje.clip(0, 1000)
+
+
+MODELOS: Dict[str, Callable[[Dict[str, np.ndarray]], np.ndarray]] = {
+    "coeficientes": ModeloCoeficientes(
+        intercepto=2.0,
+        coeficientes={
+            "log_cuota": -0.6, "cuotas": -0.03, "edad": 0.15, "tasa_aprobados": 1.5,
+            "pagos_rechazados": -0.3, "prestamos_previos": 0.2,
+        },
+    ),
+    "reglas": ModeloReglas(500, [
+        ("Historial de pagos aprobados", lambda d: d["pagos_aprobados"] >= 3, 150),
+        ("Sin pagos rechazados", lambda d: d["pagos_rechazados"] == 0, 100),
+        ("Pagos rechazados frecuentes", lambda d: d["pagos_rechazados"] >= 3, -200),
+        ("Monto alto", lambda d: d["monto_solicitado"] > 50000, -150),
+        ("Plazo corto", lambda d: d["cuotas_pactadas"] <= 6, 50),
+        ("Edad fuera de 21 a 65 años", lambda d: (d["edad"] < 21) | (d["edad"] > 65), -100),
+    ]),
+}
+
+
+def registrar_modelo(nombre: str, modelo: Callable[[Dict[str, np.ndarray]], np.ndarray]):
+    MODELOS[nombre] = modelo
+
+
+# --- Caché --------------------------------------------------------------------------
+
+class CachePuntajes:
+    # Arreglos de las pendientes y, por modelo, sus puntajes y órdenes. Se
+    # registra en cache._registradas como las CachePrestamos: invalidar()
+    # solo marca préstamos, la recarga la hace la siguiente consulta.
+    def __init__(self, nombre: str, ttl: float = TTL):
+        self.nombre = nombre
+        self.ttl = ttl
+        self.aciertos = 0
+        self.fallos = 0
+        self._datos = None
+        self._vence = 0.0
+        self._hoy = None
+        self._calculados = {}  # modelo -> puntajes; (modelo, orden, descendente) -> índices
+        self._sucios = set()
+        self._lock = threading.Lock()  # _sucios
+        self._carga = threading.Lock()  # una recarga a la vez, sin bloquear invalidar()
+        cache._registradas.append(self)
+
+    def invalidar(self, prestamo_ids):
+        with self._lock:
+            self._sucios.update(prestamo_ids)
+
+    def limpiar(self):
+        with self._lock:
+            self._vence = 0.0
+
+    def estadisticas(self) -> dict:
+        return {
+            "pendientes": 0 if self._datos is None else len(self._datos["prestamo_id"]),
+            "aciertos": self.aciertos, "fallos": self.fallos,
+        }
+
+    def _actualizar(self, db: Session, hoy: date):
+        with self._lock:
+            sucios, self._sucios = self._sucios, set()
+            completa = self._datos is None or self._vence < time.monotonic() or self._hoy != hoy
+        if completa:
+            self._datos = cargar(db, hoy)
+            self._vence = time.monotonic() + self.ttl
+            self._hoy = hoy
+            self._calculados = {}
+            self.fallos += 1
+            return
+
+        # Incremental: préstamos marcados, pendientes de sus clientes y solicitudes nuevas
+        ultimo = int(self._datos["prestamo_id"].max()) if len(self._datos["prestamo_id"]) else 0
+        condicion = prestamo.c.prestamo_id > ultimo
+        if sucios:
+            ids = list(sucios)
+            clientes = select(prestamo.c.usuario_id).where(prestamo.c.prestamo_id.in_(ids))
+            condicion = or_(condicion, prestamo.c.prestamo_id.in_(ids), prestamo.c.usuario_id.in_(clientes))
+        nuevos = cargar(db, hoy, condicion)
+        if not sucios and not len(nuevos["prestamo_id"]):
+            self.aciertos += 1
+            return
+        descartar = np.isin(self._datos["prestamo_id"], np.concatenate([np.fromiter(sucios, np.int64), nuevos["prestamo_id"]]))
+        self._datos = {
+            nombre: np.concatenate([valores[~descartar], nuevos[nombre]]) for nombre, valores in self._datos.items()
+        }
+        self._calculados = {}
+        self.fallos += 1
+
+    def consultar(self, db: Session, modelo: str, orden: str, descendente: bool, hoy: date) -> tuple:
+        # (datos, puntajes, índices en el orden pedido) de una misma versión
+        with self._carga:
+            self._actualizar(db, hoy)
+            datos, calculados = self._datos, self._calculados
+            if modelo not in calculados:
+                calculados[modelo] = MODELOS[modelo](datos)
+            puntajes = calculados[modelo]
+            clave = (modelo, orden, descendente)
+            if clave not in calculados:
+                valores = puntajes if orden == "puntaje" else datos[orden]
+                # Empates por prestamo_id ascendente
+                calculados[clave] = np.lexsort((datos["prestamo_id"], -valores if descendente else valores))
+            return datos, puntajes, calculados[clave]
+
+
+cache_puntajes = CachePuntajes("puntaje_pendientes")
+
+
+def cola(db: Session, modelo: str = MODELO, orden: str = "puntaje", descendente: bool = True,
+         limite: int = 100, desplazamiento: int = 0, hoy: Optional[date] = None) -> dict:
+    if modelo not in MODELOS:
+        raise HTTPException(status_code=400, detail=f"Modelo debe ser uno de {', '.join(MODELOS)}")
+    datos, puntajes, indices = cache_puntajes.consultar(db, modelo, orden, descendente, hoy or date.today())
+    pagina = indices[desplazamiento:desplazamiento + limite]
+    ids = datos["prestamo_id"][pagina].tolist()
+    codigos = dict(db.execute(
+        select(prestamo.c.prestamo_id, prestamo.c.codigo_prestamo).where(prestamo.c.prestamo_id.in_(ids))
+    ).all()) if ids else {}
+    items = []
+    for i in pagina.tolist():
+        fila = {nombre: valores[i].item() for nombre, valores in datos.items()}
+        fila["edad"] = None if np.isnan(fila["edad"]) else fila["edad"]
+        fila["codigo_prestamo"] = codigos.get(fila["prestamo_id"])
+        fila["puntaje"] = int(puntajes[i])
+        items.append(fila)
+    total = len(indices)
+    return {
+        "modelo": modelo,
+        "total": total,
+        "items": items,
+        "siguiente": desplazamiento + limite if desplazamiento + limite < total else None,
+    }
+
+
+# --- API -------------------------------------------------------------------------
+
+@router.get("/prestamos/pendientes/puntaje", response_model=schemas.ColaPuntajes)
+def cola_por_puntaje(
+    modelo: str = MODELO,
+    orden: str = Query("puntaje", pattern=f"^({'|'.join(ORDENES)})$"),
+    descendente: bool = True,
+    limite: int = Query(100, ge=1, le=1000),
+    desplazamiento: int = Query(0, ge=0),
+    db: Session = Depends(database.get_read_db),
+):
+    # Por defecto las de menor riesgo primero
+    return cola(db, modelo, orden, descendente, limite, desplazamiento)
+
+
+# --- CLI -------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Precalificación de solicitudes pendientes")
+    parser.add_argument("--modelo", choices=list(MODELOS), default=MODELO)
+    parser.add_argument("--limite", type=int, default=20)
+    parser.add_argument("--ascendente", action="store_true", help="Las de mayor riesgo primero")
+    args = parser.parse_args()
+
+    with database.SessionLocal() as db:
+        inicio = time.perf_counter()
+        resultado = cola(db, args.modelo, descendente=not args.ascendente, limite=args.limite)
+        duracion = time.perf_counter() - inicio
+    for item in resultado["items"]:
+        print(json.dumps(item, ensure_ascii=False))
+    print(f"{resultado['total']} solicitudes pendientes calificadas en {duracion:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
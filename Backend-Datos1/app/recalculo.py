@@ -0,0 +1,202 @@
+# recalculo.py
+# Recálculo masivo de cargos_administrativos.prestamo_total.
+#
+# Aplica la fórmula de aprobar_prestamo ("aprobacion") o la de
+# actualizar_datos_prestamo ("actualizacion") a todos los préstamos que
+# cumplen el filtro con un UPDATE ... FROM prestamo por bloque de prestamo_id.
+# Cada bloque se confirma por separado para no retener bloqueos.
+#
+# Los préstamos que ya tienen calendario (pagos_futuros, ver amortizacion.py)
+# no se tocan: su total es la suma de las cuotas y cambiarlo aquí dejaría el
+# calendario desfasado. Se informan en omitidos_con_calendario; para cambiar su
+# política hay que reprogramar el calendario.
+#
+#   python -m app.recalculo --estatus 1 --dry-run
+#   python -m app.recalculo --formula actualizacion --iva 0 --cargos 25
+import argparse
+import json
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import func, literal, or_, select, update
+from sqlalchemy.orm import Session
+
+from . import cache, database, models, schemas
+
+router = APIRouter()
+
+FORMULAS = ("aprobacion", "actualizacion")
+TAMANO_BLOQUE = schemas.Recalculo.model_fields["tamano_bloque"].default
+
+prestamo = models.Prestamos.__table__
+cargos = models.CargosAdmin.__table__
+pagos = models.PagosFuturos.__table__
+
+# Préstamos con calendario generado
+con_calendario = select(pagos.c.pago_id).where(pagos.c.prestamo_id == prestamo.c.prestamo_id).exists()
+
+
+def _valor(nuevo, columna):
+    return literal(nuevo) if nuevo is not None else func.coalesce(columna, 0.0)
+
+
+def _expresiones(parametros: schemas.Recalculo) -> dict:
+    monto = func.coalesce(prestamo.c.monto_solicitado, 0.0)
+    interes = _valor(parametros.porcentaje_interes, prestamo.c.porcentaje_interes)
+    iva = _valor(parametros.prestamo_iva, cargos.c.prestamo_iva)
+    cargos_adm = _valor(parametros.prestamo_cargos_administrativos, cargos.c.prestamo_cargos_administrativos)
+    if parametros.formula == "aprobacion":
+        total = (monto + iva + cargos_adm) * (1 + interes / 100)
+    else:
+        total = monto + monto * interes / 100 + iva + cargos_adm
+    return {"prestamo_iva": iva, "prestamo_cargos_administrativos": cargos_adm, "prestamo_total": total}
+
+
+def _filtro(parametros: schemas.Recalculo, desde: Optional[int] = None, hasta: Optional[int] = None, con_cargos: bool = True, calendario: bool = False) -> list:
+    # calendario=False excluye los préstamos con calendario, True deja solo esos
+    condiciones = [cargos.c.prestamo_id == prestamo.c.prestamo_id] if con_cargos else []
+    condiciones.append(con_calendario if calendario else ~con_calendario)
+    if parametros.estatus:
+        condiciones.append(prestamo.c.prestamo_estatus_id.in_(parametros.estatus))
+    if parametros.usuario_id is not None:
+        condiciones.append(prestamo.c.usuario_id == parametros.usuario_id)
+    if parametros.prestamo_desde is not None:
+        condiciones.append(prestamo.c.prestamo_id >= parametros.prestamo_desde)
+    if parametros.prestamo_hasta is not None:
+        condiciones.append(prestamo.c.prestamo_id <= parametros.prestamo_hasta)
+    if desde is not None:
+        condiciones.append(prestamo.c.prestamo_id.between(desde, hasta))
+    return condiciones
+
+
+def _resumen(filas, total_anterior, total_nuevo):
+    delta = total_nuevo - total_anterior
+    return select(
+        func.count().label("prestamos"),
+        func.coalesce(func.sum(total_anterior), 0.0).label("total_anterior"),
+        func.coalesce(func.sum(total_nuevo), 0.0).label("total_nuevo"),
+        func.coalesce(func.sum(delta), 0.0).label("delta_total"),
+        func.coalesce(func.min(delta), 0.0).label("delta_minimo"),
+        func.coalesce(func.max(delta), 0.0).label("delta_maximo"),
+    ).select_from(filas)
+
+
+def _omitidos(db: Session, parametros: schemas.Recalculo) -> int:
+    return db.execute(
+        select(func.count()).select_from(prestamo).where(*_filtro(parametros, con_cargos=False, calendario=True))
+    ).scalar_one()
+
+
+RESUMEN_VACIO = {
+    "prestamos": 0, "total_anterior": 0.0, "total_nuevo": 0.0,
+    "delta_total": 0.0, "delta_minimo": 0.0, "delta_maximo": 0.0,
+}
+
+
+def _sumar(acumulado: dict, parcial: dict) -> dict:
+    if not parcial["prestamos"]:
+        return acumulado
+    if not acumulado["prestamos"]:
+        return dict(parcial)
+    return {
+        "prestamos": acumulado["prestamos"] + parcial["prestamos"],
+        "total_anterior": acumulado["total_anterior"] + parcial["total_anterior"],
+        "total_nuevo": acumulado["total_nuevo"] + parcial["total_nuevo"],
+        "delta_total": acumulado["delta_total"] + parcial["delta_total"],
+        "delta_minimo": min(acumulado["delta_minimo"], parcial["delta_minimo"]),
+        "delta_maximo": max(acumulado["delta_maximo"], parcial["delta_maximo"]),
+    }
+
+
+def recalcular(db: Session, parametros: schemas.Recalculo) -> dict:
+    if parametros.formula not in FORMULAS:
+        raise ValueError(f"Fórmula debe ser una de {', '.join(FORMULAS)}")
+    valores = _expresiones(parametros)
+    anterior = func.coalesce(cargos.c.prestamo_total, 0.0)
+    cambia = or_(*(cargos.c[columna].is_distinct_from(valor) for columna, valor in valores.items()))
+
+    if parametros.dry_run:
+        # Solo lectura: una consulta agregada sobre todo el filtro
+        filas = select(
+            anterior.label("anterior"), valores["prestamo_total"].label("nuevo")
+        ).where(*_filtro(parametros), cambia).subquery()
+        resumen = db.execute(_resumen(filas, filas.c.anterior, filas.c.nuevo)).mappings().one()
+        return {"dry_run": True, **resumen, "omitidos_con_calendario": _omitidos(db, parametros)}
+
+    omitidos = _omitidos(db, parametros)
+    minimo, maximo = db.execute(
+        select(func.min(prestamo.c.prestamo_id), func.max(prestamo.c.prestamo_id)).where(*_filtro(parametros))
+    ).one()
+    db.commit()
+    acumulado = RESUMEN_VACIO
+    if minimo is None:
+        return {"dry_run": False, **acumulado, "omitidos_con_calendario": omitidos}
+
+    for desde in range(minimo, maximo + 1, parametros.tamano_bloque):
+        hasta = desde + parametros.tamano_bloque - 1
+        # UPDATE cargos_administrativos ... FROM prestamo; el total anterior se
+        # toma de una subconsulta para poder agregar los cambios del bloque
+        anteriores = select(cargos.c.cargos_id, anterior.label("anterior")).where(
+            *_filtro(parametros, desde, hasta), cambia
+        ).subquery()
+        actualizados = (
+            update(cargos)
+            .where(cargos.c.cargos_id == anteriores.c.cargos_id, cargos.c.prestamo_id == prestamo.c.prestamo_id)
+            .values(**valores)
+            .returning(anteriores.c.anterior, cargos.c.prestamo_total)
+            .cte("actualizados")
+        )
+        parcial = db.execute(_resumen(actualizados, actualizados.c.anterior, actualizados.c.prestamo_total)).mappings().one()
+        if parametros.porcentaje_interes is not None:
+            db.execute(
+                update(prestamo)
+                .where(*_filtro(parametros, desde, hasta, con_cargos=False))
+                .values(porcentaje_interes=parametros.porcentaje_interes)
+            )
+        db.commit()
+        # Un bloque puede tocar miles de préstamos: se descarta toda la caché
+        cache.limpiar_todo()
+        acumulado = _sumar(acumulado, dict(parcial))
+    return {"dry_run": False, **acumulado, "omitidos_con_calendario": omitidos}
+
+
+@router.post(
+    "/prestamos/recalcular-cargos",
+    description="Recalcula prestamo_total de los préstamos del filtro. Los que ya tienen calendario "
+    "de pagos (pagos_futuros) se omiten y se cuentan en omitidos_con_calendario.",
+)
+def recalcular_cargos(parametros: schemas.Recalculo, db: Session = Depends(database.get_db)):
+    if parametros.formula not in FORMULAS:
+        raise HTTPException(status_code=400, detail=f"Fórmula debe ser una de {', '.join(FORMULAS)}")
+    return recalcular(db, parametros)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Recálculo masivo de prestamo_total",
+        epilog="Los préstamos con calendario de pagos (pagos_futuros) se omiten y se cuentan en omitidos_con_calendario.",
+    )
+    parser.add_argument("--formula", choices=FORMULAS, default="aprobacion")
+    parser.add_argument("--estatus", type=int, action="append")
+    parser.add_argument("--prestamo-desde", type=int)
+    parser.add_argument("--prestamo-hasta", type=int)
+    parser.add_argument("--usuario-id", type=int)
+    parser.add_argument("--interes", type=float, help="Nuevo porcentaje de interés")
+    parser.add_argument("--iva", type=float, help="Nuevo IVA")
+    parser.add_argument("--cargos", type=float, help="Nuevos cargos administrativos")
+    parser.add_argument("--tamano-bloque", type=int, default=TAMANO_BLOQUE)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    parametros = schemas.Recalculo(
+        formula=args.formula, estatus=args.estatus, prestamo_desde=args.prestamo_desde,
+        prestamo_hasta=args.prestamo_hasta, usuario_id=args.usuario_id, porcentaje_interes=args.interes,
+        prestamo_iva=args.iva, prestamo_cargos_administrativos=args.cargos,
+        dry_run=args.dry_run, tamano_bloque=args.tamano_bloque,
+    )
+    with database.SessionLocal() as db:
+        print(json.dumps(recalcular(db, parametros), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+# recepcion.py
+# Recepción de solicitudes en cola para los picos de campaña.
+#
+# Con SOLICITUDES_MODO=cola, POST /usuarios/prestamos/solicitud solo valida la
+# solicitud, la guarda en solicitudes_recibidas y responde 202 con el número
+# de seguimiento (solicitud_id). Los trabajadores toman las pendientes por
+# lotes y las crean con crud.crear_solicitud, la misma lógica del modo directo
+# (por defecto), cada una en su savepoint y un commit por lote. El estado se
+# consulta en GET /usuarios/prestamos/solicitudes/{solicitud_id}.
+#
+# Control de admisión: con SOLICITUDES_COLA_MAXIMO pendientes la solicitud se
+# rechaza con 503 y Retry-After, así un pico se convierte en una cola acotada
+# que los trabajadores vacían al ritmo que la base de datos sostiene.
+#
+# Los trabajadores corren dentro de la aplicación en cualquier modo
+# (SOLICITUDES_TRABAJADORES hilos, 0 los desactiva) o como proceso aparte; varios a la vez se reparten
+# las solicitudes con FOR UPDATE SKIP LOCKED. Si un trabajador se detiene a
+# mitad de un lote, la transacción se revierte y sus solicitudes siguen
+# pendientes.
+#
+#   python -m app.recepcion --trabajadores 4
+import argparse
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import JSONResponse
+from pydantic import ValidationError
+from sqlalchemy import bindparam, func, insert, literal, select, update
+from sqlalchemy.exc import DataError, IntegrityError, SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from . import carga_masiva, catalogos, database, models, schemas
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+MODO = os.getenv("SOLICITUDES_MODO", "directo")
+MAXIMO_COLA = int(os.getenv("SOLICITUDES_COLA_MAXIMO", "10000"))
+TRABAJADORES = int(os.getenv("SOLICITUDES_TRABAJADORES", "2"))
+TAMANO_LOTE = int(os.getenv("SOLICITUDES_LOTE", "100"))
+INTERVALO = float(os.getenv("SOLICITUDES_INTERVALO", "1"))
+REINTENTAR_EN = 5  # segundos, encabezado Retry-After del 503
+
+if MODO not in ("directo", "cola"):
+    raise ValueError("SOLICITUDES_MODO debe ser 'directo' o 'cola'")
+
+recibidas = models.SolicitudRecibida.__table__
+pendiente = recibidas.c.estado == "pendiente"
+
+
+def encolar(db: Session, cliente: schemas.ClienteSolicitud) -> JSONResponse:
+    # Un solo INSERT ... SELECT que no inserta nada si la cola está llena. La
+    # profundidad se estima como el último solicitud_id menos la pendiente más
+    # antigua (dos lecturas de índice, sin contar filas); un rechazo no
+    # consume números de seguimiento, así que no deja huecos que la inflen.
+    mas_antigua = select(func.min(recibidas.c.solicitud_id)).where(pendiente).scalar_subquery()
+    ultima = select(func.max(recibidas.c.solicitud_id)).scalar_subquery()
+    profundidad = func.coalesce(ultima - mas_antigua + 1, 0)
+    solicitud_id = db.execute(
+        insert(recibidas)
+        .from_select(
+            ["datos", "recibida_en"],
+            select(literal(cliente.model_dump(mode="json"), recibidas.c.datos.type), literal(datetime.now()))
+            .where(profundidad < MAXIMO_COLA),
+        )
+        .returning(recibidas.c.solicitud_id)
+    ).scalar()
+    if solicitud_id is None:
+        raise HTTPException(
+            status_code=503,
+            detail="Hay demasiadas solicitudes en espera, intente más tarde",
+            headers={"Retry-After": str(REINTENTAR_EN)},
+        )
+    db.commit()
+    trabajadores.avisar()
+    seguimiento = f"/usuarios/prestamos/solicitudes/{solicitud_id}"
+    return JSONResponse(
+        status_code=202,
+        content={"solicitud_id": solicitud_id, "estado": "pendiente", "seguimiento": seguimiento},
+        headers={"Location": seguimiento},
+    )
+
+
+def procesar_lote(tamano_lote: int = TAMANO_LOTE) -> list:
+    # Crea hasta `tamano_lote` solicitudes pendientes en una transacción;
+    # devuelve el resultado de cada una (vacío si no había pendientes)
+    from . import crud  # crud importa este módulo
+
+    with database.SessionLocal() as db:
+        filas = db.execute(
+            select(recibidas.c.solicitud_id, recibidas.c.datos)
+            .where(pendiente)
+            .order_by(recibidas.c.solicitud_id)
+            .limit(tamano_lote)
+            .with_for_update(skip_locked=True)
+        ).all()
+        if not filas:
+            return []
+
+        resultados = []
+        conflictos = False
+        for fila in filas:
+            resultado = {
+                "b_solicitud_id": fila.solicitud_id, "estado": "error", "usuario_id": None,
+                "prestamo_id": None, "codigo_prestamo": None, "error": None,
+            }
+            try:
+                cliente = schemas.ClienteSolicitud.model_validate(fila.datos)
+                with db.begin_nested():
+                    creada = crud.crear_solicitud(db, cliente)
+                resultado.update(
+                    estado="creada", usuario_id=creada["usuario_id"], prestamo_id=creada["prestamo_id"],
+                    codigo_prestamo=creada["codigo_prestamo"],
+                )
+            except ValidationError as e:
+                resultado["error"] = carga_masiva.mensaje_validacion(e)
+            except (IntegrityError, DataError) as e:
+                conflictos = True
+                resultado["error"] = carga_masiva.mensaje_bd(e)
+            resultados.append(resultado)
+
+        db.execute(
+            update(recibidas)
+            .where(recibidas.c.solicitud_id == bindparam("b_solicitud_id"))
+            .values(
+                estado=bindparam("estado"), procesada_en=datetime.now(), usuario_id=bindparam("usuario_id"),
+                prestamo_id=bindparam("prestamo_id"), codigo_prestamo=bindparam("codigo_prestamo"),
+                error=bindparam("error"),
+            ),
+            resultados,
+        )
+        db.commit()
+    if conflictos:
+        # Como en el modo directo: puede venir de una ocupación del catálogo que ya no existe
+        catalogos.invalidar()
+    return resultados
+
+
+class Trabajadores:
+    # Hilos que vacían la cola mientras corre la aplicación. Después de cada
+    # solicitud encolada en este proceso se les avisa; si no, revisan la cola
+    # cada `intervalo` segundos.
+    def __init__(self, cantidad: int = TRABAJADORES, tamano_lote: int = TAMANO_LOTE, intervalo: float = INTERVALO):
+        self.cantidad = cantidad
+        self.tamano_lote = tamano_lote
+        self.intervalo = intervalo
+        self._detener = threading.Event()
+        self._aviso = threading.Event()
+        self._hilos = []
+        self._lock = threading.Lock()
+        self.creadas = 0
+        self.errores = 0
+        self.lotes = 0
+
+    def iniciar(self):
+        if self.cantidad <= 0 or self._hilos:
+            return
+        self._detener.clear()
+        self._hilos = [
+            threading.Thread(target=self._ciclo, name=f"recepcion-{n}", daemon=True) for n in range(self.cantidad)
+        ]
+        for hilo in self._hilos:
+            hilo.start()
+
+    def detener(self, espera: float = 30):
+        # Cada hilo termina el lote que tenga en curso
+        self._detener.set()
+        self._aviso.set()
+        for hilo in self._hilos:
+            hilo.join(espera)
+        self._hilos = []
+
+    def avisar(self):
+        self._aviso.set()
+
+    def _contar(self, resultados: list):
+        creadas = sum(1 for r in resultados if r["estado"] == "creada")
+        with self._lock:
+            self.creadas += creadas
+            self.errores += len(resultados) - creadas
+            self.lotes += 1
+
+    def _ciclo(self):
+        espera = self.intervalo
+        while not self._detener.is_set():
+            try:
+                resultados = procesar_lote(self.tamano_lote)
+                espera = self.intervalo
+            except SQLAlchemyError:
+                # La base de datos no responde: reintentar cada vez más espaciado
+                logger.exception("Falló un lote de solicitudes en cola")
+                resultados = []
+                espera = min(espera * 2, 30)
+            if resultados:
+                self._contar(resultados)
+            if len(resultados) < self.tamano_lote:
+                # Cola vacía (o la tienen otros trabajadores): esperar aviso
+                self._aviso.wait(espera)
+                self._aviso.clear()
+
+    def estadisticas(self) -> dict:
+        return {
+            "trabajadores": len(self._hilos), "lotes": self.lotes, "creadas": self.creadas, "errores": self.errores,
+        }
+
+
+trabajadores = Trabajadores()
+
+
+# --- API -------------------------------------------------------------------------
+
+@router.get("/prestamos/solicitudes/cola")
+def estado_cola(db: Session = Depends(database.get_read_db)):
+    # Profundidad y antigüedad de la cola; los contadores son de este proceso
+    cantidad, mas_antigua = db.execute(
+        select(func.count(), func.min(recibidas.c.recibida_en)).where(pendiente)
+    ).one()
+    return {
+        "modo": MODO,
+        "pendientes": cantidad,
+        "maximo": MAXIMO_COLA,
+        "espera_segundos": (datetime.now() - mas_antigua).total_seconds() if mas_antigua else 0.0,
+        **trabajadores.estadisticas(),
+    }
+
+
+@router.get("/prestamos/solicitudes/{solicitud_id}", response_model=schemas.EstadoSolicitud)
+def estado_solicitud(solicitud_id: int, db: Session = Depends(database.get_db)):
+    # Lee de la primaria: el cliente consulta justo después de encolar
+    fila = db.execute(
+        select(recibidas).where(recibidas.c.solicitud_id == solicitud_id)
+    ).mappings().first()
+    if fila is None:
+        raise HTTPException(status_code=404, detail="Solicitud no encontrada")
+    return fila
+
+
+# --- CLI -------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Trabajadores de la cola de solicitudes")
+    parser.add_argument("--trabajadores", type=int, default=max(TRABAJADORES, 1))
+    parser.add_argument("--lote", type=int, default=TAMANO_LOTE)
+    parser.add_argument("--intervalo", type=float, default=INTERVALO)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    proceso = Trabajadores(args.trabajadores, args.lote, args.intervalo)
+    proceso.iniciar()
+    try:
+        while True:
+            time.sleep(60)
+            logger.info("Solicitudes en cola: %s", proceso.estadisticas())
+    except KeyboardInterrupt:
+        proceso.detener()
+
+
+if __name__ == "__main__":
+    main()
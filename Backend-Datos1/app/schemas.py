@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from typing import Optional, List, Any
+from pydantic import BaseModel, Field, field_validator
+from typing import Optional, List
 from datetime import date , datetime
 
 
@@ -18,13 +18,6 @@ class ReferenciaBase(BaseModel):
     telefono: str
 
 
-class ReferenciaCreate(BaseModel):
-    referencia1: ReferenciaBase
-    referencia2: ReferenciaBase
-    referencia3: Optional[ReferenciaBase] = None
-    referencia4: Optional[ReferenciaBase] = None
-
-
 class ClienteSolicitud(BaseModel):
     genero: str
     cui: str
@@ -39,11 +32,28 @@ class ClienteSolicitud(BaseModel):
     apellido_casada: Optional[str] = None
     ocupacion: str  # Nombre de la ocupación
     direccion: DireccionCreate
-    referencias: ReferenciaCreate
+    referencias: List[ReferenciaBase] = Field(min_length=2, max_length=10)
     monto_prestamo: float
     motivo_prestamo: str
     cuotas_pactadas: int  # Valor entre 1 y 12
 
+    @field_validator("referencias", mode="before")
+    @classmethod
+    def referencias_numeradas(cls, valor):
+        # Formato anterior {"referencia1": {...}, "referencia2": {...}}, que
+        # también producen las columnas referencias.referenciaN.campo del CSV
+        # de carga masiva; se convierte a lista en el orden de N
+        if not isinstance(valor, dict):
+            return valor
+        numeradas = {}
+        for clave, referencia in valor.items():
+            n = clave.removeprefix("referencia")
+            if not n.isdigit():
+                raise ValueError(f"Clave de referencia inválida: {clave}")
+            if referencia is not None:
+                numeradas[int(n)] = referencia
+        return [numeradas[n] for n in sorted(numeradas)]
+
 
 class PrestamoResponse(BaseModel):
     message: str
@@ -56,6 +66,24 @@ class PrestamoResponse(BaseModel):
     porcentaje_interes: float
     prestamo_estatus_id: int
 
+
+class SolicitudEncolada(BaseModel):
+    # Respuesta 202 de POST /prestamos/solicitud con SOLICITUDES_MODO=cola
+    solicitud_id: int
+    estado: str
+    seguimiento: str
+
+
+class EstadoSolicitud(BaseModel):
+    solicitud_id: int
+    estado: str  # pendiente, creada o error
+    recibida_en: datetime
+    procesada_en: Optional[datetime] = None
+    usuario_id: Optional[int] = None
+    prestamo_id: Optional[int] = None
+    codigo_prestamo: Optional[str] = None
+    error: Optional[str] = None
+
 class PrestamoUpdate(BaseModel):
     porcentaje_interes: float
     monto_solicitado: float
@@ -82,29 +110,63 @@ class PrestamoResponse(BaseModel):
     prestamo_estatus_id: int
     codigo_prestamo: str
 
+
+class PrestamoPagina(BaseModel):
+    items: List[PrestamoResponse]
+    siguiente: Optional[int] = None  # Pasar como despues_de para la siguiente página
+
+
+class AuditoriaEvento(BaseModel):
+    auditoria_id: int
+    entidad: str
+    entidad_id: int
+    campo: str
+    valor_anterior: Optional[str] = None
+    valor_nuevo: Optional[str] = None
+    usuario: Optional[str] = None
+    origen: Optional[str] = None
+    registrado_en: datetime
+
+
+class AuditoriaPagina(BaseModel):
+    items: List[AuditoriaEvento]
+    siguiente: Optional[int] = None  # Pasar como antes_de para la siguiente página
+
+
+class ClienteEncontrado(BaseModel):
+    usuario_id: int
+    codigo_cliente: Optional[str] = None
+    cui: Optional[str] = None
+    nombre_completo: str
+    rango: float
+
+
+class BusquedaClientes(BaseModel):
+    items: List[ClienteEncontrado]
+    siguiente: Optional[int] = None  # Pasar como desplazamiento para la siguiente página
+
 class ComprobantePagoRequest(BaseModel):
     codigo_prestamo: str
     codigo_transaccion: str
     monto_pagado: float
 
-class PrestamoDetalleResponse(BaseModel):
-    prestamo_id: int
-    monto_solicitado: float
-    cuotas_pactadas: int
-    porcentaje_interes: float
-    pagos_realizados: List[Any]
-    pagos_futuros: List[Any]
-    proximo_pago: dict
-
 class EstadoComprobante(BaseModel):
     aprobado: bool
 
+class MovimientoBancario(BaseModel):
+    # Una línea del extracto bancario para la conciliación
+    codigo_transaccion: str = Field(..., min_length=1, max_length=50)
+    monto: float
+    fecha: Optional[datetime] = None
+
 class PagoRealizado(BaseModel):
     pago_realizado_id: int
-    fecha_pago: datetime
-    monto_pagado: float
-    estado: str
-    codigo_transaccion: str
+    pago_realizado_correlativo: Optional[str] = None
+    pago_realizado_fecha_creacion: Optional[datetime] = None
+    pago_realizado_fecha_pago: Optional[datetime] = None
+    pago_realizado_monto_pagado: Optional[float] = None
+    estado: Optional[str] = None
+    codigo_transaccion: Optional[str] = None
 
 
 class PagoFuturo(BaseModel):
@@ -114,14 +176,86 @@ class PagoFuturo(BaseModel):
     estado: str
 
 
-class PrestamoDetalle(BaseModel):
+class ProximoPago(BaseModel):
+    # Primera cuota pendiente; sin calendario, pago_id y fecha_pago van en None
+    # y total_pago es monto + IVA + cargos
+    pago_id: Optional[int] = None
+    fecha_pago: Optional[date] = None
+    total_pago: float
+
+
+class PrestamoDetalleResponse(BaseModel):
     prestamo_id: int
     codigo_prestamo: str
     monto_solicitado: float
     cuotas_pactadas: int
     porcentaje_interes: float
+    prestamo_estatus_id: int
     pagos_realizados: List[PagoRealizado]
     pagos_futuros: List[PagoFuturo]
+    proximo_pago: ProximoPago
+
+
+class ProximaCuota(BaseModel):
+    pago_id: int
+    fecha_pago: date
+    monto_pago: float
+    saldo_cuota: float  # lo que falta de la cuota después de los pagos aprobados
+
+
+class ResumenPrestamo(BaseModel):
+    prestamo_id: int
+    codigo_prestamo: str
+    prestamo_estatus_id: int
+    monto_solicitado: float
+    cuotas_pactadas: int
+    porcentaje_interes: float
+    prestamo_total: Optional[float] = None
+    monto_pagado: float  # pagos aprobados
+    pagos_pendientes: int  # comprobantes sin validar
+    saldo_pendiente: float  # cuotas del calendario no cubiertas por pagos aprobados
+    saldo_vencido: float
+    cuotas_pendientes: int
+    cuotas_vencidas: int
+    proxima_cuota: Optional[ProximaCuota] = None
+
+
+class ResumenTotales(BaseModel):
+    prestamos: int
+    monto_pagado: float
+    saldo_pendiente: float
+    saldo_vencido: float
+    cuotas_vencidas: int
+
+
+class ResumenCliente(BaseModel):
+    usuario_id: int
+    codigo_cliente: Optional[str] = None
+    nombre_completo: str
+    prestamos: List[ResumenPrestamo]
+    totales: ResumenTotales
+
+
+class PuntajeSolicitud(BaseModel):
+    prestamo_id: int
+    codigo_prestamo: Optional[str] = None
+    usuario_id: int
+    monto_solicitado: float
+    cuotas_pactadas: int
+    edad: Optional[float] = None
+    ocupacion_id: int
+    prestamos_previos: int  # préstamos del cliente con pagos registrados
+    pagos_aprobados: int
+    pagos_rechazados: int
+    monto_pagado: float
+    puntaje: int  # 0 (más riesgo) a 1000
+
+
+class ColaPuntajes(BaseModel):
+    modelo: str
+    total: int
+    items: List[PuntajeSolicitud]
+    siguiente: Optional[int] = None  # desplazamiento de la página siguiente
 
 
 class RegistroComprobante(BaseModel):
@@ -139,3 +273,48 @@ class AprobarDenegarPagoResponse(BaseModel):
     message: str
     pago_realizado_id: int
 
+
+class DecisionPago(BaseModel):
+    pago_realizado_id: int
+    decision: str = Field(..., pattern="^(aprobado|denegado)$")
+
+
+class DecisionesPagos(BaseModel):
+    decisiones: List[DecisionPago] = Field(..., min_length=1, max_length=5000)
+
+
+class AprobacionLote(BaseModel):
+    prestamo_ids: List[int]
+    metodo: str = "plano"
+    fecha_inicio: Optional[date] = None
+
+
+class Recalculo(BaseModel):
+    formula: str = "aprobacion"
+    # Filtro
+    estatus: Optional[List[int]] = None
+    prestamo_desde: Optional[int] = None
+    prestamo_hasta: Optional[int] = None
+    usuario_id: Optional[int] = None
+    # Nueva política (None conserva el valor actual de cada préstamo)
+    porcentaje_interes: Optional[float] = None
+    prestamo_iva: Optional[float] = None
+    prestamo_cargos_administrativos: Optional[float] = None
+    dry_run: bool = False
+    tamano_bloque: int = Field(50000, gt=0)  # rango de prestamo_id por transacción
+
+
+class ResultadoDecisionPago(BaseModel):
+    # resultado: aprobado, denegado, no_encontrado, no_pendiente o duplicado;
+    # estado es el que queda registrado para el pago
+    pago_realizado_id: int
+    resultado: str
+    estado: Optional[str] = None
+    prestamo_id: Optional[int] = None
+
+
+class DecisionesPagosResponse(BaseModel):
+    procesados: int
+    aplicados: int
+    prestamos_actualizados: List[int]
+    resultados: List[ResultadoDecisionPago]
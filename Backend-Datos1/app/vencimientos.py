@@ -0,0 +1,230 @@
+# vencimientos.py
+# Vencimiento de cuotas: las cuotas pendientes con fecha_pago anterior a la
+# fecha de referencia (hoy) pasan a estado vencido, y los préstamos afectados
+# se actualizan con crud.actualizar_estatus_prestamos (aprobado -> en mora si
+# el saldo vencido no está cubierto por pagos aprobados).
+#
+# Se trabaja por bloques de TAMANO_BLOQUE cuotas, cada uno en su propia
+# transacción corta:
+#
+#   - las cuotas se toman en orden de fecha_pago sobre el índice parcial
+#     ix_pagos_futuros_pendientes_fecha; las que vencen salen del índice, así
+#     que cada bloque empieza donde terminó el anterior sin guardar posición
+#   - FOR UPDATE SKIP LOCKED: las cuotas que otra transacción tiene bloqueadas
+#     se saltan y quedan para la siguiente corrida; nunca se espera a otra
+#     transacción ni se retienen filas de pagos_futuros más que un bloque
+#   - el avance (bloques, cuotas, préstamos, tiempos) se guarda en
+#     vencimientos_corridas en la misma transacción de cada bloque. Si el
+#     proceso se detiene la corrida queda en curso y la siguiente la retoma;
+#     varios procesos a la vez se turnan por bloque sobre la misma corrida.
+#
+# Corre dentro de la aplicación (un hilo cada VENCIMIENTOS_INTERVALO segundos,
+# 3600 por defecto; 0 lo desactiva) o como proceso aparte:
+#
+#   python -m app.vencimientos               # una corrida (cron)
+#   python -m app.vencimientos --continuo    # programador sin la API
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from datetime import date, datetime
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy import func, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from . import auditoria, cache, crud, database, models
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+TAMANO_BLOQUE = int(os.getenv("VENCIMIENTOS_BLOQUE", "2000"))
+INTERVALO = float(os.getenv("VENCIMIENTOS_INTERVALO", "3600"))
+
+futuros = models.PagosFuturos.__table__
+corridas = models.VencimientoCorrida.__table__
+
+
+def _corrida_en_curso(db: Session, hoy: date) -> tuple:
+    # La corrida en curso o una nueva (el índice único parcial deja una sola);
+    # al retomarla se usa la fecha más reciente
+    en_curso = corridas.c.estado == "en_curso"
+    db.execute(
+        pg_insert(corridas)
+        .values(fecha_referencia=hoy, estado="en_curso", iniciada_en=datetime.now())
+        .on_conflict_do_nothing(index_elements=["estado"], index_where=en_curso)
+    )
+    return db.execute(
+        update(corridas)
+        .where(en_curso)
+        .values(fecha_referencia=func.greatest(corridas.c.fecha_referencia, hoy))
+        .returning(corridas.c.corrida_id, corridas.c.fecha_referencia)
+    ).one()
+
+
+def _vencer_bloque(db: Session, corrida_id: int, hoy: date, tamano_bloque: int) -> Optional[list]:
+    # Devuelve el prestamo_id de cada cuota vencida (vacío si no quedan cuotas
+    # por vencer) o None si otro proceso ya terminó la corrida
+    estado = db.execute(
+        select(corridas.c.estado).where(corridas.c.corrida_id == corrida_id).with_for_update()
+    ).scalar()
+    if estado != "en_curso":
+        return None
+
+    inicio = time.perf_counter()
+    bloque = (
+        select(futuros.c.pago_id)
+        .where(futuros.c.estado == "pendiente", futuros.c.fecha_pago < hoy)
+        .order_by(futuros.c.fecha_pago)
+        .limit(tamano_bloque)
+        .with_for_update(skip_locked=True)
+    )
+    vencidas = db.execute(
+        update(futuros)
+        .where(futuros.c.pago_id.in_(bloque), futuros.c.estado == "pendiente")
+        .values(estado="vencido")
+        .returning(futuros.c.prestamo_id, futuros.c.fecha_pago)
+    ).all()
+    if not vencidas:
+        return []
+    prestamos = {fila.prestamo_id for fila in vencidas if fila.prestamo_id is not None}
+    actualizados = crud.actualizar_estatus_prestamos(db, prestamos)
+    duracion = (time.perf_counter() - inicio) * 1000
+
+    db.execute(
+        update(corridas)
+        .where(corridas.c.corrida_id == corrida_id)
+        .values(
+            actualizada_en=datetime.now(),
+            bloques=corridas.c.bloques + 1,
+            cuotas_vencidas=corridas.c.cuotas_vencidas + len(vencidas),
+            prestamos_actualizados=corridas.c.prestamos_actualizados + len(actualizados),
+            hasta_fecha=func.greatest(corridas.c.hasta_fecha, max(fila.fecha_pago for fila in vencidas)),
+            duracion_ms=corridas.c.duracion_ms + duracion,
+            bloque_max_ms=func.greatest(corridas.c.bloque_max_ms, duracion),
+        )
+    )
+    return [fila.prestamo_id for fila in vencidas]
+
+
+def _terminar(db: Session, corrida_id: int, hoy: date):
+    # Lo que quede por vencer estaba bloqueado por otra transacción
+    omitidas = db.execute(
+        select(func.count()).select_from(futuros).where(futuros.c.estado == "pendiente", futuros.c.fecha_pago < hoy)
+    ).scalar()
+    ahora = datetime.now()
+    db.execute(
+        update(corridas)
+        .where(corridas.c.corrida_id == corrida_id, corridas.c.estado == "en_curso")
+        .values(estado="completada", actualizada_en=ahora, terminada_en=ahora, cuotas_omitidas=omitidas)
+    )
+
+
+def _con_tasa(fila) -> dict:
+    fila = dict(fila)
+    segundos = fila["duracion_ms"] / 1000
+    fila["cuotas_por_segundo"] = round(fila["cuotas_vencidas"] / segundos) if segundos else None
+    return fila
+
+
+def _corrida(db: Session, corrida_id: int) -> dict:
+    return _con_tasa(db.execute(select(corridas).where(corridas.c.corrida_id == corrida_id)).mappings().one())
+
+
+def ejecutar(
+    hoy: Optional[date] = None, tamano_bloque: int = TAMANO_BLOQUE, detener: Optional[threading.Event] = None,
+) -> dict:
+    # Con `detener` activado la corrida se deja en curso después del bloque actual
+    with auditoria.origen("vencimientos"), database.SessionLocal() as db:
+        corrida_id, hoy = _corrida_en_curso(db, hoy or date.today())
+        db.commit()
+        while detener is None or not detener.is_set():
+            vencidas = _vencer_bloque(db, corrida_id, hoy, tamano_bloque)
+            if vencidas is None:
+                db.rollback()
+                break
+            if not vencidas:
+                _terminar(db, corrida_id, hoy)
+                db.commit()
+                break
+            db.commit()
+            cache.invalidar_prestamos(*{p for p in vencidas if p is not None})
+        return _corrida(db, corrida_id)
+
+
+class Programador:
+    # Hilo que llama a ejecutar() cada `intervalo` segundos mientras corre la aplicación
+    def __init__(self, intervalo: float = INTERVALO):
+        self.intervalo = intervalo
+        self._detener = threading.Event()
+        self._hilo = None
+
+    def iniciar(self):
+        if self.intervalo <= 0 or self._hilo is not None:
+            return
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._ciclo, name="vencimientos", daemon=True)
+        self._hilo.start()
+
+    def detener(self, espera: float = 30):
+        self._detener.set()
+        if self._hilo is not None:
+            self._hilo.join(espera)
+            self._hilo = None
+
+    def _ciclo(self):
+        while not self._detener.is_set():
+            try:
+                corrida = ejecutar(detener=self._detener)
+                logger.info(
+                    "Vencimientos: corrida %s %s, %s cuotas vencidas, %s préstamos actualizados",
+                    corrida["corrida_id"], corrida["estado"], corrida["cuotas_vencidas"],
+                    corrida["prestamos_actualizados"],
+                )
+            except SQLAlchemyError:
+                logger.exception("Falló la corrida de vencimientos")
+            self._detener.wait(self.intervalo)
+
+
+programador = Programador()
+
+
+# --- API -------------------------------------------------------------------------
+
+@router.get("/vencimientos/corridas")
+def listar_corridas(limite: int = Query(20, ge=1, le=200), db: Session = Depends(database.get_read_db)):
+    # Últimas corridas con sus tiempos; la primera puede estar en curso
+    filas = db.execute(select(corridas).order_by(corridas.c.corrida_id.desc()).limit(limite)).mappings().all()
+    return [_con_tasa(fila) for fila in filas]
+
+
+@router.post("/vencimientos/ejecutar")
+def ejecutar_vencimientos():
+    # Sesión propia con commits por bloque
+    return ejecutar()
+
+
+# --- CLI -------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Vencimiento de cuotas")
+    parser.add_argument("--fecha", type=date.fromisoformat, default=None, help="Fecha de referencia (AAAA-MM-DD)")
+    parser.add_argument("--bloque", type=int, default=TAMANO_BLOQUE)
+    parser.add_argument("--continuo", action="store_true", help="Repetir cada --intervalo segundos")
+    parser.add_argument("--intervalo", type=float, default=INTERVALO or 3600)
+    args = parser.parse_args()
+
+    if not args.continuo:
+        print(json.dumps(ejecutar(args.fecha, args.bloque), default=str))
+        return
+    logging.basicConfig(level=logging.INFO)
+    Programador(args.intervalo)._ciclo()
+
+
+if __name__ == "__main__":
+    main()
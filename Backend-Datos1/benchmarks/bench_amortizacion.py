@@ -0,0 +1,68 @@
+# bench_amortizacion.py
+# Mide cuánto tarda el motor de amortización en generar calendarios.
+#
+#   cd Backend-Datos1
+#   python -m benchmarks.bench_amortizacion --prestamos 100000
+#   python -m benchmarks.bench_amortizacion --prestamos 100000 --bd   # incluye COPY a pagos_futuros
+import argparse
+import time
+from datetime import date
+
+import numpy as np
+from sqlalchemy import select
+
+from app import amortizacion, database, models
+
+
+def prestamos_aleatorios(cantidad: int, semilla: int = 7) -> dict:
+    rng = np.random.default_rng(semilla)
+    monto = rng.uniform(500, 50000, cantidad).round(2)
+    interes = rng.choice([0.0, 5.0, 10.0, 18.0], cantidad)
+    iva = (monto * 0.12).round(2)
+    cargos = np.full(cantidad, 50.0)
+    return {
+        "prestamo_id": np.arange(1, cantidad + 1, dtype=np.int64),
+        "monto_solicitado": monto,
+        "porcentaje_interes": interes,
+        "cuotas_pactadas": rng.integers(1, 13, cantidad),
+        "prestamo_iva": iva,
+        "prestamo_cargos_administrativos": cargos,
+        "prestamo_total": (monto + iva + cargos) * (1 + interes / 100),
+    }
+
+
+def medir_calculo(prestamos: dict):
+    for metodo in amortizacion.METODOS:
+        inicio = time.perf_counter()
+        ids, fechas, montos = amortizacion.generar_calendario(prestamos, date.today(), metodo)
+        transcurrido = time.perf_counter() - inicio
+        print(f"calculo {metodo:<8} {len(prestamos['prestamo_id']):>9} préstamos {len(ids):>10} cuotas {transcurrido * 1000:>9.1f} ms")
+
+
+def medir_bd(cantidad: int):
+    # Programa los `cantidad` préstamos más recientes dentro de una transacción
+    # que se revierte al final para no alterar los datos
+    with database.SessionLocal() as db:
+        ids = db.execute(
+            select(models.Prestamos.prestamo_id).order_by(models.Prestamos.prestamo_id.desc()).limit(cantidad)
+        ).scalars().all()
+        inicio = time.perf_counter()
+        cuotas = amortizacion.programar_pagos(db, ids)
+        transcurrido = time.perf_counter() - inicio
+        db.rollback()
+    print(f"programar_pagos (bd) {len(ids):>9} préstamos {cuotas:>10} cuotas {transcurrido * 1000:>9.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del motor de amortización")
+    parser.add_argument("--prestamos", type=int, default=100000)
+    parser.add_argument("--bd", action="store_true", help="Medir también la inserción en pagos_futuros")
+    args = parser.parse_args()
+
+    medir_calculo(prestamos_aleatorios(args.prestamos))
+    if args.bd:
+        medir_bd(args.prestamos)
+
+
+if __name__ == "__main__":
+    main()
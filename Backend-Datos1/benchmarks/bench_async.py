@@ -0,0 +1,110 @@
+# bench_async.py
+# Compara peticiones/seg y latencia p99 entre DB_MODO=sync y DB_MODO=async.
+#
+# Levanta la API con uvicorn una vez por modo contra la base de datos
+# configurada en app/database.py y la somete a la misma carga concurrente.
+#
+#   cd Backend-Datos1
+#   python -m benchmarks.bench_async --concurrencia 200 --duracion 20 \
+#       --ruta /usuarios/prestamos/1 --ruta /usuarios/prestamos/pendientes
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    indice = min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))
+    return ordenados[indice]
+
+
+async def _esperar_servidor(url, timeout=30):
+    limite = time.monotonic() + timeout
+    async with httpx.AsyncClient() as cliente:
+        while time.monotonic() < limite:
+            try:
+                await cliente.get(url + "/")
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f"El servidor en {url} no respondió")
+
+
+async def _generar_carga(url, rutas, concurrencia, duracion):
+    latencias = []
+    errores = 0
+    fin = time.monotonic() + duracion
+    limites = httpx.Limits(max_connections=concurrencia, max_keepalive_connections=concurrencia)
+
+    async with httpx.AsyncClient(base_url=url, limits=limites, timeout=60) as cliente:
+        async def trabajador(n):
+            nonlocal errores
+            i = n
+            while time.monotonic() < fin:
+                ruta = rutas[i % len(rutas)]
+                i += 1
+                inicio = time.perf_counter()
+                try:
+                    respuesta = await cliente.get(ruta)
+                    if respuesta.status_code >= 500:
+                        errores += 1
+                except httpx.HTTPError:
+                    errores += 1
+                latencias.append(time.perf_counter() - inicio)
+
+        inicio = time.perf_counter()
+        await asyncio.gather(*(trabajador(n) for n in range(concurrencia)))
+        transcurrido = time.perf_counter() - inicio
+
+    return {
+        "peticiones": len(latencias),
+        "errores": errores,
+        "rps": len(latencias) / transcurrido,
+        "p50_ms": percentil(latencias, 50) * 1000,
+        "p99_ms": percentil(latencias, 99) * 1000,
+    }
+
+
+def medir_modo(modo, args):
+    url = f"http://127.0.0.1:{args.puerto}"
+    entorno = dict(os.environ, DB_MODO=modo)
+    servidor = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(args.puerto),
+         "--workers", str(args.workers), "--log-level", "warning"],
+        env=entorno,
+    )
+    try:
+        asyncio.run(_esperar_servidor(url))
+        # Calentamiento para llenar el pool de conexiones
+        asyncio.run(_generar_carga(url, args.ruta, args.concurrencia, 2))
+        return asyncio.run(_generar_carga(url, args.ruta, args.concurrencia, args.duracion))
+    finally:
+        servidor.terminate()
+        servidor.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark sync vs async")
+    parser.add_argument("--ruta", action="append", help="Ruta GET a medir (repetible)")
+    parser.add_argument("--concurrencia", type=int, default=100)
+    parser.add_argument("--duracion", type=float, default=15.0, help="Segundos de carga por modo")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--puerto", type=int, default=8765)
+    args = parser.parse_args()
+    args.ruta = args.ruta or ["/usuarios/prestamos/1"]
+
+    print(f"{'modo':<6} {'peticiones':>10} {'errores':>8} {'rps':>9} {'p50 ms':>9} {'p99 ms':>9}")
+    for modo in ("sync", "async"):
+        r = medir_modo(modo, args)
+        print(f"{modo:<6} {r['peticiones']:>10} {r['errores']:>8} {r['rps']:>9.1f} {r['p50_ms']:>9.2f} {r['p99_ms']:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+# bench_busqueda.py
+# Latencia de GET /usuarios/buscar (busqueda.buscar) con muchos clientes.
+#
+# Crea un esquema temporal (bench_busqueda) con models.Base.metadata, genera
+# los usuarios con generate_series (nombres y apellidos comunes, con tildes) y
+# mide p50/p99 de cada tipo de búsqueda. Con tan pocos nombres distintos las
+# búsquedas por nombre coinciden con muchos clientes: es el peor caso para el
+# ordenamiento por rango. Sin pg_trgm en el servidor la búsqueda por nombre no
+# tiene índice y se nota en los tiempos. El esquema se borra al terminar.
+#
+#   cd Backend-Datos1
+#   python -m benchmarks.bench_busqueda --usuarios 2000000 --repeticiones 200
+import argparse
+import random
+import time
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from app import busqueda, database, models
+
+from .bench_async import percentil
+
+ESQUEMA = "bench_busqueda"
+NOMBRES = ["José", "María", "Ana", "Luis", "Carmen", "Juan", "Rosa", "Carlos", "Sofía", "Andrés", "Lucía", "Héctor"]
+APELLIDOS = ["López", "García", "Pérez", "Hernández", "Morales", "Castillo", "Peña", "Gómez", "Méndez", "Ramírez"]
+
+
+def _arreglo(valores: list) -> str:
+    return "ARRAY[" + ", ".join(f"'{v}'" for v in valores) + "]"
+
+
+def crear_usuarios(engine, cantidad: int):
+    # create_all con solo el esquema en el search_path: con public también
+    # daría por existentes las tablas de public
+    solo_esquema = create_engine(database.SQLALCHEMY_DATABASE_URL, connect_args={"options": f"-csearch_path={ESQUEMA}"})
+    models.Base.metadata.create_all(solo_esquema)
+    solo_esquema.dispose()
+    with engine.begin() as conexion:
+        # Los índices de búsqueda se construyen después de cargar los datos
+        conexion.execute(text("DROP INDEX IF EXISTS ix_usuarios_nombre_trgm, ix_usuarios_cui_busqueda, ix_usuarios_codigo_cliente_busqueda"))
+        conexion.execute(text(f"""
+            INSERT INTO usuarios (codigo_cliente, cui, primer_nombre, segundo_nombre, primer_apellido, segundo_apellido)
+            SELECT 'U-' || g,
+                   lpad(((g::bigint * 7919) % 10000000000)::text, 10, '0') || '0101',
+                   (n)[1 + (hashint8(g * 3) & 2147483647) % cardinality(n)],
+                   CASE WHEN g % 3 = 0 THEN NULL ELSE (n)[1 + (hashint8(g * 5) & 2147483647) % cardinality(n)] END,
+                   (a)[1 + (hashint8(g * 7) & 2147483647) % cardinality(a)],
+                   (a)[1 + (hashint8(g * 11) & 2147483647) % cardinality(a)]
+            FROM generate_series(1, :cantidad) AS g,
+                 (SELECT {_arreglo(NOMBRES)} AS n, {_arreglo(APELLIDOS)} AS a) AS listas
+        """), {"cantidad": cantidad})
+        conexion.execute(text(models.BUSQUEDA_INDICES))
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conexion:
+        conexion.execute(text("VACUUM ANALYZE usuarios"))
+
+
+def consultas(Sesion, cantidad: int) -> dict:
+    rng = random.Random(3)
+    with Sesion() as db:
+        muestra = db.execute(text(
+            "SELECT cui, codigo_cliente, primer_nombre, primer_apellido, segundo_apellido FROM usuarios TABLESAMPLE SYSTEM (1) LIMIT :n"
+        ), {"n": cantidad}).all()
+    tipos = {"cui exacto": [], "prefijo cui": [], "código": [], "nombre y apellidos": [], "nombre con error": []}
+    for cui, codigo, nombre, apellido, segundo in muestra:
+        tipos["cui exacto"].append(cui)
+        tipos["prefijo cui"].append(cui[:6])
+        tipos["código"].append(codigo)
+        tipos["nombre y apellidos"].append(f"{nombre} {apellido} {segundo}")
+        # Una letra cambiada en el apellido
+        i = rng.randrange(1, len(apellido))
+        tipos["nombre con error"].append(f"{nombre} {apellido[:i - 1]}x{apellido[i:]} {segundo}")
+    return tipos
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latencia de la búsqueda de clientes")
+    parser.add_argument("--usuarios", type=int, default=1000000)
+    parser.add_argument("--repeticiones", type=int, default=200, help="Búsquedas por tipo")
+    args = parser.parse_args()
+
+    with database.engine.begin() as conexion:
+        conexion.execute(text(f"DROP SCHEMA IF EXISTS {ESQUEMA} CASCADE"))
+        conexion.execute(text(f"CREATE SCHEMA {ESQUEMA}"))
+    # public queda en el search_path por pg_trgm
+    engine = create_engine(database.SQLALCHEMY_DATABASE_URL, connect_args={"options": f"-csearch_path={ESQUEMA},public"})
+    Sesion = sessionmaker(bind=engine)
+    try:
+        inicio = time.perf_counter()
+        crear_usuarios(engine, args.usuarios)
+        print(f"{args.usuarios} usuarios en {time.perf_counter() - inicio:.1f} s")
+        with Sesion() as db:
+            print(f"pg_trgm: {'sí' if busqueda._hay_trigramas(db) else 'no'}")
+
+        print(f"{'búsqueda':<22} {'p50 ms':>8} {'p99 ms':>8} {'resultados':>11}")
+        for tipo, valores in consultas(Sesion, args.repeticiones).items():
+            latencias, resultados = [], 0
+            with Sesion() as db:
+                for q in valores:
+                    inicio = time.perf_counter()
+                    resultados += len(busqueda.buscar(db, q)["items"])
+                    latencias.append(time.perf_counter() - inicio)
+            print(
+                f"{tipo:<22} {percentil(latencias, 50) * 1000:>8.2f} {percentil(latencias, 99) * 1000:>8.2f} "
+                f"{resultados / max(len(valores), 1):>11.1f}"
+            )
+    finally:
+        engine.dispose()
+        with database.engine.begin() as conexion:
+            conexion.execute(text(f"DROP SCHEMA {ESQUEMA} CASCADE"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+# bench_carga.py
+# Carga concurrente sobre el router de usuarios con una mezcla de endpoints.
+#
+# 1. Crea un esquema aparte (bench_carga por defecto) en la base de datos de
+#    app/database.py y lo llena con --clientes clientes y --prestamos préstamos
+#    (carga masiva), aprueba la mitad y registra pagos pendientes.
+# 2. Cuenta sentencias SQL por petición de cada endpoint con TestClient.
+# 3. Levanta la API con uvicorn contra ese esquema y genera carga concurrente
+#    con la mezcla de --mezcla durante --duracion segundos.
+# 4. Guarda rps, p50/p95/p99 y SQL por petición de cada endpoint en JSON;
+#    con --comparar avisa de regresiones contra una corrida anterior.
+#
+#   cd Backend-Datos1
+#   python -m benchmarks.bench_carga --clientes 5000 --prestamos 50000 \
+#       --concurrencia 50 --duracion 30 --salida carga.json
+#   python -m benchmarks.bench_carga --comparar carga.json --salida carga2.json
+#
+# Solo PostgreSQL: la aplicación usa COPY, ON CONFLICT, secuencias y json_agg,
+# así que SQLite no sirve como sustituto. El esquema se elige con PGOPTIONS
+# (search_path), por eso se usa DB_MODO=sync.
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime
+
+import httpx
+
+from .bench_async import _esperar_servidor, percentil
+
+MEZCLA = "solicitud=1,detalle=6,pendientes=2,comprobante=1,validar=1"
+
+
+def solicitud(n: int, cui: str) -> dict:
+    referencia = {"primer_nombre": "Ref", "primer_apellido": "Carga", "telefono": "5555-0000"}
+    return {
+        "genero": "F" if n % 2 else "M",
+        "cui": cui,
+        "fecha_nacimiento": "1990-01-01",
+        "estado_civil": "Soltero",
+        "nacionalidad": "Guatemalteca",
+        "primer_nombre": "Carga",
+        "primer_apellido": f"Usuario{n}",
+        "ocupacion": f"Ocupación {n % 25}",
+        "direccion": {"depto_nacimiento": "Guatemala", "muni_nacimiento": "Mixco", "vecindad": "Zona 1"},
+        "referencias": [referencia, referencia],
+        "monto_prestamo": 500 + (n * 37) % 50000,
+        "motivo_prestamo": "Benchmark de carga",
+        "cuotas_pactadas": 1 + n % 24,
+    }
+
+
+def preparar_datos(esquema: str, clientes: int, prestamos: int, pagos: int) -> dict:
+    # Se importa aquí para que las conexiones ya usen el search_path del esquema
+    from sqlalchemy import select, text, update
+
+    from app import amortizacion, carga_masiva, database, models
+
+    with database.engine.begin() as conexion:
+        conexion.execute(text(f"DROP SCHEMA IF EXISTS {esquema} CASCADE"))
+        conexion.execute(text(f"CREATE SCHEMA {esquema}"))
+    models.Base.metadata.create_all(database.engine)
+    with database.engine.begin() as conexion:
+        conexion.execute(text("INSERT INTO roles (rol_id, nombre_rol) VALUES (1, 'Administrador'), (2, 'Cliente')"))
+        conexion.execute(text(
+            "INSERT INTO prestamo_estatus (estatus_id, descripcion) VALUES (1, 'Aprobado'), (2, 'Pendiente'), (3, 'Denegado')"
+        ))
+
+    # Un CUI por cliente (los últimos 4 dígitos forman codigo_cliente)
+    rng = random.Random(7)
+    cuis = [f"{rng.randrange(10**8, 10**9)}{n:04d}" for n in range(clientes)]
+    inicio = time.perf_counter()
+    for desde in range(0, prestamos, carga_masiva.TAMANO_LOTE):
+        filas = [(n + 1, solicitud(n, cuis[n % clientes])) for n in range(desde, min(prestamos, desde + carga_masiva.TAMANO_LOTE))]
+        with database.SessionLocal() as db:
+            carga_masiva.procesar_lote(db, filas)
+
+    with database.SessionLocal() as db:
+        ids = db.execute(select(models.Prestamos.prestamo_id).order_by(models.Prestamos.prestamo_id)).scalars().all()
+        aprobados = ids[::2]
+        db.execute(update(models.Prestamos).where(models.Prestamos.prestamo_id.in_(aprobados)).values(prestamo_estatus_id=1))
+        amortizacion.programar_pagos(db, aprobados)
+        pagos_ids = db.execute(
+            models.PagosRealizados.__table__.insert().returning(models.PagosRealizados.pago_realizado_id),
+            [
+                {"prestamo_id": aprobados[n % len(aprobados)], "pago_realizado_fecha_creacion": datetime.now(),
+                 "pago_realizado_monto_pagado": 100.0, "codigo_transaccion": f"CARGA-{uuid.uuid4()}", "estado": "pendiente"}
+                for n in range(pagos)
+            ],
+        ).scalars().all()
+        codigos = dict(db.execute(
+            select(models.Prestamos.prestamo_id, models.Prestamos.codigo_prestamo).where(models.Prestamos.prestamo_id.in_(aprobados))
+        ).all())
+        db.commit()
+        db.execute(text("ANALYZE"))
+    print(f"Datos: {len(ids)} préstamos, {len(aprobados)} aprobados, {len(pagos_ids)} pagos pendientes "
+          f"({time.perf_counter() - inicio:.1f} s)")
+    return {"cuis": cuis, "codigos": [codigos[p] for p in aprobados], "pagos": pagos_ids}
+
+
+class Operaciones:
+    # Genera (método, ruta, cuerpo) para cada endpoint de la mezcla
+    def __init__(self, datos: dict, semilla: int):
+        self.datos = datos
+        self.rng = random.Random(semilla)
+        self.n = 0
+
+    def solicitud(self):
+        # Clientes existentes con un préstamo nuevo (codigo_cliente no admite más clientes)
+        self.n += 1
+        cui = self.rng.choice(self.datos["cuis"])
+        return "POST", "/usuarios/prestamos/solicitud", solicitud(self.n, cui)
+
+    def detalle(self):
+        return "GET", f"/usuarios/prestamos/{self.rng.choice(self.datos['codigos'])}/detalle", None
+
+    def pendientes(self):
+        return "GET", f"/usuarios/prestamos/pendientes?limite=50&despues_de={self.rng.randrange(0, 1000)}", None
+
+    def comprobante(self):
+        cuerpo = {
+            "codigo_prestamo": self.rng.choice(self.datos["codigos"]),
+            "codigo_transaccion": f"CARGA-{uuid.uuid4()}",
+            "monto_pagado": 100.0,
+        }
+        return "POST", "/usuarios/pagos/comprobante-general", cuerpo
+
+    def validar(self):
+        return "PUT", f"/usuarios/pagos/{self.rng.choice(self.datos['pagos'])}/validar", {"aprobado": True}
+
+
+def contar_sql(datos: dict, operaciones: list, repeticiones: int) -> dict:
+    # Sentencias SQL promedio por petición, medidas dentro del proceso
+    from fastapi.testclient import TestClient
+    from sqlalchemy import event
+
+    from app import database
+    from app.main import app
+
+    contador = [0]
+
+    def sumar(*args, **kwargs):
+        contador[0] += 1
+
+    generador = Operaciones(datos, semilla=1)
+    resultado = {}
+    with TestClient(app) as cliente:
+        time.sleep(0.5)  # recarga inicial de catálogos en segundo plano
+        event.listen(database.engine, "before_cursor_execute", sumar)
+        try:
+            for nombre in operaciones:
+                antes = contador[0]
+                for _ in range(repeticiones):
+                    metodo, ruta, cuerpo = getattr(generador, nombre)()
+                    cliente.request(metodo, ruta, json=cuerpo)
+                resultado[nombre] = (contador[0] - antes) / repeticiones
+        finally:
+            event.remove(database.engine, "before_cursor_execute", sumar)
+    return resultado
+
+
+async def generar_carga(url: str, datos: dict, pesos: dict, concurrencia: int, duracion: float) -> dict:
+    nombres = list(pesos)
+    latencias = {nombre: [] for nombre in nombres}
+    errores = {nombre: 0 for nombre in nombres}
+    fin = time.monotonic() + duracion
+    limites = httpx.Limits(max_connections=concurrencia, max_keepalive_connections=concurrencia)
+
+    async with httpx.AsyncClient(base_url=url, limits=limites, timeout=60) as cliente:
+        async def trabajador(n):
+            generador = Operaciones(datos, semilla=1000 + n)
+            while time.monotonic() < fin:
+                nombre = generador.rng.choices(nombres, weights=[pesos[x] for x in nombres])[0]
+                metodo, ruta, cuerpo = getattr(generador, nombre)()
+                inicio = time.perf_counter()
+                try:
+                    respuesta = await cliente.request(metodo, ruta, json=cuerpo)
+                    if respuesta.status_code >= 500:
+                        errores[nombre] += 1
+                except httpx.HTTPError:
+                    errores[nombre] += 1
+                latencias[nombre].append(time.perf_counter() - inicio)
+
+        inicio = time.perf_counter()
+        await asyncio.gather(*(trabajador(n) for n in range(concurrencia)))
+        transcurrido = time.perf_counter() - inicio
+
+    return {
+        nombre: {
+            "peticiones": len(latencias[nombre]),
+            "errores": errores[nombre],
+            "rps": len(latencias[nombre]) / transcurrido,
+            "p50_ms": percentil(latencias[nombre], 50) * 1000,
+            "p95_ms": percentil(latencias[nombre], 95) * 1000,
+            "p99_ms": percentil(latencias[nombre], 99) * 1000,
+        }
+        for nombre in nombres
+    }
+
+
+def medir_servidor(args, datos: dict, pesos: dict) -> dict:
+    url = f"http://127.0.0.1:{args.puerto}"
+    servidor = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(args.puerto),
+         "--workers", str(args.workers), "--log-level", "warning"],
+        env=dict(os.environ, DB_MODO="sync"),
+    )
+    try:
+        asyncio.run(_esperar_servidor(url))
+        asyncio.run(generar_carga(url, datos, pesos, args.concurrencia, 2))  # calentamiento
+        return asyncio.run(generar_carga(url, datos, pesos, args.concurrencia, args.duracion))
+    finally:
+        servidor.terminate()
+        servidor.wait()
+
+
+def comparar(anterior: dict, actual: dict, tolerancia: float) -> list:
+    regresiones = []
+    for nombre, medida in actual["endpoints"].items():
+        base = anterior.get("endpoints", {}).get(nombre)
+        if not base:
+            continue
+        for metrica in ("p95_ms", "p99_ms"):
+            if base[metrica] and medida[metrica] > base[metrica] * (1 + tolerancia):
+                regresiones.append(f"{nombre} {metrica}: {base[metrica]:.2f} -> {medida[metrica]:.2f}")
+        if base["rps"] and medida["rps"] < base["rps"] * (1 - tolerancia):
+            regresiones.append(f"{nombre} rps: {base['rps']:.1f} -> {medida['rps']:.1f}")
+        if medida["sql_por_peticion"] > base["sql_por_peticion"] + 0.5:
+            regresiones.append(f"{nombre} sql: {base['sql_por_peticion']:.1f} -> {medida['sql_por_peticion']:.1f}")
+    return regresiones
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de carga del router de usuarios")
+    parser.add_argument("--esquema", default="bench_carga")
+    parser.add_argument("--clientes", type=int, default=5000, help="Máximo 10000 (codigo_cliente usa 4 dígitos del CUI)")
+    parser.add_argument("--prestamos", type=int, default=20000)
+    parser.add_argument("--pagos", type=int, default=5000, help="Pagos pendientes para validar")
+    parser.add_argument("--mezcla", default=MEZCLA, help="endpoint=peso separados por coma")
+    parser.add_argument("--concurrencia", type=int, default=50)
+    parser.add_argument("--duracion", type=float, default=20.0)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--puerto", type=int, default=8766)
+    parser.add_argument("--repeticiones-sql", type=int, default=50, help="Peticiones por endpoint para contar SQL")
+    parser.add_argument("--salida", default="bench_carga.json")
+    parser.add_argument("--comparar", help="JSON de una corrida anterior")
+    parser.add_argument("--tolerancia", type=float, default=0.2, help="Regresión permitida (0.2 = 20%%)")
+    parser.add_argument("--conservar", action="store_true", help="No borrar el esquema al terminar")
+    args = parser.parse_args()
+    if args.clientes > 10000:
+        raise SystemExit("--clientes no puede pasar de 10000")
+    pesos = {nombre: float(peso) for nombre, peso in (p.split("=") for p in args.mezcla.split(","))}
+    desconocidos = set(pesos) - {n for n in dir(Operaciones) if not n.startswith("_")}
+    if desconocidos:
+        raise SystemExit(f"Endpoints desconocidos en --mezcla: {', '.join(sorted(desconocidos))}")
+
+    # Todas las conexiones (este proceso y el servidor) usan el esquema de prueba
+    os.environ["PGOPTIONS"] = f"-csearch_path={args.esquema}"
+    try:
+        datos = preparar_datos(args.esquema, args.clientes, args.prestamos, args.pagos)
+        sql = contar_sql(datos, list(pesos), args.repeticiones_sql)
+        endpoints = medir_servidor(args, datos, pesos)
+    finally:
+        if not args.conservar:
+            from sqlalchemy import text
+
+            from app import database
+
+            database.engine.dispose()
+            with database.engine.begin() as conexion:
+                conexion.execute(text(f"DROP SCHEMA IF EXISTS {args.esquema} CASCADE"))
+
+    for nombre, medida in endpoints.items():
+        medida["sql_por_peticion"] = sql[nombre]
+    resultado = {
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "configuracion": {
+            "clientes": args.clientes, "prestamos": args.prestamos, "pagos": args.pagos, "mezcla": pesos,
+            "concurrencia": args.concurrencia, "duracion": args.duracion, "workers": args.workers,
+        },
+        "endpoints": endpoints,
+        "total_rps": sum(m["rps"] for m in endpoints.values()),
+    }
+    with open(args.salida, "w", encoding="utf-8") as archivo:
+        json.dump(resultado, archivo, indent=2, ensure_ascii=False)
+
+    print(f"{'endpoint':<12} {'peticiones':>10} {'errores':>8} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'sql/pet':>8}")
+    for nombre, m in endpoints.items():
+        print(f"{nombre:<12} {m['peticiones']:>10} {m['errores']:>8} {m['rps']:>8.1f} {m['p50_ms']:>8.2f} "
+              f"{m['p95_ms']:>8.2f} {m['p99_ms']:>8.2f} {m['sql_por_peticion']:>8.1f}")
+    print(f"Total {resultado['total_rps']:.1f} peticiones/seg; resultados en {args.salida}")
+
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as archivo:
+            regresiones = comparar(json.load(archivo), resultado, args.tolerancia)
+        for regresion in regresiones:
+            print(f"REGRESIÓN {regresion}")
+        sys.exit(1 if regresiones else 0)
+
+
+if __name__ == "__main__":
+    main()
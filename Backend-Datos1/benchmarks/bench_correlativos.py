@@ -0,0 +1,105 @@
+# bench_correlativos.py
+# Registra pagos desde varios hilos a la vez y comprueba que ningún
+# pago_realizado_correlativo se repita; reporta pagos por segundo para el
+# cálculo anterior (último id + 1), la secuencia y el asignador por bloques.
+#
+#   cd Backend-Datos1
+#   python -m benchmarks.bench_correlativos --hilos 16 --pagos 200 --bloque 100
+#
+# Los pagos creados se borran al terminar cada modo. Termina con código 1 si
+# algún modo de la secuencia produce duplicados.
+import argparse
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from sqlalchemy import delete, func, select
+
+from app import correlativos, crud, database, models
+
+
+def pago_anterior(db, prestamo_id):
+    # Reproducción del cálculo original: leer el último pago y sumar uno
+    ultimo = db.query(models.PagosRealizados).order_by(models.PagosRealizados.pago_realizado_id.desc()).first()
+    pago = models.PagosRealizados(
+        prestamo_id=prestamo_id,
+        pago_realizado_fecha_creacion=datetime.now(),
+        pago_realizado_monto_pagado=1.0,
+        codigo_transaccion=f"BENCH-{uuid.uuid4()}",
+        estado="pendiente",
+        pago_realizado_correlativo=f"PAGO-{(ultimo.pago_realizado_id + 1) if ultimo else 1}",
+    )
+    db.add(pago)
+    db.commit()
+    return pago.pago_realizado_id
+
+
+def pago_nuevo(db, prestamo_id):
+    origen = select(models.Prestamos.prestamo_id).where(models.Prestamos.prestamo_id == prestamo_id)
+    return crud._insertar_pago(
+        db, origen,
+        pago_realizado_fecha_creacion=datetime.now(),
+        pago_realizado_monto_pagado=1.0,
+        codigo_transaccion=f"BENCH-{uuid.uuid4()}",
+        estado="pendiente",
+    ).pago_realizado_id
+
+
+def medir(nombre, registrar, prestamo_id, hilos, pagos):
+    def trabajador(_):
+        ids = []
+        with database.SessionLocal() as db:
+            for _ in range(pagos):
+                ids.append(registrar(db, prestamo_id))
+        return ids
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(hilos) as ejecutor:
+        ids = [i for lote in ejecutor.map(trabajador, range(hilos)) for i in lote]
+    transcurrido = time.perf_counter() - inicio
+
+    with database.SessionLocal() as db:
+        duplicados = db.execute(
+            select(func.count()).select_from(
+                select(models.PagosRealizados.pago_realizado_correlativo)
+                .where(models.PagosRealizados.pago_realizado_id.in_(ids))
+                .group_by(models.PagosRealizados.pago_realizado_correlativo)
+                .having(func.count() > 1)
+                .subquery()
+            )
+        ).scalar()
+        db.execute(delete(models.PagosRealizados).where(models.PagosRealizados.pago_realizado_id.in_(ids)))
+        db.commit()
+
+    print(f"{nombre:<10} {len(ids):>8} {len(ids) / transcurrido:>12.1f} {duplicados:>11}")
+    return duplicados
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrencia y rendimiento de correlativos de pago")
+    parser.add_argument("--hilos", type=int, default=16)
+    parser.add_argument("--pagos", type=int, default=200, help="Pagos por hilo")
+    parser.add_argument("--bloque", type=int, default=100, help="Tamaño de bloque del asignador")
+    args = parser.parse_args()
+
+    with database.SessionLocal() as db:
+        prestamo_id = db.execute(select(func.min(models.Prestamos.prestamo_id))).scalar()
+    if prestamo_id is None:
+        raise SystemExit("Se necesita al menos un préstamo en la base de datos")
+
+    print(f"{'modo':<10} {'pagos':>8} {'pagos/seg':>12} {'duplicados':>11}")
+    medir("anterior", pago_anterior, prestamo_id, args.hilos, args.pagos)
+
+    correlativos.asignador = None
+    duplicados = medir("secuencia", pago_nuevo, prestamo_id, args.hilos, args.pagos)
+
+    correlativos.asignador = correlativos.AsignadorBloques(args.bloque)
+    duplicados += medir("bloque", pago_nuevo, prestamo_id, args.hilos, args.pagos)
+
+    sys.exit(1 if duplicados else 0)
+
+
+if __name__ == "__main__":
+    main()
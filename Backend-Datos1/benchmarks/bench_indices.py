@@ -0,0 +1,173 @@
+# bench_indices.py
+# Compara el perfil de índices anterior (index=True en casi todas las
+# columnas) con el actual de models.py / migrations/0003_perfil_indices.sql.
+#
+# Para cada perfil crea un esquema temporal (bench_antes / bench_despues),
+# inserta solicitudes con crud.crear_solicitud y con la carga masiva, aprueba
+# una parte con amortizacion (pagos_futuros), registra pagos y mide la latencia
+# de lectura de los endpoints GET. Los esquemas se borran al terminar.
+#
+#   cd Backend-Datos1
+#   python -m benchmarks.bench_indices --solicitudes 2000 --masivas 20000 --repeticiones 200
+import argparse
+import time
+import uuid
+from datetime import datetime
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, inspect, select, text
+from sqlalchemy.orm import sessionmaker
+
+from app import amortizacion, carga_masiva, crud, database, models
+from app.main import app
+
+from .bench_async import percentil
+from .bench_solicitud import solicitud_de_prueba
+
+
+def crear_esquema(esquema: str, anterior: bool):
+    with database.engine.begin() as conexion:
+        conexion.execute(text(f"DROP SCHEMA IF EXISTS {esquema} CASCADE"))
+        conexion.execute(text(f"CREATE SCHEMA {esquema}"))
+    engine = create_engine(database.SQLALCHEMY_DATABASE_URL, connect_args={"options": f"-csearch_path={esquema}"})
+    models.Base.metadata.create_all(engine)
+    with engine.begin() as conexion:
+        conexion.execute(text("INSERT INTO roles (rol_id, nombre_rol) VALUES (1, 'Administrador'), (2, 'Cliente')"))
+        conexion.execute(text(
+            "INSERT INTO prestamo_estatus (estatus_id, descripcion) VALUES (1, 'Aprobado'), (2, 'Pendiente'), (3, 'Denegado')"
+        ))
+        if anterior:
+            # Perfil anterior: un índice por columna, como con index=True en todas
+            for tabla in models.Base.metadata.sorted_tables:
+                indexadas = {c for indice in inspect(conexion).get_indexes(tabla.name) for c in indice["column_names"]}
+                for columna in tabla.columns:
+                    if columna.name not in indexadas:
+                        conexion.execute(text(f"CREATE INDEX ON {tabla.name} ({columna.name})"))
+    return engine
+
+
+def contar_indices(engine) -> int:
+    with engine.connect() as conexion:
+        return conexion.execute(text("SELECT count(*) FROM pg_indexes WHERE schemaname = current_schema()")).scalar()
+
+
+def medir_solicitudes(Sesion, cantidad: int, desplazamiento: int) -> float:
+    solicitudes = [solicitud_de_prueba(n, f"{n + desplazamiento:04d}") for n in range(cantidad)]
+    inicio = time.perf_counter()
+    for cliente in solicitudes:
+        with Sesion() as db:
+            crud.crear_solicitud(db, cliente)
+            db.commit()
+    return cantidad / (time.perf_counter() - inicio)
+
+
+def medir_masiva(Sesion, cantidad: int, desplazamiento: int) -> float:
+    # Un solo CUI por cliente nuevo en un rango distinto del de las solicitudes
+    filas = []
+    for n in range(cantidad):
+        datos = solicitud_de_prueba(n, "0000").model_dump(mode="json")
+        datos["cui"] = datos["cui"][:-4] + f"{(n % (10000 - desplazamiento)) + desplazamiento:04d}"
+        filas.append((n + 1, datos))
+    inicio = time.perf_counter()
+    for i in range(0, cantidad, carga_masiva.TAMANO_LOTE):
+        with Sesion() as db:
+            carga_masiva.procesar_lote(db, filas[i:i + carga_masiva.TAMANO_LOTE])
+    return cantidad / (time.perf_counter() - inicio)
+
+
+def preparar_lecturas(Sesion) -> dict:
+    # Aprueba la mitad de los préstamos (genera pagos_futuros) y registra un pago
+    # por préstamo aprobado; devuelve ids para las consultas
+    with Sesion() as db:
+        ids = db.execute(select(models.Prestamos.prestamo_id).order_by(models.Prestamos.prestamo_id)).scalars().all()
+        aprobados = ids[::2]
+        db.execute(
+            models.Prestamos.__table__.update()
+            .where(models.Prestamos.prestamo_id.in_(aprobados))
+            .values(prestamo_estatus_id=1)
+        )
+        amortizacion.programar_pagos(db, aprobados)
+        db.execute(models.PagosRealizados.__table__.insert(), [
+            {"prestamo_id": p, "pago_realizado_fecha_creacion": datetime.now(), "pago_realizado_monto_pagado": 100.0,
+             "codigo_transaccion": f"BENCH-{uuid.uuid4()}", "estado": "pendiente"}
+            for p in aprobados
+        ])
+        db.commit()
+        db.execute(text("ANALYZE"))
+        pendiente = ids[1]
+        codigo = db.execute(
+            select(models.Prestamos.codigo_prestamo).where(models.Prestamos.prestamo_id == pendiente)
+        ).scalar()
+    return {"medio": ids[len(ids) // 2], "pendiente": pendiente, "codigo": codigo}
+
+
+def medir_lecturas(Sesion, repeticiones: int) -> dict:
+    datos = preparar_lecturas(Sesion)
+
+    def get_db():
+        db = Sesion()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    rutas = {
+        "GET /prestamos": "/usuarios/prestamos?limite=50",
+        "GET /prestamos?estatus=1": f"/usuarios/prestamos?estatus=1&despues_de={datos['medio']}&limite=50",
+        "GET /prestamos/pendientes": "/usuarios/prestamos/pendientes?limite=50",
+        "GET /prestamos/{id}": f"/usuarios/prestamos/{datos['pendiente']}",
+        "GET /prestamos/{codigo}/detalle": f"/usuarios/prestamos/{datos['codigo']}/detalle",
+    }
+    app.dependency_overrides[database.get_db] = get_db
+    app.dependency_overrides[database.get_read_db] = get_db
+    resultados = {}
+    try:
+        with TestClient(app) as cliente:
+            for nombre, ruta in rutas.items():
+                latencias = []
+                for _ in range(repeticiones):
+                    inicio = time.perf_counter()
+                    respuesta = cliente.get(ruta)
+                    latencias.append(time.perf_counter() - inicio)
+                    respuesta.raise_for_status()
+                resultados[nombre] = (percentil(latencias, 50), percentil(latencias, 99))
+    finally:
+        app.dependency_overrides.pop(database.get_db, None)
+        app.dependency_overrides.pop(database.get_read_db, None)
+    return resultados
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Perfil de índices: inserción y lectura")
+    parser.add_argument("--solicitudes", type=int, default=2000, help="Solicitudes una por una (máx. 5000)")
+    parser.add_argument("--masivas", type=int, default=20000, help="Solicitudes por carga masiva")
+    parser.add_argument("--repeticiones", type=int, default=200, help="Peticiones por endpoint GET")
+    args = parser.parse_args()
+    if args.solicitudes > 5000:
+        raise SystemExit("--solicitudes no puede pasar de 5000 (codigo_cliente usa 4 dígitos del CUI)")
+
+    lecturas = {}
+    for perfil, anterior in (("antes", True), ("despues", False)):
+        esquema = f"bench_{perfil}"
+        engine = crear_esquema(esquema, anterior)
+        Sesion = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        try:
+            indices = contar_indices(engine)
+            por_segundo = medir_solicitudes(Sesion, args.solicitudes, 0)
+            masivas = medir_masiva(Sesion, args.masivas, 5000)
+            print(f"{perfil:<8} {indices:>4} índices  solicitud {por_segundo:>8.1f}/s  carga masiva {masivas:>9.1f}/s")
+            lecturas[perfil] = medir_lecturas(Sesion, args.repeticiones)
+        finally:
+            engine.dispose()
+            with database.engine.begin() as conexion:
+                conexion.execute(text(f"DROP SCHEMA {esquema} CASCADE"))
+
+    print()
+    print(f"{'endpoint':<32} {'antes p50':>10} {'despues p50':>12} {'antes p99':>10} {'despues p99':>12}  (ms)")
+    for nombre in lecturas["antes"]:
+        antes, despues = lecturas["antes"][nombre], lecturas["despues"][nombre]
+        print(f"{nombre:<32} {antes[0] * 1000:>10.2f} {despues[0] * 1000:>12.2f} {antes[1] * 1000:>10.2f} {despues[1] * 1000:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+# bench_puntaje.py
+# Mide la precalificación de solicitudes pendientes: cada modelo sobre
+# arreglos sintéticos y, con --bd, la cola completa desde la base de datos
+# (carga fría, recarga incremental después de invalidar y página en caché).
+#
+#   cd Backend-Datos1
+#   python -m benchmarks.bench_puntaje --solicitudes 1000000
+#   python -m benchmarks.bench_puntaje --solicitudes 1000000 --bd
+import argparse
+import time
+
+import numpy as np
+
+from app import cache, database, puntaje
+
+
+def solicitudes_aleatorias(cantidad: int, semilla: int = 7) -> dict:
+    rng = np.random.default_rng(semilla)
+    aprobados = rng.poisson(3, cantidad)
+    edad = rng.integers(18, 80, cantidad).astype(np.float64)
+    edad[rng.random(cantidad) < 0.01] = np.nan
+    return {
+        "prestamo_id": np.arange(1, cantidad + 1, dtype=np.int64),
+        "usuario_id": rng.integers(1, cantidad // 3 + 2, cantidad),
+        "monto_solicitado": rng.uniform(500, 100000, cantidad).round(2),
+        "cuotas_pactadas": rng.integers(1, 37, cantidad),
+        "edad": edad,
+        "ocupacion_id": rng.integers(0, 60, cantidad),
+        "prestamos_previos": rng.integers(0, 4, cantidad),
+        "pagos_aprobados": aprobados,
+        "pagos_rechazados": rng.poisson(0.5, cantidad),
+        "monto_pagado": aprobados * rng.uniform(100, 2000, cantidad),
+    }
+
+
+def medir_modelos(datos: dict):
+    for nombre, modelo in puntaje.MODELOS.items():
+        inicio = time.perf_counter()
+        puntajes = modelo(datos)
+        calculo = time.perf_counter() - inicio
+        inicio = time.perf_counter()
+        np.lexsort((datos["prestamo_id"], -puntajes))
+        orden = time.perf_counter() - inicio
+        print(f"modelo {nombre:<13} {len(puntajes):>9} solicitudes {calculo * 1000:>9.1f} ms  orden {orden * 1000:>8.1f} ms")
+
+
+def _medir_cola(db, paso: str) -> dict:
+    inicio = time.perf_counter()
+    resultado = puntaje.cola(db, limite=100)
+    transcurrido = time.perf_counter() - inicio
+    print(f"cola (bd) {paso:<11} {resultado['total']:>9} solicitudes {transcurrido * 1000:>9.1f} ms")
+    return resultado
+
+
+def medir_bd():
+    with database.SessionLectura() as db:
+        cache.limpiar_todo()
+        primera = _medir_cola(db, "carga fría")
+        _medir_cola(db, "en caché")
+        if primera["items"]:
+            # Como después de aprobar una de las primeras de la cola
+            cache.invalidar_prestamos(primera["items"][0]["prestamo_id"])
+            _medir_cola(db, "incremental")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de la precalificación de solicitudes")
+    parser.add_argument("--solicitudes", type=int, default=1000000)
+    parser.add_argument("--bd", action="store_true", help="Medir también la cola sobre las pendientes de la base de datos")
+    args = parser.parse_args()
+
+    medir_modelos(solicitudes_aleatorias(args.solicitudes))
+    if args.bd:
+        medir_bd()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# bench_recepcion.py
+# Pico de POST /prestamos/solicitud con SOLICITUDES_MODO=directo y =cola.
+#
+# Levanta la API una vez por modo y envía todas las solicitudes a la vez con
+# la concurrencia indicada. Mide la latencia que ve el cliente, las respuestas
+# por código (202 encoladas, 503 rechazadas por admisión) y, en modo cola, el
+# tiempo hasta que los trabajadores terminan de crearlas.
+#
+#   cd Backend-Datos1
+#   python -m benchmarks.bench_recepcion --solicitudes 2000 --concurrencia 200
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+from collections import Counter
+
+import httpx
+
+from app import database
+from benchmarks.bench_async import _esperar_servidor, percentil
+from benchmarks.bench_solicitud import solicitud_de_prueba, sufijos_libres
+
+
+async def _pico(url, cuerpos, concurrencia, modo):
+    latencias = []
+    codigos = Counter()
+    limites = httpx.Limits(max_connections=concurrencia, max_keepalive_connections=concurrencia)
+    pendientes = iter(cuerpos)
+
+    async with httpx.AsyncClient(base_url=url, limits=limites, timeout=120) as cliente:
+        async def trabajador():
+            for cuerpo in pendientes:
+                inicio = time.perf_counter()
+                try:
+                    respuesta = await cliente.post("/usuarios/prestamos/solicitud", content=cuerpo,
+                                                   headers={"Content-Type": "application/json"})
+                    codigos[respuesta.status_code] += 1
+                except httpx.HTTPError:
+                    codigos["error"] += 1
+                latencias.append(time.perf_counter() - inicio)
+
+        inicio = time.perf_counter()
+        await asyncio.gather(*(trabajador() for _ in range(concurrencia)))
+        pico = time.perf_counter() - inicio
+
+        # Modo cola: esperar a que los trabajadores vacíen la cola
+        while modo == "cola" and (await cliente.get("/usuarios/prestamos/solicitudes/cola")).json()["pendientes"]:
+            await asyncio.sleep(0.2)
+        total = time.perf_counter() - inicio
+
+    return {
+        "codigos": codigos,
+        "pico_s": pico,
+        "total_s": total,
+        "p50_ms": percentil(latencias, 50) * 1000,
+        "p99_ms": percentil(latencias, 99) * 1000,
+    }
+
+
+def medir_modo(modo, cuerpos, args):
+    url = f"http://127.0.0.1:{args.puerto}"
+    entorno = dict(
+        os.environ, SOLICITUDES_MODO=modo, SOLICITUDES_TRABAJADORES=str(args.trabajadores),
+        SOLICITUDES_COLA_MAXIMO=str(args.maximo), VENCIMIENTOS_INTERVALO="0",
+    )
+    servidor = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(args.puerto), "--log-level", "warning"],
+        env=entorno,
+    )
+    try:
+        asyncio.run(_esperar_servidor(url))
+        return asyncio.run(_pico(url, cuerpos, args.concurrencia, modo))
+    finally:
+        servidor.terminate()
+        servidor.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de la recepción de solicitudes en cola")
+    parser.add_argument("--solicitudes", type=int, default=1000, help="Solicitudes por modo")
+    parser.add_argument("--concurrencia", type=int, default=200)
+    parser.add_argument("--trabajadores", type=int, default=2)
+    parser.add_argument("--maximo", type=int, default=10000, help="SOLICITUDES_COLA_MAXIMO")
+    parser.add_argument("--puerto", type=int, default=8765)
+    args = parser.parse_args()
+
+    n = args.solicitudes
+    with database.SessionLocal() as db:
+        sufijos = sufijos_libres(db, 2 * n)
+
+    print(f"{'modo':<8} {'pico s':>8} {'total s':>8} {'p50 ms':>9} {'p99 ms':>9}  respuestas")
+    for modo, lote in (("directo", sufijos[:n]), ("cola", sufijos[n:])):
+        cuerpos = [solicitud_de_prueba(i, s).model_dump_json() for i, s in enumerate(lote)]
+        r = medir_modo(modo, cuerpos, args)
+        codigos = ", ".join(f"{codigo}: {total}" for codigo, total in sorted(r["codigos"].items(), key=str))
+        print(f"{modo:<8} {r['pico_s']:>8.2f} {r['total_s']:>8.2f} {r['p50_ms']:>9.2f} {r['p99_ms']:>9.2f}  {codigos}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+# bench_referencias.py
+# Compara el diseño anterior de referencias (una fila de 24 columnas por
+# solicitud) con el normalizado de models.py / migrations/0006 (una fila por
+# referencia).
+#
+# Cada perfil se crea en un esquema temporal con solo la tabla referencias
+# (sin la llave foránea a usuarios, para medir únicamente la tabla) y se llena
+# con las mismas solicitudes de 2 a 4 referencias, una transacción por
+# solicitud como en crud.crear_solicitud:
+#
+#   anterior     24 columnas con un índice por columna (antes de 0003)
+#   ancha        24 columnas con los índices de 0003 (llave primaria y usuario_id)
+#   normalizada  una fila por referencia (llave primaria y usuario_id)
+#
+# Se mide el ancho de fila (pg_column_size), bytes de tabla e índices por
+# solicitud, entradas de índice escritas por solicitud, inserciones por segundo
+# y la lectura de las referencias de un usuario. Los esquemas se borran al
+# terminar.
+#
+#   cd Backend-Datos1
+#   python -m benchmarks.bench_referencias --solicitudes 20000
+import argparse
+import random
+import time
+
+from sqlalchemy import VARCHAR, Column, Integer, MetaData, Table, bindparam, create_engine, insert, select, text
+
+from app import crud, database, models, schemas
+
+from .bench_async import percentil
+
+CAMPOS = list(schemas.ReferenciaBase.model_fields)
+NOMBRES = ["María", "José", "Ana", "Luis", "Carmen", "Juan", "Rosa", "Carlos"]
+APELLIDOS = ["López", "García", "Pérez", "Hernández", "Morales", "Castillo"]
+
+
+def tabla_ancha(metadata: MetaData, indice_por_columna: bool) -> Table:
+    columnas = [
+        Column("referencia_id", Integer, primary_key=True, index=indice_por_columna),
+        Column("usuario_id", Integer, index=True),
+    ]
+    for n in range(1, 5):
+        for campo in CAMPOS:
+            tipo = VARCHAR(20) if campo == "telefono" else VARCHAR(100)
+            columnas.append(Column(f"referencia{n}_{campo}", tipo, index=indice_por_columna))
+    return Table("referencias", metadata, *columnas)
+
+
+def tabla_normalizada(metadata: MetaData) -> Table:
+    # Misma definición que models.Referencias, sin la llave foránea
+    return Table("referencias", metadata, *(
+        Column(c.name, c.type, primary_key=c.primary_key, nullable=c.nullable, index=c.index)
+        for c in models.Referencias.__table__.c
+    ))
+
+
+def filas_anchas(usuario_id: int, referencias: list) -> list:
+    fila = {"usuario_id": usuario_id}
+    for n, referencia in enumerate(referencias, start=1):
+        fila.update({f"referencia{n}_{campo}": valor for campo, valor in referencia.model_dump().items()})
+    return [fila]
+
+
+PERFILES = {
+    "anterior": (lambda metadata: tabla_ancha(metadata, True), filas_anchas),
+    "ancha": (lambda metadata: tabla_ancha(metadata, False), filas_anchas),
+    "normalizada": (tabla_normalizada, crud._filas_referencias),
+}
+
+
+def referencias_de_prueba(cantidad: int, semilla: int = 7) -> list:
+    # De 2 a 4 referencias por solicitud; nombres y apellidos segundos a veces vacíos
+    rng = random.Random(semilla)
+    solicitudes = []
+    for _ in range(cantidad):
+        solicitudes.append([
+            schemas.ReferenciaBase(
+                primer_nombre=rng.choice(NOMBRES),
+                segundo_nombre=rng.choice(NOMBRES) if rng.random() < 0.6 else None,
+                primer_apellido=rng.choice(APELLIDOS),
+                segundo_apellido=rng.choice(APELLIDOS) if rng.random() < 0.8 else None,
+                telefono=f"{rng.randrange(3000, 6000)}-{rng.randrange(10000):04d}",
+            )
+            for _ in range(rng.choice((2, 2, 3, 4)))
+        ])
+    return solicitudes
+
+
+def medir_perfil(esquema: str, perfil: str, solicitudes: list, lecturas: int) -> dict:
+    crear_tabla, filas = PERFILES[perfil]
+    with database.engine.begin() as conexion:
+        conexion.execute(text(f"DROP SCHEMA IF EXISTS {esquema} CASCADE"))
+        conexion.execute(text(f"CREATE SCHEMA {esquema}"))
+    engine = create_engine(database.SQLALCHEMY_DATABASE_URL, connect_args={"options": f"-csearch_path={esquema}"})
+    try:
+        metadata = MetaData()
+        tabla = crear_tabla(metadata)
+        metadata.create_all(engine)
+
+        inicio = time.perf_counter()
+        for usuario_id, referencias in enumerate(solicitudes, start=1):
+            with engine.begin() as conexion:
+                conexion.execute(insert(tabla).values(filas(usuario_id, referencias)))
+        por_segundo = len(solicitudes) / (time.perf_counter() - inicio)
+
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conexion:
+            conexion.execute(text("VACUUM ANALYZE referencias"))
+            cantidad_filas, ancho, bytes_tabla, bytes_indices = conexion.execute(text(
+                "SELECT count(*), avg(pg_column_size(r.*)), pg_table_size('referencias'), pg_indexes_size('referencias')"
+                " FROM referencias r"
+            )).one()
+            indices = conexion.execute(text(
+                "SELECT count(*) FROM pg_indexes WHERE schemaname = current_schema()"
+            )).scalar()
+
+            rng = random.Random(11)
+            consulta = select(tabla).where(tabla.c.usuario_id == bindparam("usuario_id"))
+            latencias = []
+            for _ in range(lecturas):
+                usuario_id = rng.randrange(1, len(solicitudes) + 1)
+                inicio = time.perf_counter()
+                conexion.execute(consulta, {"usuario_id": usuario_id}).all()
+                latencias.append(time.perf_counter() - inicio)
+    finally:
+        engine.dispose()
+        with database.engine.begin() as conexion:
+            conexion.execute(text(f"DROP SCHEMA {esquema} CASCADE"))
+
+    n = len(solicitudes)
+    return {
+        "indices": indices,
+        "ancho_fila": float(ancho),
+        "bytes_fila_solicitud": float(ancho) * cantidad_filas / n,
+        "tabla_solicitud": bytes_tabla / n,
+        "indices_solicitud": bytes_indices / n,
+        "entradas_indice": indices * cantidad_filas / n,
+        "por_segundo": por_segundo,
+        "lectura_p50": percentil(latencias, 50),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Referencias: tabla ancha contra una fila por referencia")
+    parser.add_argument("--solicitudes", type=int, default=20000)
+    parser.add_argument("--lecturas", type=int, default=2000, help="Consultas de referencias por usuario")
+    args = parser.parse_args()
+
+    solicitudes = referencias_de_prueba(args.solicitudes)
+    promedio = sum(len(r) for r in solicitudes) / len(solicitudes)
+    print(f"{args.solicitudes} solicitudes, {promedio:.2f} referencias en promedio")
+    print(
+        f"{'perfil':<12} {'índices':>7} {'B/fila':>7} {'B filas/solic':>13} {'tabla B/solic':>13} "
+        f"{'índices B/solic':>15} {'entradas índice':>15} {'solic/s':>8} {'lectura p50 ms':>14}"
+    )
+    for perfil in PERFILES:
+        r = medir_perfil(f"bench_ref_{perfil}", perfil, solicitudes, args.lecturas)
+        print(
+            f"{perfil:<12} {r['indices']:>7} {r['ancho_fila']:>7.0f} {r['bytes_fila_solicitud']:>13.0f} "
+            f"{r['tabla_solicitud']:>13.0f} {r['indices_solicitud']:>15.0f} {r['entradas_indice']:>15.1f} "
+            f"{r['por_segundo']:>8.0f} {r['lectura_p50'] * 1000:>14.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+# bench_solicitud.py
+# Compara idas y vueltas a la base de datos y latencia por solicitud entre el
+# flujo anterior de POST /prestamos/solicitud (varios commits y refresh) y
+# crud.crear_solicitud (una sola transacción).
+#
+#   cd Backend-Datos1
+#   python -m benchmarks.bench_solicitud --solicitudes 2000
+import argparse
+import random
+import time
+from datetime import date
+
+from sqlalchemy import event
+
+from app import crud, database, models, schemas
+
+
+def sufijos_libres(db, cantidad: int) -> list:
+    # codigo_cliente es único y se deriva de los últimos 4 dígitos del CUI,
+    # así que cada solicitud de prueba necesita un sufijo sin usar
+    usados = {c for (c,) in db.query(models.User.codigo_cliente)}
+    libres = [f"{n:04d}" for n in range(10000) if f"U-{n:04d}" not in usados]
+    if len(libres) < cantidad:
+        raise SystemExit(f"Solo quedan {len(libres)} sufijos de CUI libres")
+    return libres[:cantidad]
+
+
+def solicitud_de_prueba(n: int, sufijo: str) -> schemas.ClienteSolicitud:
+    referencia = {"primer_nombre": "Ref", "primer_apellido": "Prueba", "telefono": "5555-0000"}
+    return schemas.ClienteSolicitud(
+        genero="F",
+        cui=f"{random.randrange(10**8, 10**9)}{sufijo}",
+        fecha_nacimiento=date(1990, 1, 1),
+        estado_civil="Soltera",
+        nacionalidad="Guatemalteca",
+        primer_nombre="Bench",
+        primer_apellido=f"Usuario{n}",
+        ocupacion=f"Ocupación {n % 20}",
+        direccion={"depto_nacimiento": "Guatemala", "muni_nacimiento": "Mixco", "vecindad": "Zona 1"},
+        referencias=[referencia, referencia],
+        monto_prestamo=1000 + n,
+        motivo_prestamo="Benchmark",
+        cuotas_pactadas=12,
+    )
+
+
+def flujo_anterior(db, cliente: schemas.ClienteSolicitud):
+    # Reproducción del flujo original: un commit por entidad y refresh tras cada uno
+    ocupacion = db.query(models.Ocupaciones).filter(models.Ocupaciones.nombre_ocupacion == cliente.ocupacion).first()
+    if not ocupacion:
+        ocupacion = models.Ocupaciones(nombre_ocupacion=cliente.ocupacion)
+        db.add(ocupacion)
+        db.commit()
+        db.refresh(ocupacion)
+    usuario = db.query(models.User).filter(models.User.cui == cliente.cui).first()
+    if not usuario:
+        usuario = models.User(
+            codigo_cliente=f"U-{cliente.cui[-4:]}", cui=cliente.cui, genero=cliente.genero,
+            fecha_nacimiento=cliente.fecha_nacimiento, primer_nombre=cliente.primer_nombre,
+            primer_apellido=cliente.primer_apellido, ocupaciones_id=ocupacion.ocupacion_id, rol_id=2,
+        )
+        db.add(usuario)
+        db.commit()
+        db.refresh(usuario)
+    db.add(models.DireccionUser(usuario_id=usuario.usuario_id, **cliente.direccion.model_dump()))
+    db.add_all(models.Referencias(**fila) for fila in crud._filas_referencias(usuario.usuario_id, cliente.referencias))
+    prestamo = models.Prestamos(
+        usuario_id=usuario.usuario_id, codigo_prestamo=f"P-{usuario.usuario_id}-{cliente.monto_prestamo:.0f}",
+        motivo_prestamo=cliente.motivo_prestamo, prestamo_estatus_id=2,
+        monto_solicitado=cliente.monto_prestamo, cuotas_pactadas=cliente.cuotas_pactadas, porcentaje_interes=0,
+    )
+    db.add(prestamo)
+    db.commit()
+    db.refresh(prestamo)
+    db.add(models.CargosAdmin(prestamo_id=prestamo.prestamo_id, prestamo_iva=0.0,
+                              prestamo_cargos_administrativos=0.0, prestamo_total=0.0))
+    db.commit()
+
+
+def flujo_transaccional(db, cliente: schemas.ClienteSolicitud):
+    crud.crear_solicitud(db, cliente)
+    db.commit()
+
+
+class ContadorIdasVueltas:
+    def __init__(self, engine):
+        self.total = 0
+        event.listen(engine, "before_cursor_execute", self._sumar)
+        event.listen(engine, "begin", self._sumar)
+        event.listen(engine, "commit", self._sumar)
+        event.listen(engine, "rollback", self._sumar)
+
+    def _sumar(self, *args, **kwargs):
+        self.total += 1
+
+
+def medir(nombre, flujo, solicitudes, contador):
+    latencias = []
+    idas_vueltas = 0
+    for n, cliente in enumerate(solicitudes):
+        db = database.SessionLocal()
+        antes = contador.total
+        inicio = time.perf_counter()
+        try:
+            flujo(db, cliente)
+        finally:
+            db.close()
+        latencias.append(time.perf_counter() - inicio)
+        idas_vueltas += contador.total - antes
+    latencias.sort()
+    print(
+        f"{nombre:<14} {idas_vueltas / len(solicitudes):>12.1f} "
+        f"{sum(latencias) / len(latencias) * 1000:>10.2f} "
+        f"{latencias[len(latencias) // 2] * 1000:>9.2f} "
+        f"{latencias[int(len(latencias) * 0.99)] * 1000:>9.2f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de POST /prestamos/solicitud")
+    parser.add_argument("--solicitudes", type=int, default=1000, help="Solicitudes por flujo")
+    args = parser.parse_args()
+
+    with database.SessionLocal() as db:
+        sufijos = sufijos_libres(db, 2 * args.solicitudes)
+    n = args.solicitudes
+
+    contador = ContadorIdasVueltas(database.engine)
+    print(f"{'flujo':<14} {'idas/vuelta':>12} {'media ms':>10} {'p50 ms':>9} {'p99 ms':>9}")
+    medir("anterior", flujo_anterior, [solicitud_de_prueba(i, s) for i, s in enumerate(sufijos[:n])], contador)
+    medir("transaccional", flujo_transaccional, [solicitud_de_prueba(i, s) for i, s in enumerate(sufijos[n:])], contador)
+
+
+if __name__ == "__main__":
+    main()
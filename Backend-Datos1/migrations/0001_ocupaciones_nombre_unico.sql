@@ -0,0 +1,26 @@
+-- 0001_ocupaciones_nombre_unico.sql
+-- La solicitud de préstamo hace upsert de la ocupación con
+-- INSERT ... ON CONFLICT (nombre_ocupacion), que requiere un índice único.
+
+BEGIN;
+
+-- Reasignar usuarios de ocupaciones duplicadas a la de menor id
+UPDATE usuarios u
+SET ocupaciones_id = d.conservar_id
+FROM (
+    SELECT ocupacion_id,
+           min(ocupacion_id) OVER (PARTITION BY nombre_ocupacion) AS conservar_id
+    FROM ocupaciones
+) d
+WHERE u.ocupaciones_id = d.ocupacion_id
+  AND d.ocupacion_id <> d.conservar_id;
+
+DELETE FROM ocupaciones o
+USING ocupaciones c
+WHERE o.nombre_ocupacion = c.nombre_ocupacion
+  AND o.ocupacion_id > c.ocupacion_id;
+
+DROP INDEX IF EXISTS ix_ocupaciones_nombre_ocupacion;
+CREATE UNIQUE INDEX ix_ocupaciones_nombre_ocupacion ON ocupaciones (nombre_ocupacion);
+
+COMMIT;
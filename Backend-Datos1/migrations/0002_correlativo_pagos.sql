@@ -0,0 +1,24 @@
+-- 0002_correlativo_pagos.sql
+-- pago_realizado_correlativo pasa a salir de una secuencia en lugar de
+-- consultar el último pago_realizado_id y sumarle uno.
+
+BEGIN;
+
+CREATE SEQUENCE IF NOT EXISTS pago_realizado_correlativo_seq;
+
+-- Continuar después del mayor correlativo o id existente
+SELECT setval(
+    'pago_realizado_correlativo_seq',
+    GREATEST(
+        COALESCE((SELECT max(substring(pago_realizado_correlativo FROM '^PAGO-(\d+)$')::bigint) FROM pagos_realizados), 0),
+        COALESCE((SELECT max(pago_realizado_id) FROM pagos_realizados), 0),
+        1
+    ),
+    EXISTS (SELECT 1 FROM pagos_realizados)
+);
+
+ALTER TABLE pagos_realizados
+    ALTER COLUMN pago_realizado_correlativo
+    SET DEFAULT ('PAGO-' || nextval('pago_realizado_correlativo_seq'));
+
+COMMIT;
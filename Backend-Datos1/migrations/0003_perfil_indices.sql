@@ -0,0 +1,107 @@
+-- 0003_perfil_indices.sql
+-- Perfil de índices según las consultas que realmente se ejecutan: casi todas
+-- las columnas tenían index=True (montos, Text, los 24 nombres y teléfonos de
+-- referencias), lo que multiplicaba el costo de cada solicitud de préstamo.
+--
+-- Se conservan los índices de cui, codigo_cliente, nombre_ocupacion y de las
+-- llaves foráneas que se consultan (usuario_id, cargos por prestamo_id). Los
+-- ix_<tabla>_<llave primaria> duplicaban el índice de la llave primaria.
+--
+-- Los índices nuevos se crean con CONCURRENTLY, fuera de transacción, para no
+-- bloquear escrituras mientras se construyen (ver app/migraciones.py).
+
+BEGIN;
+
+-- codigo_prestamo pasa a ser único: los repetidos reciben el sufijo -<prestamo_id>
+-- como hace ahora crear_solicitud
+UPDATE prestamo p
+SET codigo_prestamo = p.codigo_prestamo || '-' || p.prestamo_id
+FROM prestamo c
+WHERE p.codigo_prestamo = c.codigo_prestamo
+  AND p.prestamo_id > c.prestamo_id;
+
+DROP INDEX IF EXISTS ix_usuarios_usuario_id;
+DROP INDEX IF EXISTS ix_usuarios_rol_id;
+DROP INDEX IF EXISTS ix_usuarios_genero;
+DROP INDEX IF EXISTS ix_usuarios_fecha_nacimiento;
+DROP INDEX IF EXISTS ix_usuarios_estado_civil;
+DROP INDEX IF EXISTS ix_usuarios_nacionalidad;
+DROP INDEX IF EXISTS ix_usuarios_primer_nombre;
+DROP INDEX IF EXISTS ix_usuarios_segundo_nombre;
+DROP INDEX IF EXISTS ix_usuarios_tercer_nombre;
+DROP INDEX IF EXISTS ix_usuarios_primer_apellido;
+DROP INDEX IF EXISTS ix_usuarios_segundo_apellido;
+DROP INDEX IF EXISTS ix_usuarios_apellido_casada;
+DROP INDEX IF EXISTS ix_usuarios_ocupaciones_id;
+DROP INDEX IF EXISTS ix_cargos_administrativos_cargos_id;
+DROP INDEX IF EXISTS ix_cargos_administrativos_prestamo_iva;
+DROP INDEX IF EXISTS ix_cargos_administrativos_prestamo_cargos_administrativos;
+DROP INDEX IF EXISTS ix_cargos_administrativos_prestamo_total;
+DROP INDEX IF EXISTS ix_direccion_usuario_direccion_usuario_id;
+DROP INDEX IF EXISTS ix_direccion_usuario_depto_nacimiento;
+DROP INDEX IF EXISTS ix_direccion_usuario_muni_nacimiento;
+DROP INDEX IF EXISTS ix_direccion_usuario_vecindad;
+DROP INDEX IF EXISTS ix_ocupaciones_ocupacion_id;
+DROP INDEX IF EXISTS ix_pagos_realizados_pago_realizado_id;
+DROP INDEX IF EXISTS ix_pagos_realizados_prestamo_id;
+DROP INDEX IF EXISTS ix_pagos_realizados_pago_realizado_fecha_creacion;
+DROP INDEX IF EXISTS ix_pagos_realizados_pago_realizado_fecha_pago;
+DROP INDEX IF EXISTS ix_pagos_realizados_pago_realizado_monto_pagado;
+DROP INDEX IF EXISTS ix_pagos_realizados_validacion1_validado_por;
+DROP INDEX IF EXISTS ix_pagos_realizados_estado;
+DROP INDEX IF EXISTS ix_prestamo_prestamo_id;
+DROP INDEX IF EXISTS ix_prestamo_codigo_prestamo;
+DROP INDEX IF EXISTS ix_prestamo_motivo_prestamo;
+DROP INDEX IF EXISTS ix_prestamo_prestamo_estatus_id;
+DROP INDEX IF EXISTS ix_prestamo_monto_solicitado;
+DROP INDEX IF EXISTS ix_prestamo_cuotas_pactadas;
+DROP INDEX IF EXISTS ix_prestamo_estatus_estatus_id;
+DROP INDEX IF EXISTS ix_prestamo_estatus_descripcion;
+DROP INDEX IF EXISTS ix_referencias_referencia_id;
+DROP INDEX IF EXISTS ix_referencias_referencia1_primer_nombre;
+DROP INDEX IF EXISTS ix_referencias_referencia1_segundo_nombre;
+DROP INDEX IF EXISTS ix_referencias_referencia1_tercer_nombre;
+DROP INDEX IF EXISTS ix_referencias_referencia1_primer_apellido;
+DROP INDEX IF EXISTS ix_referencias_referencia1_segundo_apellido;
+DROP INDEX IF EXISTS ix_referencias_referencia1_telefono;
+DROP INDEX IF EXISTS ix_referencias_referencia2_primer_nombre;
+DROP INDEX IF EXISTS ix_referencias_referencia2_segundo_nombre;
+DROP INDEX IF EXISTS ix_referencias_referencia2_tercer_nombre;
+DROP INDEX IF EXISTS ix_referencias_referencia2_primer_apellido;
+DROP INDEX IF EXISTS ix_referencias_referencia2_segundo_apellido;
+DROP INDEX IF EXISTS ix_referencias_referencia2_telefono;
+DROP INDEX IF EXISTS ix_referencias_referencia3_primer_nombre;
+DROP INDEX IF EXISTS ix_referencias_referencia3_segundo_nombre;
+DROP INDEX IF EXISTS ix_referencias_referencia3_tercer_nombre;
+DROP INDEX IF EXISTS ix_referencias_referencia3_primer_apellido;
+DROP INDEX IF EXISTS ix_referencias_referencia3_segundo_apellido;
+DROP INDEX IF EXISTS ix_referencias_referencia3_telefono;
+DROP INDEX IF EXISTS ix_referencias_referencia4_primer_nombre;
+DROP INDEX IF EXISTS ix_referencias_referencia4_segundo_nombre;
+DROP INDEX IF EXISTS ix_referencias_referencia4_tercer_nombre;
+DROP INDEX IF EXISTS ix_referencias_referencia4_primer_apellido;
+DROP INDEX IF EXISTS ix_referencias_referencia4_segundo_apellido;
+DROP INDEX IF EXISTS ix_referencias_referencia4_telefono;
+DROP INDEX IF EXISTS ix_roles_rol_id;
+DROP INDEX IF EXISTS ix_roles_nombre_rol;
+DROP INDEX IF EXISTS ix_roles_descripcion;
+DROP INDEX IF EXISTS ix_validadores_validador_id;
+DROP INDEX IF EXISTS ix_validadores_validador_nombre;
+DROP INDEX IF EXISTS ix_pagos_futuros_pago_id;
+DROP INDEX IF EXISTS ix_pagos_futuros_prestamo_id;
+DROP INDEX IF EXISTS ix_pagos_futuros_fecha_pago;
+DROP INDEX IF EXISTS ix_pagos_futuros_monto_pago;
+DROP INDEX IF EXISTS ix_pagos_futuros_estado;
+
+COMMIT;
+
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS ix_prestamo_codigo_prestamo ON prestamo (codigo_prestamo);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_prestamo_estatus_prestamo ON prestamo (prestamo_estatus_id, prestamo_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_pagos_realizados_prestamo_estado ON pagos_realizados (prestamo_id, estado);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_pagos_realizados_pendientes ON pagos_realizados (pago_realizado_id) WHERE estado = 'pendiente';
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_pagos_futuros_prestamo_estado ON pagos_futuros (prestamo_id, estado);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_pagos_futuros_pendientes_fecha ON pagos_futuros (fecha_pago) WHERE estado = 'pendiente';
+
+ANALYZE prestamo;
+ANALYZE pagos_realizados;
+ANALYZE pagos_futuros;
@@ -0,0 +1,80 @@
+-- 0004_morosidad.sql
+-- Reporte de morosidad incremental (app/morosidad.py): tablas de resumen,
+-- préstamos por refrescar y triggers que los anotan cuando cambian sus
+-- cuotas, sus pagos o el préstamo. El primer refresco recalcula todo.
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS morosidad_prestamo (
+    prestamo_id INTEGER NOT NULL PRIMARY KEY REFERENCES prestamo (prestamo_id),
+    tramo VARCHAR(10) NOT NULL,
+    prestamo_estatus_id INTEGER DEFAULT '0' NOT NULL,
+    ocupacion_id INTEGER DEFAULT '0' NOT NULL,
+    depto_nacimiento VARCHAR(100) DEFAULT '' NOT NULL,
+    fecha_atraso DATE,
+    cuotas_vencidas INTEGER NOT NULL,
+    saldo_vencido FLOAT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS morosidad_resumen (
+    tramo VARCHAR(10) NOT NULL,
+    prestamo_estatus_id INTEGER NOT NULL,
+    ocupacion_id INTEGER NOT NULL,
+    depto_nacimiento VARCHAR(100) NOT NULL,
+    prestamos INTEGER NOT NULL,
+    cuotas_vencidas INTEGER NOT NULL,
+    saldo_vencido FLOAT NOT NULL,
+    PRIMARY KEY (tramo, prestamo_estatus_id, ocupacion_id, depto_nacimiento)
+);
+
+CREATE TABLE IF NOT EXISTS morosidad_pendientes (
+    prestamo_id INTEGER NOT NULL PRIMARY KEY
+);
+
+CREATE TABLE IF NOT EXISTS morosidad_control (
+    control_id INTEGER NOT NULL PRIMARY KEY,
+    fecha_referencia DATE,
+    actualizado_en TIMESTAMP WITHOUT TIME ZONE
+);
+
+CREATE OR REPLACE FUNCTION morosidad_marcar_nuevas() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    INSERT INTO morosidad_pendientes (prestamo_id)
+    SELECT DISTINCT prestamo_id FROM nuevas WHERE prestamo_id IS NOT NULL ORDER BY 1
+    ON CONFLICT DO NOTHING;
+    RETURN NULL;
+END
+$$;
+
+CREATE OR REPLACE FUNCTION morosidad_marcar_anteriores() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    INSERT INTO morosidad_pendientes (prestamo_id)
+    SELECT DISTINCT prestamo_id FROM anteriores WHERE prestamo_id IS NOT NULL ORDER BY 1
+    ON CONFLICT DO NOTHING;
+    RETURN NULL;
+END
+$$;
+
+DROP TRIGGER IF EXISTS morosidad_pagos_futuros_insert ON pagos_futuros;
+CREATE TRIGGER morosidad_pagos_futuros_insert AFTER INSERT ON pagos_futuros
+    REFERENCING NEW TABLE AS nuevas FOR EACH STATEMENT EXECUTE FUNCTION morosidad_marcar_nuevas();
+DROP TRIGGER IF EXISTS morosidad_pagos_futuros_update ON pagos_futuros;
+CREATE TRIGGER morosidad_pagos_futuros_update AFTER UPDATE ON pagos_futuros
+    REFERENCING NEW TABLE AS nuevas FOR EACH STATEMENT EXECUTE FUNCTION morosidad_marcar_nuevas();
+DROP TRIGGER IF EXISTS morosidad_pagos_futuros_delete ON pagos_futuros;
+CREATE TRIGGER morosidad_pagos_futuros_delete AFTER DELETE ON pagos_futuros
+    REFERENCING OLD TABLE AS anteriores FOR EACH STATEMENT EXECUTE FUNCTION morosidad_marcar_anteriores();
+DROP TRIGGER IF EXISTS morosidad_pagos_realizados_insert ON pagos_realizados;
+CREATE TRIGGER morosidad_pagos_realizados_insert AFTER INSERT ON pagos_realizados
+    REFERENCING NEW TABLE AS nuevas FOR EACH STATEMENT EXECUTE FUNCTION morosidad_marcar_nuevas();
+DROP TRIGGER IF EXISTS morosidad_pagos_realizados_update ON pagos_realizados;
+CREATE TRIGGER morosidad_pagos_realizados_update AFTER UPDATE ON pagos_realizados
+    REFERENCING NEW TABLE AS nuevas FOR EACH STATEMENT EXECUTE FUNCTION morosidad_marcar_nuevas();
+DROP TRIGGER IF EXISTS morosidad_pagos_realizados_delete ON pagos_realizados;
+CREATE TRIGGER morosidad_pagos_realizados_delete AFTER DELETE ON pagos_realizados
+    REFERENCING OLD TABLE AS anteriores FOR EACH STATEMENT EXECUTE FUNCTION morosidad_marcar_anteriores();
+DROP TRIGGER IF EXISTS morosidad_prestamo_update ON prestamo;
+CREATE TRIGGER morosidad_prestamo_update AFTER UPDATE ON prestamo
+    REFERENCING NEW TABLE AS nuevas FOR EACH STATEMENT EXECUTE FUNCTION morosidad_marcar_nuevas();
+
+COMMIT;
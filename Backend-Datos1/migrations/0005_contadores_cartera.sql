@@ -0,0 +1,126 @@
+-- 0005_contadores_cartera.sql
+-- Contadores del resumen de cartera (app/contadores.py), mantenidos por
+-- triggers en la misma transacción de cada escritura sobre prestamo y
+-- pagos_realizados. Los valores iniciales se cargan con los triggers ya
+-- creados: CREATE TRIGGER bloquea las escrituras hasta el COMMIT.
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS contadores_cartera (
+    tipo VARCHAR(20) NOT NULL,
+    clave VARCHAR(30) NOT NULL,
+    slot INTEGER NOT NULL,
+    cantidad INTEGER NOT NULL,
+    monto FLOAT NOT NULL,
+    PRIMARY KEY (tipo, clave, slot)
+);
+
+CREATE OR REPLACE FUNCTION contadores_prestamo() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO contadores_cartera (tipo, clave, slot, cantidad, monto)
+        SELECT 'prestamos', clave, mod(pg_backend_pid(), 16), sum(cantidad), sum(monto)
+        FROM (SELECT coalesce(prestamo_estatus_id::text, ''), 1, 1 * coalesce(monto_solicitado, 0) FROM nuevas) AS cambios (clave, cantidad, monto)
+        GROUP BY clave
+        HAVING sum(cantidad) <> 0 OR sum(monto) <> 0
+        ORDER BY clave
+        ON CONFLICT (tipo, clave, slot) DO UPDATE
+        SET cantidad = contadores_cartera.cantidad + excluded.cantidad,
+            monto = contadores_cartera.monto + excluded.monto;
+    ELSIF TG_OP = 'DELETE' THEN
+        INSERT INTO contadores_cartera (tipo, clave, slot, cantidad, monto)
+        SELECT 'prestamos', clave, mod(pg_backend_pid(), 16), sum(cantidad), sum(monto)
+        FROM (SELECT coalesce(prestamo_estatus_id::text, ''), -1, -1 * coalesce(monto_solicitado, 0) FROM anteriores) AS cambios (clave, cantidad, monto)
+        GROUP BY clave
+        HAVING sum(cantidad) <> 0 OR sum(monto) <> 0
+        ORDER BY clave
+        ON CONFLICT (tipo, clave, slot) DO UPDATE
+        SET cantidad = contadores_cartera.cantidad + excluded.cantidad,
+            monto = contadores_cartera.monto + excluded.monto;
+    ELSE
+        INSERT INTO contadores_cartera (tipo, clave, slot, cantidad, monto)
+        SELECT 'prestamos', clave, mod(pg_backend_pid(), 16), sum(cantidad), sum(monto)
+        FROM (SELECT coalesce(prestamo_estatus_id::text, ''), 1, 1 * coalesce(monto_solicitado, 0) FROM nuevas
+        UNION ALL SELECT coalesce(prestamo_estatus_id::text, ''), -1, -1 * coalesce(monto_solicitado, 0) FROM anteriores) AS cambios (clave, cantidad, monto)
+        GROUP BY clave
+        HAVING sum(cantidad) <> 0 OR sum(monto) <> 0
+        ORDER BY clave
+        ON CONFLICT (tipo, clave, slot) DO UPDATE
+        SET cantidad = contadores_cartera.cantidad + excluded.cantidad,
+            monto = contadores_cartera.monto + excluded.monto;
+    END IF;
+    RETURN NULL;
+END
+$$;
+
+CREATE OR REPLACE FUNCTION contadores_pagos() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO contadores_cartera (tipo, clave, slot, cantidad, monto)
+        SELECT 'pagos', clave, mod(pg_backend_pid(), 16), sum(cantidad), sum(monto)
+        FROM (SELECT coalesce(estado, ''), 1, 1 * coalesce(pago_realizado_monto_pagado, 0) FROM nuevas) AS cambios (clave, cantidad, monto)
+        GROUP BY clave
+        HAVING sum(cantidad) <> 0 OR sum(monto) <> 0
+        ORDER BY clave
+        ON CONFLICT (tipo, clave, slot) DO UPDATE
+        SET cantidad = contadores_cartera.cantidad + excluded.cantidad,
+            monto = contadores_cartera.monto + excluded.monto;
+    ELSIF TG_OP = 'DELETE' THEN
+        INSERT INTO contadores_cartera (tipo, clave, slot, cantidad, monto)
+        SELECT 'pagos', clave, mod(pg_backend_pid(), 16), sum(cantidad), sum(monto)
+        FROM (SELECT coalesce(estado, ''), -1, -1 * coalesce(pago_realizado_monto_pagado, 0) FROM anteriores) AS cambios (clave, cantidad, monto)
+        GROUP BY clave
+        HAVING sum(cantidad) <> 0 OR sum(monto) <> 0
+        ORDER BY clave
+        ON CONFLICT (tipo, clave, slot) DO UPDATE
+        SET cantidad = contadores_cartera.cantidad + excluded.cantidad,
+            monto = contadores_cartera.monto + excluded.monto;
+    ELSE
+        INSERT INTO contadores_cartera (tipo, clave, slot, cantidad, monto)
+        SELECT 'pagos', clave, mod(pg_backend_pid(), 16), sum(cantidad), sum(monto)
+        FROM (SELECT coalesce(estado, ''), 1, 1 * coalesce(pago_realizado_monto_pagado, 0) FROM nuevas
+        UNION ALL SELECT coalesce(estado, ''), -1, -1 * coalesce(pago_realizado_monto_pagado, 0) FROM anteriores) AS cambios (clave, cantidad, monto)
+        GROUP BY clave
+        HAVING sum(cantidad) <> 0 OR sum(monto) <> 0
+        ORDER BY clave
+        ON CONFLICT (tipo, clave, slot) DO UPDATE
+        SET cantidad = contadores_cartera.cantidad + excluded.cantidad,
+            monto = contadores_cartera.monto + excluded.monto;
+    END IF;
+    RETURN NULL;
+END
+$$;
+
+DROP TRIGGER IF EXISTS contadores_prestamo_insert ON prestamo;
+CREATE TRIGGER contadores_prestamo_insert AFTER INSERT ON prestamo
+    REFERENCING NEW TABLE AS nuevas FOR EACH STATEMENT EXECUTE FUNCTION contadores_prestamo();
+DROP TRIGGER IF EXISTS contadores_prestamo_update ON prestamo;
+CREATE TRIGGER contadores_prestamo_update AFTER UPDATE ON prestamo
+    REFERENCING OLD TABLE AS anteriores NEW TABLE AS nuevas FOR EACH STATEMENT EXECUTE FUNCTION contadores_prestamo();
+DROP TRIGGER IF EXISTS contadores_prestamo_delete ON prestamo;
+CREATE TRIGGER contadores_prestamo_delete AFTER DELETE ON prestamo
+    REFERENCING OLD TABLE AS anteriores FOR EACH STATEMENT EXECUTE FUNCTION contadores_prestamo();
+
+DROP TRIGGER IF EXISTS contadores_pagos_realizados_insert ON pagos_realizados;
+CREATE TRIGGER contadores_pagos_realizados_insert AFTER INSERT ON pagos_realizados
+    REFERENCING NEW TABLE AS nuevas FOR EACH STATEMENT EXECUTE FUNCTION contadores_pagos();
+DROP TRIGGER IF EXISTS contadores_pagos_realizados_update ON pagos_realizados;
+CREATE TRIGGER contadores_pagos_realizados_update AFTER UPDATE ON pagos_realizados
+    REFERENCING OLD TABLE AS anteriores NEW TABLE AS nuevas FOR EACH STATEMENT EXECUTE FUNCTION contadores_pagos();
+DROP TRIGGER IF EXISTS contadores_pagos_realizados_delete ON pagos_realizados;
+CREATE TRIGGER contadores_pagos_realizados_delete AFTER DELETE ON pagos_realizados
+    REFERENCING OLD TABLE AS anteriores FOR EACH STATEMENT EXECUTE FUNCTION contadores_pagos();
+
+DELETE FROM contadores_cartera;
+
+INSERT INTO contadores_cartera (tipo, clave, slot, cantidad, monto)
+SELECT 'prestamos', coalesce(prestamo_estatus_id::text, ''), 0, count(*), coalesce(sum(coalesce(monto_solicitado, 0)), 0)
+FROM prestamo
+GROUP BY 2;
+
+INSERT INTO contadores_cartera (tipo, clave, slot, cantidad, monto)
+SELECT 'pagos', coalesce(estado, ''), 0, count(*), coalesce(sum(coalesce(pago_realizado_monto_pagado, 0)), 0)
+FROM pagos_realizados
+GROUP BY 2;
+
+COMMIT;
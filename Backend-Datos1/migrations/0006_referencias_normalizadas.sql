@@ -0,0 +1,62 @@
+-- 0006_referencias_normalizadas.sql
+-- referencias pasa de una fila ancha por solicitud (4 referencias en 24
+-- columnas, casi siempre con la mitad en NULL) a una fila por referencia,
+-- numerada con orden. Solo se indexan la llave primaria y usuario_id.
+--
+-- Los datos se mueven en la misma transacción: la tabla anterior se renombra,
+-- cada referencia con algún dato pasa a una fila de la nueva y al final se
+-- borra. Las escrituras sobre referencias esperan hasta el COMMIT.
+
+BEGIN;
+
+ALTER TABLE referencias RENAME TO referencias_anchas;
+ALTER INDEX referencias_pkey RENAME TO referencias_anchas_pkey;
+ALTER INDEX IF EXISTS ix_referencias_usuario_id RENAME TO ix_referencias_anchas_usuario_id;
+ALTER SEQUENCE IF EXISTS referencias_referencia_id_seq RENAME TO referencias_anchas_referencia_id_seq;
+
+CREATE TABLE referencias (
+    referencia_id SERIAL PRIMARY KEY,
+    usuario_id INTEGER NOT NULL REFERENCES usuarios (usuario_id),
+    orden SMALLINT NOT NULL,
+    primer_nombre VARCHAR(100),
+    segundo_nombre VARCHAR(100),
+    tercer_nombre VARCHAR(100),
+    primer_apellido VARCHAR(100),
+    segundo_apellido VARCHAR(100),
+    telefono VARCHAR(20)
+);
+
+-- Las referencias vacías (3 y 4 eran opcionales) no se copian; orden se
+-- renumera para que quede consecutivo dentro de cada solicitud
+INSERT INTO referencias (
+    usuario_id, orden, primer_nombre, segundo_nombre, tercer_nombre, primer_apellido, segundo_apellido, telefono
+)
+SELECT
+    r.usuario_id,
+    row_number() OVER (PARTITION BY r.referencia_id ORDER BY v.n),
+    v.primer_nombre, v.segundo_nombre, v.tercer_nombre, v.primer_apellido, v.segundo_apellido, v.telefono
+FROM referencias_anchas r
+CROSS JOIN LATERAL (VALUES
+    (1, r.referencia1_primer_nombre, r.referencia1_segundo_nombre, r.referencia1_tercer_nombre,
+        r.referencia1_primer_apellido, r.referencia1_segundo_apellido, r.referencia1_telefono),
+    (2, r.referencia2_primer_nombre, r.referencia2_segundo_nombre, r.referencia2_tercer_nombre,
+        r.referencia2_primer_apellido, r.referencia2_segundo_apellido, r.referencia2_telefono),
+    (3, r.referencia3_primer_nombre, r.referencia3_segundo_nombre, r.referencia3_tercer_nombre,
+        r.referencia3_primer_apellido, r.referencia3_segundo_apellido, r.referencia3_telefono),
+    (4, r.referencia4_primer_nombre, r.referencia4_segundo_nombre, r.referencia4_tercer_nombre,
+        r.referencia4_primer_apellido, r.referencia4_segundo_apellido, r.referencia4_telefono)
+) AS v (n, primer_nombre, segundo_nombre, tercer_nombre, primer_apellido, segundo_apellido, telefono)
+WHERE r.usuario_id IS NOT NULL
+  AND num_nonnulls(v.primer_nombre, v.segundo_nombre, v.tercer_nombre,
+                   v.primer_apellido, v.segundo_apellido, v.telefono) > 0
+ORDER BY r.referencia_id, v.n;
+
+-- El índice se crea después de copiar: construirlo una vez es más barato que
+-- mantenerlo fila por fila
+CREATE INDEX ix_referencias_usuario_id ON referencias (usuario_id);
+
+DROP TABLE referencias_anchas;
+
+ANALYZE referencias;
+
+COMMIT;
@@ -0,0 +1,59 @@
+-- 0007_busqueda_clientes.sql
+-- Índices de GET /usuarios/buscar (app/busqueda.py):
+--
+--   - trigramas (GIN, pg_trgm) sobre el nombre completo normalizado: búsquedas
+--     por fragmentos del nombre y con errores de escritura
+--   - prefijo (text_pattern_ops) sobre cui y codigo_cliente normalizados
+--
+-- Normalizado = minúsculas y sin tildes; las funciones son las mismas que crea
+-- models.py. pg_trgm viene en el paquete
+-- contrib de PostgreSQL y CREATE EXTENSION necesita permisos de dueño de la base.
+-- Si no se puede instalar la migración sigue sin el índice de trigramas, como
+-- create_all en models.py, y busqueda.py busca por nombre sin pg_trgm.
+--
+-- Los índices de prefijo se crean con CONCURRENTLY, fuera de transacción, para
+-- no bloquear las solicitudes mientras se construyen. El de trigramas depende
+-- de la extensión y se crea dentro de un bloque DO, donde no se admite
+-- CONCURRENTLY: bloquea las escrituras en usuarios mientras se construye. En
+-- tablas grandes se puede crear antes a mano con CONCURRENTLY (misma
+-- definición) y la migración lo deja como está.
+
+BEGIN;
+
+DO $$
+BEGIN
+    CREATE EXTENSION IF NOT EXISTS pg_trgm;
+EXCEPTION WHEN feature_not_supported OR undefined_file OR undefined_object OR insufficient_privilege THEN
+    RAISE NOTICE 'pg_trgm no disponible: la búsqueda por nombre no tendrá índice';
+END
+$$;
+
+CREATE OR REPLACE FUNCTION normalizar_busqueda(texto text) RETURNS text
+LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+    SELECT translate(lower(texto), 'áàäâéèëêíìïîóòöôúùüûñçÁÀÄÂÉÈËÊÍÌÏÎÓÒÖÔÚÙÜÛÑÇ', 'aaaaeeeeiiiioooouuuuncaaaaeeeeiiiioooouuuunc')
+$$;
+
+CREATE OR REPLACE FUNCTION usuarios_nombre_busqueda(
+    primer_nombre text, segundo_nombre text, tercer_nombre text,
+    primer_apellido text, segundo_apellido text, apellido_casada text
+) RETURNS text
+LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+    SELECT rtrim(translate(lower(coalesce(primer_nombre || ' ', '') || coalesce(segundo_nombre || ' ', '') || coalesce(tercer_nombre || ' ', '') || coalesce(primer_apellido || ' ', '') || coalesce(segundo_apellido || ' ', '') || coalesce(apellido_casada || ' ', '')), 'áàäâéèëêíìïîóòöôúùüûñçÁÀÄÂÉÈËÊÍÌÏÎÓÒÖÔÚÙÜÛÑÇ', 'aaaaeeeeiiiioooouuuuncaaaaeeeeiiiioooouuuunc'))
+$$;
+
+COMMIT;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_usuarios_cui_busqueda
+    ON usuarios (normalizar_busqueda(cui) text_pattern_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_usuarios_codigo_cliente_busqueda
+    ON usuarios (normalizar_busqueda(codigo_cliente) text_pattern_ops);
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm') THEN
+        CREATE INDEX IF NOT EXISTS ix_usuarios_nombre_trgm
+            ON usuarios USING gin (usuarios_nombre_busqueda(primer_nombre, segundo_nombre, tercer_nombre, primer_apellido, segundo_apellido, apellido_casada) gin_trgm_ops);
+    END IF;
+END
+$$;
+
+ANALYZE usuarios;
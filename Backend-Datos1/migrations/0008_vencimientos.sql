@@ -0,0 +1,40 @@
+-- 0008_vencimientos.sql
+-- Vencimiento de cuotas (app/vencimientos.py): avance de cada corrida, el
+-- estatus "En mora" para préstamos con saldo vencido y el índice parcial de
+-- cuotas vencidas por fecha que usa el reporte de morosidad.
+--
+-- Las cuotas que ya vencieron no se marcan aquí: la primera corrida lo hace
+-- por bloques sin bloquear pagos_futuros.
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS vencimientos_corridas (
+    corrida_id SERIAL NOT NULL PRIMARY KEY,
+    fecha_referencia DATE NOT NULL,
+    estado VARCHAR(20) DEFAULT 'en_curso' NOT NULL,
+    iniciada_en TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    actualizada_en TIMESTAMP WITHOUT TIME ZONE,
+    terminada_en TIMESTAMP WITHOUT TIME ZONE,
+    bloques INTEGER DEFAULT '0' NOT NULL,
+    cuotas_vencidas INTEGER DEFAULT '0' NOT NULL,
+    prestamos_actualizados INTEGER DEFAULT '0' NOT NULL,
+    cuotas_omitidas INTEGER,
+    hasta_fecha DATE,
+    duracion_ms FLOAT DEFAULT '0' NOT NULL,
+    bloque_max_ms FLOAT DEFAULT '0' NOT NULL
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS ix_vencimientos_corridas_en_curso
+    ON vencimientos_corridas (estado) WHERE estado = 'en_curso';
+
+-- Código 4 como en app/catalogos.py, o el siguiente libre si ya está ocupado
+INSERT INTO prestamo_estatus (estatus_id, descripcion)
+SELECT CASE WHEN EXISTS (SELECT 1 FROM prestamo_estatus WHERE estatus_id = 4)
+            THEN (SELECT max(estatus_id) + 1 FROM prestamo_estatus) ELSE 4 END,
+       'En mora'
+WHERE NOT EXISTS (SELECT 1 FROM prestamo_estatus WHERE lower(trim(descripcion)) = 'en mora');
+
+COMMIT;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_pagos_futuros_vencidos_fecha
+    ON pagos_futuros (fecha_pago) WHERE estado = 'vencido';
@@ -0,0 +1,25 @@
+-- 0009_auditoria_estados.sql
+-- Historial de cambios de estado de préstamos y pagos (app/auditoria.py). La
+-- tabla solo recibe inserciones por lotes (COPY); los índices sirven a
+-- GET /usuarios/auditoria por préstamo o pago y por usuario.
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS auditoria_estados (
+    auditoria_id BIGSERIAL NOT NULL PRIMARY KEY,
+    entidad VARCHAR(20) NOT NULL,
+    entidad_id INTEGER NOT NULL,
+    campo VARCHAR(30) NOT NULL,
+    valor_anterior VARCHAR(30),
+    valor_nuevo VARCHAR(30),
+    usuario VARCHAR(100),
+    origen VARCHAR(200),
+    registrado_en TIMESTAMP WITHOUT TIME ZONE NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS ix_auditoria_estados_entidad
+    ON auditoria_estados (entidad, entidad_id, auditoria_id);
+CREATE INDEX IF NOT EXISTS ix_auditoria_estados_usuario
+    ON auditoria_estados (usuario, auditoria_id);
+
+COMMIT;
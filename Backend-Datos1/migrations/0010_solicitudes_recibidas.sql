@@ -0,0 +1,24 @@
+-- 0010_solicitudes_recibidas.sql
+-- Cola de solicitudes de préstamo para SOLICITUDES_MODO=cola
+-- (app/recepcion.py). El índice parcial solo contiene las pendientes: los
+-- trabajadores las toman en orden y el control de admisión lee la más
+-- antigua sin recorrer la tabla.
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS solicitudes_recibidas (
+    solicitud_id BIGSERIAL NOT NULL PRIMARY KEY,
+    estado VARCHAR(20) DEFAULT 'pendiente' NOT NULL,
+    datos JSONB NOT NULL,
+    recibida_en TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    procesada_en TIMESTAMP WITHOUT TIME ZONE,
+    usuario_id INTEGER,
+    prestamo_id INTEGER,
+    codigo_prestamo VARCHAR(50),
+    error TEXT
+);
+
+CREATE INDEX IF NOT EXISTS ix_solicitudes_recibidas_pendientes
+    ON solicitudes_recibidas (solicitud_id) WHERE estado = 'pendiente';
+
+COMMIT;
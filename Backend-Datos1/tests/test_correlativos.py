@@ -0,0 +1,94 @@
+# test_correlativos.py
+# Correlativos de pagos (PAGO-n) únicos con registros concurrentes, tanto con
+# el DEFAULT de la secuencia como con AsignadorBloques (CORRELATIVO_BLOQUE).
+#
+# Necesita PostgreSQL: DATABASE_URL apuntando a una base con el esquema y al
+# menos un préstamo. Los pagos de prueba se borran al terminar.
+#
+#   cd Backend-Datos1
+#   DATABASE_URL=postgresql://... python -m pytest tests/test_correlativos.py
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from anyio.from_thread import start_blocking_portal
+
+if not os.getenv("DATABASE_URL"):
+    pytest.skip("DATABASE_URL no configurada", allow_module_level=True)
+
+from fastapi.testclient import TestClient
+from sqlalchemy import delete, select
+from sqlalchemy.exc import OperationalError
+
+from app import correlativos, database, models
+from app.main import app
+
+HILOS = 8
+PAGOS_POR_HILO = 25
+
+
+@pytest.fixture(scope="module")
+def cliente():
+    # Sin `with` no arranca el lifespan (programador, trabajadores). Un solo
+    # portal para todo el módulo: las peticiones corren en un mismo event loop,
+    # como en el servidor (en DB_MODO=async el pool de asyncpg es de ese loop)
+    cliente = TestClient(app)
+    with start_blocking_portal() as portal:
+        cliente.portal = portal
+        yield cliente
+
+
+@pytest.fixture
+def codigo_prestamo():
+    try:
+        with database.SessionLocal() as db:
+            codigo = db.execute(
+                select(models.Prestamos.codigo_prestamo).where(models.Prestamos.codigo_prestamo.isnot(None)).limit(1)
+            ).scalar()
+    except OperationalError as e:
+        pytest.skip(f"Sin conexión a la base de datos: {e}")
+    if codigo is None:
+        pytest.skip("La base de datos no tiene préstamos")
+    return codigo
+
+
+@pytest.fixture
+def prefijo():
+    prefijo = f"TEST-CORR-{uuid.uuid4().hex[:8]}-"
+    yield prefijo
+    with database.SessionLocal() as db:
+        db.execute(delete(models.PagosRealizados).where(models.PagosRealizados.codigo_transaccion.startswith(prefijo)))
+        db.commit()
+
+
+def _registrar_concurrente(cliente: TestClient, codigo_prestamo: str, prefijo: str) -> list:
+    inicio = threading.Barrier(HILOS)
+
+    def registrar(hilo: int):
+        inicio.wait()
+        for n in range(PAGOS_POR_HILO):
+            respuesta = cliente.post("/usuarios/pagos/comprobante-general", json={
+                "codigo_prestamo": codigo_prestamo, "codigo_transaccion": f"{prefijo}{hilo}-{n}", "monto_pagado": 1.0,
+            })
+            assert respuesta.status_code == 200, respuesta.text
+
+    with ThreadPoolExecutor(HILOS) as hilos:
+        list(hilos.map(registrar, range(HILOS)))
+    with database.SessionLocal() as db:
+        return db.execute(
+            select(models.PagosRealizados.pago_realizado_correlativo)
+            .where(models.PagosRealizados.codigo_transaccion.startswith(prefijo))
+        ).scalars().all()
+
+
+@pytest.mark.parametrize("bloque", [0, 7], ids=["secuencia", "bloques"])
+def test_correlativos_unicos_con_hilos(monkeypatch, cliente, codigo_prestamo, prefijo, bloque):
+    # Bloque pequeño para que los hilos recarguen a la vez varias veces
+    monkeypatch.setattr(correlativos, "asignador", correlativos.AsignadorBloques(bloque) if bloque else None)
+    asignados = _registrar_concurrente(cliente, codigo_prestamo, prefijo)
+    assert len(asignados) == HILOS * PAGOS_POR_HILO
+    assert None not in asignados
+    assert all(c.startswith("PAGO-") for c in asignados)
+    assert len(set(asignados)) == len(asignados)